@@ -0,0 +1,224 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The benchmark suite.
+
+This module times the main stages of the tool on synthetic Makefiles of
+growing size and records the peak memory they use. Run it with::
+
+    python -m benchmarks.run --sizes 2000 4000 8000 --check
+
+Each benchmark is run a few times and the median time is kept, which is
+steadier than the best time when the machine is busy (e.g. in CI). Each run
+starts with empty memos: they are bounded, so otherwise the repeated runs of
+the small inputs would be served from them while those of the large inputs
+would not. With ``--check``, the tool exits with an error if the time per
+rule of any benchmark grows too much with the size of the input, i.e. if its
+time is no longer linear in the input size.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks import synthetic
+from make_to_batch import cli, parser, shell
+from make_to_batch.filesystem import FileIndex
+from make_to_batch.makefile import Makefile
+from make_to_batch.translator import CommandTranslator, default_translator
+
+Benchmark = Callable[[str, List[str], str], None]
+
+
+def bench_parse(content: str, commands: List[str], directory: str) -> None:
+    """Parse a Makefile."""
+    Makefile().parse_file(content)
+
+
+def bench_to_batch(content: str, commands: List[str], directory: str) -> None:
+    """Parse a Makefile and convert it, with a translator that remembers
+    nothing from previous runs."""
+    makefile = Makefile(CommandTranslator())
+    makefile.parse_file(content)
+    makefile.to_batch()
+
+
+def bench_command_parser(content: str, commands: List[str], directory: str) -> None:
+    """Parse the commands of the recipes."""
+    for command in commands:
+        parser.Parser(command)
+
+
+def bench_shell_parser(content: str, commands: List[str], directory: str) -> None:
+    """Parse the commands of the recipes into syntax trees, without the memo."""
+    for command in commands:
+        shell.parse.__wrapped__(command)
+
+
+def bench_patterns(content: str, commands: List[str], directory: str) -> None:
+    """Convert a Makefile whose rules are instantiated from a pattern rule,
+    indexing the source tree from scratch."""
+    with open(os.path.join(directory, 'patterns.mk')) as f:
+        patterns = f.read()
+    makefile = Makefile(CommandTranslator(), files=FileIndex())
+    makefile.parse_file(patterns, directory)
+    makefile.to_batch()
+
+
+def bench_cli(content: str, commands: List[str], directory: str) -> None:
+    """Convert a Makefile with the command-line interface."""
+    cli.run(['-i', os.path.join(directory, 'Makefile'), '-o', os.path.join(directory, 'make.bat'), '--no-cache'])
+
+
+BENCHMARKS = {
+    'parse_file': bench_parse,
+    'to_batch': bench_to_batch,
+    'parser.Parser': bench_command_parser,
+    'shell.parse': bench_shell_parser,
+    'patterns': bench_patterns,
+    'cli.run': bench_cli,
+}  # type: Dict[str, Benchmark]
+"""The benchmarks, by name."""
+
+
+def measure(benchmark: Benchmark, content: str, commands: List[str], directory: str,
+            repeat: int) -> Tuple[float, int]:
+    """Run a benchmark.
+
+    Parameters
+    ----------
+    benchmark : Benchmark
+        The benchmark to be run.
+    content : str
+        The content of the Makefile.
+    commands : List[str]
+        The commands to be parsed.
+    directory : str
+        The directory containing the Makefile.
+    repeat : int
+        The number of times the benchmark is timed.
+
+    Returns
+    -------
+    Tuple[float, int]
+        The median time (in seconds) and the peak memory (in bytes) of the
+        benchmark.
+    """
+    times = []
+    for _ in range(repeat):
+        forget()
+        start = time.perf_counter()
+        benchmark(content, commands, directory)
+        times.append(time.perf_counter() - start)
+
+    # Tracing the allocations slows the code down, so it is done apart
+    forget()
+    tracemalloc.start()
+    try:
+        benchmark(content, commands, directory)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def forget() -> None:
+    """Empty the memos shared by the conversions of a process."""
+    shell.parse.cache_clear()
+    default_translator.cache_clear()
+
+
+def run(argv: Optional[List[str]] = None) -> Optional[int]:
+    """Run the benchmark suite.
+
+    Parameters
+    ----------
+    argv : Optional[List[str]]
+        The command line arguments. Defaults to the arguments of the process.
+
+    Returns
+    -------
+    Optional[int]
+        1 if ``--check`` is given and a benchmark does not scale linearly.
+    """
+    arguments = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.splitlines()[0])
+    arguments.add_argument('--sizes', type=int, nargs='+', default=[2000, 4000, 8000],
+                           help="the numbers of rules of the Makefiles")
+    arguments.add_argument('--prerequisites', type=int, default=3, help="the prerequisites of each rule")
+    arguments.add_argument('--recipe-length', type=int, default=3, help="the commands of each recipe")
+    arguments.add_argument('--continuation-depth', type=int, default=0,
+                           help="the continued lines each command is split into")
+    arguments.add_argument('--comment-density', type=float, default=0.1,
+                           help="the probability of a line being followed by a comment")
+    arguments.add_argument('--variables', type=int, default=10, help="the number of variables")
+    arguments.add_argument('--repeat', type=int, default=5, help="the number of times each benchmark is timed")
+    arguments.add_argument('--only', choices=sorted(BENCHMARKS), action='append',
+                           help="run only the given benchmarks")
+    arguments.add_argument('--check', action='store_true',
+                           help="fail if the time per rule grows more than the tolerance")
+    arguments.add_argument('--tolerance', type=float, default=2.0,
+                           help="the allowed growth of the time per rule between the smallest and the "
+                                "largest size. Defaults to 2")
+    args = arguments.parse_args(argv)
+
+    names = args.only or list(BENCHMARKS)
+    sizes = sorted(args.sizes)
+    results = {name: [] for name in names}  # type: Dict[str, List[Tuple[float, int]]]
+
+    print("{:<16}{:>10}{:>12}{:>14}{:>12}".format('benchmark', 'rules', 'time (ms)', 'us per rule', 'peak (KiB)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            content = synthetic.generate(size, args.prerequisites, args.recipe_length, args.continuation_depth,
+                                         args.comment_density, args.variables)
+            commands = synthetic.commands(size * args.recipe_length)
+            with open(os.path.join(directory, 'Makefile'), 'w') as f:
+                f.write(content)
+            if 'patterns' in names:
+                with open(os.path.join(directory, 'patterns.mk'), 'w') as f:
+                    f.write(synthetic.write_sources(directory, size))
+
+            for name in names:
+                elapsed, peak = measure(BENCHMARKS[name], content, commands, directory, args.repeat)
+                results[name].append((elapsed, peak))
+                print("{:<16}{:>10}{:>12.1f}{:>14.2f}{:>12}".format(
+                    name, size, elapsed * 1000, elapsed / size * 1000000, peak // 1024))
+
+    if not args.check or len(sizes) < 2:
+        return None
+
+    failed = False
+    for name in names:
+        growth = (results[name][-1][0] / sizes[-1]) / (results[name][0][0] / sizes[0])
+        if growth > args.tolerance:
+            failed = True
+            print("{}: the time per rule grew {:.2f} times from {} to {} rules.".format(
+                name, growth, sizes[0], sizes[-1]), file=sys.stderr)
+    return 1 if failed else None
+
+
+if __name__ == '__main__':
+    sys.exit(run())
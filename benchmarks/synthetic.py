@@ -0,0 +1,161 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The synthetic Makefile generator.
+
+This module generates Makefiles of any size, used to measure the performance
+of the tool. The generated Makefiles only depend on the parameters and on the
+seed, so the same benchmark always runs on the same input.
+"""
+
+import os
+import random
+from typing import List
+
+COMMANDS = [
+    'mkdir -p {out}',
+    'rm -f {out}/{name}.o',
+    'cp {name}.c {out}',
+    'ls -l {out}',
+    'cd {out} && $(MAKE) {name}',
+    '$(CC) $(CFLAGS) -c {name}.c -o {out}/{name}.o',
+    'echo building {name}',
+]
+"""The templates of the commands of the recipes."""
+
+
+def generate(rules: int = 1000, prerequisites: int = 3, recipe_length: int = 3,
+             continuation_depth: int = 0, comment_density: float = 0.1,
+             variables: int = 10, seed: int = 0) -> str:
+    """Generate a synthetic Makefile.
+
+    Parameters
+    ----------
+    rules : int
+        The number of rules.
+    prerequisites : int
+        The number of prerequisites of each rule. The prerequisites are
+        targets defined later in the Makefile, so the targets never depend on
+        each other in a cycle.
+    recipe_length : int
+        The number of commands of each recipe.
+    continuation_depth : int
+        The number of continued lines each command is split into (0 means
+        that commands are not split).
+    comment_density : float
+        The probability of a line being followed by a comment line.
+    variables : int
+        The number of variables. Each variable references the previous one.
+    seed : int
+        The seed of the random generator.
+
+    Returns
+    -------
+    str
+        The content of the Makefile.
+    """
+    generator = random.Random(seed)
+    lines = []  # type: List[str]
+
+    def comment() -> None:
+        if generator.random() < comment_density:
+            lines.append('# comment {}'.format(generator.randrange(1000000)))
+
+    for index in range(variables):
+        value = 'dir{}'.format(index) if index == 0 else '$(VAR{})/dir{}'.format(index - 1, index)
+        lines.append('VAR{} {} {}'.format(index, generator.choice(['=', ':=']), value))
+        comment()
+    lines.append('CC = gcc')
+    lines.append('CFLAGS = -O2 -Wall')
+    lines.append('.PHONY: target0')
+
+    out = '$(VAR{})'.format(variables - 1) if variables else 'build'
+    for index in range(rules):
+        name = 'target{}'.format(index)
+        later = range(index + 1, rules)
+        dependencies = generator.sample(later, min(prerequisites, len(later)))
+        lines.append('{}: {}'.format(name, ' '.join('target{}'.format(d) for d in dependencies)).rstrip())
+        comment()
+        for _ in range(recipe_length):
+            command = generator.choice(COMMANDS).format(out=out, name=name)
+            words = command.split(' ')
+            if continuation_depth and len(words) > 1:
+                # Split the command in (up to) continuation_depth + 1 lines
+                step = max(1, len(words) // (continuation_depth + 1))
+                pieces = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+                lines.append('\t' + ' \\\n\t\t'.join(pieces))
+            else:
+                lines.append('\t' + command)
+            comment()
+    return '\n'.join(lines) + '\n'
+
+
+def commands(count: int = 1000, seed: int = 0) -> List[str]:
+    """Generate synthetic commands.
+
+    Parameters
+    ----------
+    count : int
+        The number of commands.
+    seed : int
+        The seed of the random generator.
+
+    Returns
+    -------
+    List[str]
+        The commands.
+    """
+    generator = random.Random(seed)
+    return [generator.choice(COMMANDS).format(out='build', name='target{}'.format(index))
+            for index in range(count)]
+
+
+def write_sources(directory: str, count: int = 1000, directories: int = 100) -> str:
+    """Write a tree of empty source files and a Makefile building them with a
+    pattern rule.
+
+    Parameters
+    ----------
+    directory : str
+        The directory the files are written to.
+    count : int
+        The number of source files.
+    directories : int
+        The number of directories the source files are spread over.
+
+    Returns
+    -------
+    str
+        The content of the Makefile, whose wildcards and paths are relative to
+        the directory.
+    """
+    objects = []  # type: List[str]
+    for index in range(count):
+        path = os.path.join('src', 'dir{}'.format(index % directories), 'file{}'.format(index))
+        os.makedirs(os.path.join(directory, os.path.dirname(path)), exist_ok=True)
+        open(os.path.join(directory, path + '.c'), 'w').close()
+        objects.append(path.replace(os.sep, '/') + '.o')
+    return ('SRC = $(wildcard src/dir0/*.c)\n'
+            'all: {}\n'
+            '\tgcc -o $@ $^\n'
+            '%.o: %.c\n'
+            '\tgcc -c $< -o $@\n').format(' '.join(objects))
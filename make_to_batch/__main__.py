@@ -20,7 +20,9 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 #  SOFTWARE.
 
+import sys
+
 from make_to_batch.cli import run
 
 if __name__ == "__main__":
-    run()
+    sys.exit(run())
@@ -0,0 +1,261 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The conversion cache.
+
+This module contains an on-disk cache of converted batch files. Each batch
+file is stored under a key computed by hashing everything its content depends
+on: the content of the Makefile and its directory (which the included files
+are relative to), the version of the tool, the look-up tables and the
+conversion options. The files included by the Makefile are only known
+once it is parsed, so they are recorded in a manifest stored next to the
+batch file, together with the hashes of their contents. A batch file found in
+the cache whose included files are unchanged is therefore always valid and it
+can be copied in place instead of converting the Makefile again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterable, Sequence, Tuple
+
+import make_to_batch.look_up_table as look_up_table
+from make_to_batch import __version__
+from make_to_batch.filesystem import atomic_file
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+"""The default size (in bytes) of the cache."""
+
+
+def default_directory() -> str:
+    """Get the default directory of the cache.
+
+    Returns
+    -------
+    str
+        The directory ``make-to-batch`` inside ``$XDG_CACHE_HOME`` (or
+        ``~/.cache`` if it is not set).
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'make-to-batch')
+
+
+class ConversionCache:
+    """A content-addressed cache of batch files.
+
+    The least recently used batch files are evicted when the cache grows
+    larger than its maximum size.
+
+    Attributes
+    ----------
+    directory : str
+        The directory containing the cached batch files.
+    max_size : int
+        The maximum size (in bytes) of the cache.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        """Create a cache stored in a directory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory containing the cached batch files. It is created
+            when the first batch file is stored.
+        max_size : int
+            The maximum size (in bytes) of the cache.
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def key(input_path: str, options: Dict[str, Any], tables: Sequence[str] = (),
+            defines: Sequence[Tuple[str, str]] = ()) -> str:
+        """Compute the key of the conversion of a Makefile.
+
+        Parameters
+        ----------
+        input_path : str
+            The Makefile to be converted.
+        options : Dict[str, Any]
+            The options changing the content of the batch file.
+        tables : Sequence[str]
+            The files of the look-up tables merged with the built-in one.
+        defines : Sequence[Tuple[str, str]]
+            The variables defined when converting, overriding the Makefile.
+
+        Returns
+        -------
+        str
+            The key of the conversion.
+        """
+        digest = hashlib.sha256()
+        digest.update(__version__.encode())
+        digest.update(json.dumps(look_up_table.linux_to_dos, sort_keys=True).encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        if defines:
+            digest.update(json.dumps(sorted(dict(defines).items())).encode())
+        for table in tables:
+            _hash_file(table, digest)
+        # The same Makefile can include different files in another directory
+        digest.update(os.path.realpath(os.path.dirname(os.path.abspath(input_path))).encode())
+        _hash_file(input_path, digest)
+        return digest.hexdigest()
+
+    def __entry(self, key: str) -> str:
+        """Get the path of the cache entry of a key."""
+        return os.path.join(self.directory, key[:2], key + '.bat')
+
+    @staticmethod
+    def __manifest(entry: str) -> str:
+        """Get the path of the manifest of a cache entry."""
+        return entry[:-len('.bat')] + '.json'
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Copy a cached batch file in place.
+
+        Parameters
+        ----------
+        key : str
+            The key of the conversion.
+        output_path : str
+            The path of the batch file to be written.
+
+        Returns
+        -------
+        bool
+            True if the batch file was in the cache, False otherwise.
+        """
+        entry = self.__entry(key)
+        try:
+            with open(self.__manifest(entry), "r") as f:
+                dependencies = json.load(f)  # type: Dict[str, str]
+            for path, expected in dependencies.items():
+                if _hash_file(path, hashlib.sha256()).hexdigest() != expected:
+                    return False
+            _copy(entry, output_path)
+        except (FileNotFoundError, ValueError):
+            return False
+        # The modification time marks the last use of the entry
+        os.utime(entry)
+        return True
+
+    def store(self, key: str, output_path: str, dependencies: Iterable[str] = ()) -> None:
+        """Store a batch file in the cache.
+
+        Parameters
+        ----------
+        key : str
+            The key of the conversion.
+        output_path : str
+            The path of the batch file to be stored.
+        dependencies : Iterable[str]
+            The files included by the Makefile. The entry is only valid as
+            long as their contents do not change.
+        """
+        entry = self.__entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        manifest = {
+            os.path.abspath(path): _hash_file(path, hashlib.sha256()).hexdigest()
+            for path in dependencies
+        }
+        with atomic_file(self.__manifest(entry)) as f:
+            json.dump(manifest, f)
+        _copy(output_path, entry)
+
+    def evict(self) -> None:
+        """Remove the least recently used batch files until the cache is
+        smaller than its maximum size, and the batch files left without their
+        manifest.
+        """
+        entries = []
+        total = 0
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.bat'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                try:
+                    size = stat.st_size + os.path.getsize(self.__manifest(path))
+                except FileNotFoundError:
+                    # The manifest is written first and removed first, so an
+                    # entry without it (e.g. after an interrupted eviction)
+                    # is never used again
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                entries.append((stat.st_mtime, size, path))
+                total += size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            # The manifest goes first: an entry without it is never used
+            for name in (self.__manifest(path), path):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+def _hash_file(path: str, digest: Any) -> Any:
+    """Update a hash with the content of a file.
+
+    Parameters
+    ----------
+    path : str
+        The file to be hashed.
+    digest : hashlib._Hash
+        The hash to be updated.
+
+    Returns
+    -------
+    hashlib._Hash
+        The updated hash.
+    """
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest
+
+
+def _copy(source: str, destination: str) -> None:
+    """Copy a file, atomically replacing the destination.
+
+    Parameters
+    ----------
+    source : str
+        The file to be copied.
+    destination : str
+        The path of the copy.
+    """
+    with open(source, "rb") as original, atomic_file(destination, "wb") as copy:
+        shutil.copyfileobj(original, copy)
@@ -21,80 +21,629 @@
 #  SOFTWARE.
 
 import argparse
+import glob
+import json
 import os
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
-import colorama
-
+import make_to_batch.look_up_table as look_up_table
 from make_to_batch import __version__
+from make_to_batch.cache import ConversionCache, default_directory
+from make_to_batch.emitter import DISPATCH_MODES
 from make_to_batch.makefile import Makefile
+from make_to_batch.stats import Statistics
+from make_to_batch.translator import CommandTranslator
+
+MAKEFILE_NAMES = ('GNUmakefile', 'makefile', 'Makefile')
+"""The names of the files recognized as Makefiles when searching directories."""
+
+BATCH_NAME = 'make.bat'
+"""The name of the batch files created when converting many Makefiles."""
+
+_makefile = None  # type: Optional[Makefile]
+"""The Makefile reused by each conversion done in the current process."""
+
+_tables = []  # type: List[Tuple[str, int, int]]
+"""The signatures of the look-up tables used by the translator of the reused
+Makefile."""
+
+_colorama = None  # type: Any
+"""The colorama module, imported when the first error is printed."""
+
+
+def print_error(message: str) -> None:
+    """Print an error message in red.
+
+    colorama is imported (and initialized) only when the first error is
+    printed, so the conversions that succeed do not pay for it.
+
+    Parameters
+    ----------
+    message : str
+        The message.
+    """
+    global _colorama
+
+    if _colorama is None:
+        import colorama
+        colorama.init()
+        _colorama = colorama
+    print(_colorama.Fore.RED + message + _colorama.Style.RESET_ALL)
+
+
+def _split_targets(value: str) -> List[str]:
+    """Split a comma separated list of targets."""
+    targets = [target.strip() for target in value.split(',') if target.strip()]
+    if not targets:
+        raise argparse.ArgumentTypeError("no target given")
+    return targets
+
+
+def _split_define(value: str) -> Tuple[str, str]:
+    """Split the definition of a variable, given as ``VAR=value``."""
+    name, separator, definition = value.partition('=')
+    name = name.strip()
+    if not separator or not name or any(char in name for char in ' \t:#$()'):
+        raise argparse.ArgumentTypeError("invalid definition '{}': expected VAR=value".format(value))
+    return name, definition
 
 
-def setup_args():
+def setup_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     """Set the tool's arguments.
 
+    Parameters
+    ----------
+    argv : Optional[List[str]]
+        The command line arguments. Defaults to the arguments of the process.
+
     Returns
     -------
-    Dict[str, Any]
-        A dictionary containing all the arguments values. The keys are the
-        following:
-        * 'input': The name of the Makefile to be converted.
-        * 'output': The name of the output batch file.
-
-    Raises
-    ------
-    FileNotFoundError
-        If the Makefile provided via command line arguments does not exists.
+    argparse.Namespace
+        The arguments values. The attributes are the following:
+        * 'inputs': The Makefiles, directories or glob patterns to be
+          converted.
+        * 'output': The name of the output batch file, if given.
+        * 'out_dir': The directory where the batch files are written, if given.
+        * 'recursive': Whether directories are searched recursively.
+        * 'jobs': The number of processes used to convert the Makefiles.
+        * 'cache_dir': The directory of the conversion cache.
+        * 'no_cache': Whether the conversion cache is disabled.
+        * 'dispatch': How the batch files jump to the requested target.
+        * 'once': Whether each target is run at most once per build.
+        * 'subroutines': Whether prerequisites are run as subroutines.
+        * 'incremental': Whether up-to-date targets are skipped.
+        * 'parallel': The number of prerequisites the batch files run
+          concurrently.
+        * 'inline_variables': Whether constant variables are inlined in the
+          recipes.
+        * 'targets': The only targets converted (with the rules they need),
+          if given.
+        * 'define': The pairs of names and values of the variables defined
+          on the command line, overriding the Makefiles.
+        * 'shard': Whether each target is written to its own sub-script.
+        * 'share_recipes': Whether the recipes shared by many targets are
+          written once.
+        * 'stats': The format of the statistics to be printed ('text' or
+          'json'), if any.
+        * 'profile': The file the profile of the conversions is written to, if
+          given.
+        * 'table': The files of the look-up tables merged with the built-in
+          one.
+        * 'watch': The interval (in seconds) between the checks for changes to
+          the Makefiles, if they are watched.
     """
     parser = argparse.ArgumentParser(
         prog='make-to-batch',
-        description='Convert a Makefile to a Batch (Windows) file.'
+        description='Convert a Makefile to a Batch (Windows) file.',
+        epilog="Run 'make-to-batch serve -h' to convert Makefiles from a "
+               "long-lived process instead."
     )
     parser.add_argument(
         '-v', '--version',
         action='version',
         version='%(prog)s ' + str(__version__)
     )
+    parser.add_argument(
+        'inputs',
+        nargs='*',
+        metavar='INPUT',
+        help="other Makefiles, directories or glob patterns to be converted"
+    )
     parser.add_argument(
         '-i', '--input',
-        help="set the makefile to be converted. Defaults to './Makefile'",
-        default='./Makefile'
+        action='append',
+        default=[],
+        help="set the makefile to be converted. Defaults to './Makefile'"
     )
     parser.add_argument(
         '-o', '--output',
-        help="set the name of the output batch file. Defaults to './make.bat'",
-        default='./make.bat'
+        help="set the name of the output batch file. Defaults to './make.bat'"
+    )
+    parser.add_argument(
+        '-r', '--recursive',
+        action='store_true',
+        help="search the given directories recursively for Makefiles"
+    )
+    parser.add_argument(
+        '--out-dir',
+        help="write the batch files in this directory, mirroring the layout of "
+             "the inputs. Defaults to writing each batch file next to its Makefile"
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help="set the number of Makefiles converted in parallel. Defaults to 1"
+    )
+
+    parser.add_argument(
+        '--dispatch',
+        choices=DISPATCH_MODES,
+        default='if',
+        help="set how the batch file jumps to the requested target: with a "
+             "chain of IF statements or with a lookup and a single GOTO. "
+             "Defaults to 'if'"
+    )
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help="run each target at most once per build, even if many targets "
+             "depend on it"
+    )
+    parser.add_argument(
+        '--subroutines',
+        action='store_true',
+        help="run the prerequisites as subroutines of the same batch file "
+             "instead of invoking it again"
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help="skip the recipes of the targets that are newer than their "
+             "prerequisites"
+    )
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        default=1,
+        metavar='N',
+        help="let the batch file run up to N independent prerequisites of a "
+             "target concurrently. Defaults to 1"
+    )
+    parser.add_argument(
+        '--inline-variables',
+        action='store_true',
+        help="replace the references to the variables whose value is known "
+             "at conversion time with their value"
+    )
+    parser.add_argument(
+        '--targets',
+        type=_split_targets,
+        metavar='TARGET,...',
+        help="convert only the rules needed to make these targets, and set "
+             "only the variables their recipes reference"
+    )
+    parser.add_argument(
+        '-D', '--define',
+        action='append',
+        default=[],
+        type=_split_define,
+        metavar='VAR=value',
+        help="define a variable, overriding its assignments in the Makefile, "
+             "before evaluating the conditionals. Can be given many times"
+    )
+    parser.add_argument(
+        '--shard',
+        action='store_true',
+        help="write a small dispatcher and a sub-script for each target, in "
+             "the directory named as the batch file with the '.d' extension, "
+             "so that running a target does not slow down as the Makefile "
+             "grows"
+    )
+    parser.add_argument(
+        '--share-recipes',
+        action='store_true',
+        help="write the recipes shared by many targets (or differing only by "
+             "the name of the target) once, as subroutines the targets call"
+    )
+    parser.add_argument(
+        '--stats',
+        nargs='?',
+        const='text',
+        choices=('text', 'json'),
+        help="print the time spent in each phase of the conversion and other "
+             "statistics, as text (the default) or as JSON"
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='FILE',
+        help="profile the conversions (run in this process) and write the "
+             "profile to FILE, to be read with the pstats module"
+    )
+    parser.add_argument(
+        '--table',
+        action='append',
+        default=[],
+        metavar='FILE',
+        help="translate the commands also with the look-up table in FILE "
+             "(JSON, or TOML if its name ends with '.toml'). Can be given many "
+             "times: later tables take precedence"
+    )
+    parser.add_argument(
+        '--watch',
+        type=float,
+        nargs='?',
+        const=0.5,
+        metavar='SECONDS',
+        help="keep converting the Makefiles when they (or the files they "
+             "include) change, checking every SECONDS seconds. Defaults to 0.5"
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=default_directory(),
+        help="set the directory of the conversion cache. Defaults to "
+             "'$XDG_CACHE_HOME/make-to-batch'"
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="always convert the Makefiles, without using the conversion cache"
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    args.inputs = args.input + args.inputs or ['./Makefile']
 
-    if not os.path.exists(args.input):
-        raise FileNotFoundError("The Makefile '{}' does not exists.".format(args.input))
+    if args.jobs < 1 or args.parallel < 1:
+        parser.error("the number of jobs must be at least 1")
+    if args.watch is not None and args.watch <= 0:
+        parser.error("the interval between the checks must be positive")
+    if args.output is not None and args.out_dir is not None:
+        parser.error("the options -o/--output and --out-dir are mutually exclusive")
+    if args.shard and args.watch is not None:
+        parser.error("the options --shard and --watch are mutually exclusive")
+    if args.shard and args.parallel > 1:
+        parser.error("the option --shard does not support parallel prerequisites")
+    if args.shard and args.share_recipes:
+        parser.error("the options --shard and --share-recipes are mutually exclusive")
+    if args.shard and args.subroutines:
+        parser.error("the options --shard and --subroutines are mutually exclusive")
 
     return args
 
 
-def run():
+def find_makefiles(inputs: List[str], recursive: bool = False) -> Iterator[str]:
+    """Find the Makefiles to be converted.
+
+    Parameters
+    ----------
+    inputs : List[str]
+        The Makefiles, directories or glob patterns given by the user. A
+        directory stands for the Makefiles it contains.
+    recursive : bool
+        Whether directories are searched recursively.
+
+    Yields
+    ------
+    str
+        The path of a Makefile. Paths given explicitly are yielded even if
+        they do not exist, so that the error can be reported.
+    """
+    for path in inputs:
+        if any(char in path for char in '*?['):
+            matches = sorted(glob.glob(path, recursive=True))
+        else:
+            matches = [path]
+        for match in matches:
+            if not os.path.isdir(match):
+                yield match
+            elif recursive:
+                for directory, subdirectories, files in os.walk(match):
+                    subdirectories.sort()
+                    for name in MAKEFILE_NAMES:
+                        if name in files:
+                            yield os.path.join(directory, name)
+                            break
+            else:
+                for name in MAKEFILE_NAMES:
+                    if os.path.isfile(os.path.join(match, name)):
+                        yield os.path.join(match, name)
+                        break
+
+
+def plan_conversions(makefiles: List[str], out_dir: Optional[str]) -> List[Tuple[str, str]]:
+    """Choose the output path of each Makefile.
+
+    Parameters
+    ----------
+    makefiles : List[str]
+        The Makefiles to be converted.
+    out_dir : Optional[str]
+        The directory where the batch files are written. If None, each batch
+        file is written next to its Makefile.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        The pairs of input and output paths. If an output directory is given,
+        the layout of the Makefiles' directories (relative to their common
+        ancestor) is reproduced inside it.
+    """
+    directories = [os.path.dirname(os.path.abspath(makefile)) for makefile in makefiles]
+    if out_dir is None:
+        return [(makefile, os.path.join(directory, BATCH_NAME))
+                for makefile, directory in zip(makefiles, directories)]
+
+    base = os.path.commonpath(directories) if directories else ''
+    return [(makefile, os.path.normpath(os.path.join(out_dir, os.path.relpath(directory, base), BATCH_NAME)))
+            for makefile, directory in zip(makefiles, directories)]
+
+
+def convert(input_path: str, output_path: str, options: Dict[str, Any],
+            cache: Optional[ConversionCache] = None, stats: Optional[Statistics] = None,
+            tables: Sequence[str] = (), shard: bool = False,
+            defines: Sequence[Tuple[str, str]] = ()) -> None:
+    """Convert a Makefile to a batch file.
+
+    The same Makefile object is reused by all the conversions done by a
+    process.
+
+    Parameters
+    ----------
+    input_path : str
+        The Makefile to be converted.
+    output_path : str
+        The batch file to be written.
+    options : Dict[str, Any]
+        The options changing the content of the batch file.
+    cache : Optional[ConversionCache]
+        The conversion cache. If the batch file is in the cache, it is copied
+        in place without converting the Makefile.
+    stats : Optional[Statistics]
+        The statistics updated by the conversion, if any.
+    tables : Sequence[str]
+        The files of the look-up tables merged with the built-in one. Their
+        compiled form is cached in the directory of the conversion cache.
+    shard : bool
+        Whether the batch file is a dispatcher running a sub-script for each
+        target (see ``Makefile.save_shards``). The sharded batch files are
+        not cached.
+    defines : Sequence[Tuple[str, str]]
+        The names and the values of the variables defined when converting,
+        overriding the Makefile.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the Makefile does not exists.
+    ValueError
+        If a look-up table is not valid.
+    """
+    global _makefile, _tables
+
+    if not os.path.isfile(input_path):
+        raise FileNotFoundError("The Makefile '{}' does not exists.".format(input_path))
+
+    # Create the output directories
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+    key = None
+    if cache is not None and not shard:
+        key = cache.key(input_path, options, tables, defines)
+        if cache.fetch(key, output_path):
+            if stats is not None:
+                stats.count('cache hits')
+            return
+
+    signatures = look_up_table.signatures(tables)
+    if _makefile is None or signatures != _tables:
+        _makefile = Makefile(_translator(tables, cache))
+        _tables = signatures
+    else:
+        _makefile.clear()
+    _makefile.stats = stats
+    _makefile.overrides = dict(defines)
+
+    # Read the Makefile, one line at a time
+    with open(input_path, "r") as f:
+        _makefile.parse_stream(f, os.path.dirname(input_path) or '.')
+
+    if shard:
+        _makefile.save_shards(output_path, **options)
+        return
+
+    # Create and write the output file, one chunk at a time
+    _makefile.save_batch(output_path, **options)
+
+    # The batch file can not be cached if it depends on which files exist
+    if cache is not None and key is not None and not _makefile.depends_on_files:
+        cache.store(key, output_path, _makefile.included)
+
+
+def _translator(tables: Sequence[str], cache: Optional[ConversionCache] = None) -> Optional[CommandTranslator]:
+    """Create a translator using look-up tables, whose compiled form is cached
+    in the directory of the conversion cache (if any). None if no table is
+    given, i.e. if the default translator is enough."""
+    if not tables:
+        return None
+    return CommandTranslator(compiled=look_up_table.load_tables(
+        tables, cache.directory if cache is not None else None))
+
+
+def _convert_job(input_path: str, output_path: str, options: Dict[str, Any], cache: Optional[ConversionCache],
+                 collect_stats: bool = False, tables: Sequence[str] = (),
+                 shard: bool = False,
+                 defines: Sequence[Tuple[str, str]] = ()) -> Tuple[Optional[str], Optional[Statistics]]:
+    """Convert a Makefile, returning the error instead of raising it, and the
+    statistics of the conversion if they are collected."""
+    stats = Statistics() if collect_stats else None
+    try:
+        convert(input_path, output_path, options, cache, stats, tables, shard, defines)
+    except Exception as e:
+        return str(e) or type(e).__name__, stats
+    return None, stats
+
+
+def watch(conversions: List[Tuple[str, str]], options: Dict[str, Any], interval: float,
+          max_rounds: Optional[int] = None, translator: Optional[CommandTranslator] = None,
+          defines: Sequence[Tuple[str, str]] = ()) -> None:
+    """Keep the batch files up to date while the Makefiles change.
+
+    Only the changed rules of a Makefile are converted again, when possible.
+    The errors are printed and the Makefile is converted again at its next
+    change.
+
+    Parameters
+    ----------
+    conversions : List[Tuple[str, str]]
+        The pairs of input and output paths.
+    options : Dict[str, Any]
+        The options changing the content of the batch files.
+    interval : float
+        The seconds between the checks for changes.
+    max_rounds : Optional[int]
+        The number of checks after which the function returns. If None, it
+        returns only when interrupted (e.g. with Ctrl+C).
+    translator : Optional[CommandTranslator]
+        The translator of the commands. Defaults to the default translator.
+    defines : Sequence[Tuple[str, str]]
+        The names and the values of the variables defined when converting,
+        overriding the Makefiles.
+    """
+    from make_to_batch.watch import Watcher
+
+    watchers = []  # type: List[Watcher]
+    for input_path, output_path in conversions:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        watchers.append(Watcher(input_path, output_path, options, translator, dict(defines)))
+
+    rounds = 0
+    try:
+        while max_rounds is None or rounds < max_rounds:
+            if rounds:
+                time.sleep(interval)
+            rounds += 1
+            for watcher in watchers:
+                if not watcher.changed():
+                    continue
+                start = time.perf_counter()
+                try:
+                    kind = watcher.update()
+                except Exception as e:
+                    print_error("ERROR: {}: {}".format(watcher.input_path, str(e) or type(e).__name__))
+                    continue
+                if kind is not None:
+                    print("{} -> {} ({} update, {:.1f} ms)".format(
+                        watcher.input_path, watcher.output_path, kind, (time.perf_counter() - start) * 1000))
+    except KeyboardInterrupt:
+        pass
+
+
+def run(argv: Optional[List[str]] = None) -> Optional[int]:
     """The main function.
 
-    Run the tool.
+    Run the tool. If the first argument is ``serve``, run the conversion
+    server instead (see ``make_to_batch.serve``).
+
+    Parameters
+    ----------
+    argv : Optional[List[str]]
+        The command line arguments. Defaults to the arguments of the process.
+
+    Returns
+    -------
+    Optional[int]
+        The exit status of the tool: 1 if any conversion failed.
     """
-    colorama.init()
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['serve']:
+        from make_to_batch import serve
+        return serve.run(argv[1:])
+
+    args = setup_args(argv)
+    makefiles = list(find_makefiles(args.inputs, args.recursive))
+
+    if len(makefiles) == 1 and args.out_dir is None and not os.path.isdir(args.inputs[0]):
+        conversions = [(makefiles[0], args.output or './make.bat')]
+    elif args.output is not None:
+        print_error("ERROR: -o/--output requires a single Makefile.")
+        return 1
+    else:
+        conversions = plan_conversions(makefiles, args.out_dir)
+
+    if not conversions:
+        print_error("ERROR: No Makefile found.")
+        return 1
+
+    # The options changing the content of the batch files
+    options = {
+        'dispatch': args.dispatch,
+        'once': args.once,
+        'subroutines': args.subroutines,
+        'incremental': args.incremental,
+        'jobs': args.parallel,
+        'inline_variables': args.inline_variables,
+        'targets': args.targets,
+        'share_recipes': args.share_recipes,
+    }  # type: Dict[str, Any]
+    cache = None if args.no_cache else ConversionCache(args.cache_dir)
 
+    # The tables are loaded once here, to report their errors only once and
+    # to have their compiled form cached for the other processes
     try:
-        args = setup_args()
-    except FileNotFoundError as e:
-        print(colorama.Fore.RED + "ERROR: " + str(e) + colorama.Style.RESET_ALL)
-        return
+        translator = _translator(args.table, cache)
+    except (OSError, ValueError) as e:
+        print_error("ERROR: " + str(e))
+        return 1
 
-    makefile = Makefile()
+    if args.watch is not None:
+        watch(conversions, options, args.watch, translator=translator, defines=args.define)
+        return None
 
-    # Read the content of the Makefile
-    with open(args.input, "r") as f:
-        makefile.parse_file(f.read())
+    collect_stats = args.stats is not None
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    # Create the output directories
-    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    if args.jobs == 1 or len(conversions) == 1 or profiler is not None:
+        results = [_convert_job(input_path, output_path, options, cache, collect_stats, args.table, args.shard,
+                                args.define)
+                   for input_path, output_path in conversions]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(_convert_job, input_path, output_path, options, cache, collect_stats,
+                                       args.table, args.shard, args.define)
+                       for input_path, output_path in conversions]
+            results = [future.result() for future in futures]
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    if cache is not None:
+        cache.evict()
+
+    if collect_stats:
+        stats = Statistics()
+        for _, job_stats in results:
+            if job_stats is not None:
+                stats.merge(job_stats)
+        print(json.dumps(stats.to_dict(), indent=2) if args.stats == 'json' else stats.format())
+
+    failed = 0
+    for (input_path, _), (error, _) in zip(conversions, results):
+        if error is not None:
+            failed += 1
+            if len(conversions) > 1:
+                error = "{}: {}".format(input_path, error)
+            print_error("ERROR: " + error)
 
-    # Create and write the output file
-    with open(args.output, "w") as f:
-        f.write(makefile.to_batch())
+    if failed and len(conversions) > 1:
+        print_error("{} of {} Makefiles could not be converted.".format(failed, len(conversions)))
+    return 1 if failed else None
@@ -0,0 +1,380 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+"""The conditionals module.
+
+This module evaluates the conditional directives of the Makefiles (``ifeq``,
+``ifneq``, ``ifdef`` and ``ifndef``, with their ``else`` and ``endif``) while
+they are parsed, as GNU make does: with the values the variables have at that
+point. Only the branches whose condition holds are kept.
+
+A condition referencing variables that are not defined in the Makefile (e.g.
+``$(OS)``) depends on the environment of the build, so it can not be
+evaluated at conversion time. Such a condition is lowered to the condition of
+a batch ``IF`` statement, which guards the commands and the assignments in its
+branches. The references to functions that can not be called at conversion
+time (e.g. ``$(shell ...)``) are taken as empty, as are the automatic
+variables.
+"""
+
+import re
+from typing import Sequence, Tuple, Union
+
+from make_to_batch.variables import VariableTable, references
+
+Condition = Union[bool, str]
+"""A condition: its value, if known at conversion time, otherwise the
+condition of a batch ``IF`` statement."""
+
+Guard = Tuple[str, ...]
+"""The conditions of the batch ``IF`` statements guarding a line."""
+
+KEYWORDS = frozenset(['ifeq', 'ifneq', 'ifdef', 'ifndef'])
+"""The directives starting a conditional."""
+
+GUARD_END = '\x1f'
+"""The character ending the guard of a command of a recipe, which the
+commands never contain."""
+
+_name_pattern = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_quoted_pattern = re.compile(r"""^(["'])(.*?)\1\s+(["'])(.*?)\3$""")
+
+
+def negate(condition: str) -> str:
+    """Negate the condition of a batch ``IF`` statement.
+
+    Parameters
+    ----------
+    condition : str
+        The condition.
+
+    Returns
+    -------
+    str
+        The negated condition.
+    """
+    return condition[4:] if condition.startswith('NOT ') else 'NOT ' + condition
+
+
+def guard_prefix(guard: Sequence[str]) -> str:
+    """Get the ``IF`` statements guarding a line.
+
+    Parameters
+    ----------
+    guard : Sequence[str]
+        The conditions guarding the line.
+
+    Returns
+    -------
+    str
+        The statements, to be prepended to the line.
+    """
+    return ''.join('IF ' + condition + ' ' for condition in guard)
+
+
+def guard_command(guard: Sequence[str], command: str) -> str:
+    """Attach a guard to a command of a recipe.
+
+    Parameters
+    ----------
+    guard : Sequence[str]
+        The conditions guarding the command.
+    command : str
+        The command, still to be translated.
+
+    Returns
+    -------
+    str
+        The command, preceded by its ``IF`` statements and by ``GUARD_END``
+        (or unchanged, if it is not guarded).
+    """
+    if not guard:
+        return command
+    return guard_prefix(guard) + GUARD_END + command
+
+
+def split_guard(command: str) -> Tuple[str, str]:
+    """Split a command of a recipe into its guard and the command itself.
+
+    Parameters
+    ----------
+    command : str
+        The command, as stored in the recipe.
+
+    Returns
+    -------
+    Tuple[str, str]
+        The ``IF`` statements guarding the command ('' if none) and the
+        command to be translated.
+    """
+    if GUARD_END not in command:
+        return '', command
+    prefix, _, command = command.partition(GUARD_END)
+    return prefix, command
+
+
+def split_arguments(argument: str) -> Tuple[str, str]:
+    """Split the argument of ``ifeq`` or ``ifneq`` into the two texts it
+    compares.
+
+    Parameters
+    ----------
+    argument : str
+        The argument: ``(a,b)``, or two quoted texts (e.g. ``"a" 'b'``).
+
+    Returns
+    -------
+    Tuple[str, str]
+        The texts compared, without the surrounding whitespace.
+
+    Raises
+    ------
+    ValueError
+        If the argument is not valid.
+    """
+    argument = argument.strip()
+    if argument.startswith('(') and argument.endswith(')'):
+        depth = 0
+        for index, char in enumerate(argument[1:-1], 1):
+            if char in '({':
+                depth += 1
+            elif char in ')}':
+                depth -= 1
+            elif char == ',' and depth == 0:
+                return argument[1:index].strip(), argument[index + 1:-1].strip()
+    match = _quoted_pattern.match(argument)
+    if match is None:
+        raise ValueError("Invalid conditional: '{}'.".format(argument))
+    return match.group(2), match.group(4)
+
+
+def _lower(text: str) -> Tuple[str, bool]:
+    """Convert the references left in an expanded text to their batch syntax.
+
+    Returns the text and whether it references variables of the environment.
+    The other references are dropped."""
+    if '$' not in text:
+        return text, False
+    parts = []
+    environment = False
+    last = 0
+    for start, end, content in references(text):
+        parts.append(text[last:start])
+        last = end
+        if content == '$':
+            parts.append('$')
+        elif _name_pattern.fullmatch(content):
+            parts.append('%' + content + '%')
+            environment = True
+    parts.append(text[last:])
+    return ''.join(parts), environment
+
+
+def evaluate(keyword: str, argument: str, variables: VariableTable) -> Condition:
+    """Evaluate the condition of a conditional directive.
+
+    Parameters
+    ----------
+    keyword : str
+        The directive: ``ifeq``, ``ifneq``, ``ifdef`` or ``ifndef``.
+    argument : str
+        The argument of the directive.
+    variables : VariableTable
+        The variables defined so far.
+
+    Returns
+    -------
+    Condition
+        Whether the condition holds or, if it depends on the environment, the
+        equivalent condition of a batch ``IF`` statement.
+
+    Raises
+    ------
+    ValueError
+        If the argument is not valid.
+    """
+    if keyword in ('ifdef', 'ifndef'):
+        name = variables.expand(argument.strip())[0]
+        condition = None  # type: Union[None, bool, str]
+        if name in variables:
+            condition = bool(variables.value(name))
+        elif _name_pattern.fullmatch(name):
+            condition = 'DEFINED ' + name
+        else:
+            condition = False
+    else:
+        # As in the values of the variables, the paths use backslashes
+        left, right = (variables.expand(text.replace('/', '\\'))[0] for text in split_arguments(argument))
+        left, left_environment = _lower(left)
+        right, right_environment = _lower(right)
+        if left_environment or right_environment:
+            condition = '"' + left + '"=="' + right + '"'
+        else:
+            condition = left == right
+
+    if keyword in ('ifneq', 'ifndef'):
+        return not condition if isinstance(condition, bool) else negate(condition)
+    return condition
+
+
+class _Conditional:
+    """A conditional directive, with the state of its current branch."""
+
+    __slots__ = ('line', 'live', 'guard', 'taken', 'negations', 'final')
+
+    def __init__(self, line: int):
+        self.line = line
+        # Whether the current branch is kept, and its guard
+        self.live = False
+        self.guard = ()  # type: Guard
+        # Whether a previous branch was taken at conversion time, the
+        # negations of the conditions of the previous branches lowered to
+        # batch, and whether the current branch is the final else
+        self.taken = False
+        self.negations = ()  # type: Guard
+        self.final = False
+
+    def branch(self, condition: Condition) -> None:
+        """Start a branch of the conditional."""
+        if self.taken or condition is False:
+            self.live = False
+            self.guard = ()
+        elif condition is True:
+            self.live = True
+            self.guard = self.negations
+            self.taken = True
+        else:
+            self.live = True
+            self.guard = self.negations + (condition,)
+            self.negations += (negate(condition),)
+
+
+class ConditionalStack:
+    """The conditional directives enclosing the current line of a Makefile.
+
+    Attributes
+    ----------
+    live : bool
+        Whether the current line is kept.
+    guard : Guard
+        The conditions guarding the current line at run time.
+    """
+
+    def __init__(self, guard: Guard = ()):
+        """Create a stack with no conditionals.
+
+        Parameters
+        ----------
+        guard : Guard
+            The conditions guarding all the lines (e.g. the ones guarding the
+            directive including the Makefile).
+        """
+        self.live = True
+        self.guard = guard
+        self.__outer = guard
+        # The enclosing conditionals, the innermost last
+        self.__conditionals = ()  # type: Tuple[_Conditional, ...]
+
+    def enter(self, condition: Condition, line: int) -> None:
+        """Start a conditional.
+
+        Parameters
+        ----------
+        condition : Condition
+            The condition of its first branch.
+        line : int
+            The line of the directive.
+        """
+        conditional = _Conditional(line)
+        conditional.branch(condition)
+        self.__conditionals += (conditional,)
+        self.__update()
+
+    def alternative(self, condition: Condition, line: int, final: bool) -> None:
+        """Start another branch of the current conditional (``else``).
+
+        Parameters
+        ----------
+        condition : Condition
+            The condition of the branch (True for a plain ``else``).
+        line : int
+            The line of the directive.
+        final : bool
+            Whether the branch is the plain ``else``, i.e. the last one.
+
+        Raises
+        ------
+        ValueError
+            If there is no conditional, or if its final branch already
+            started.
+        """
+        if not self.__conditionals or self.__conditionals[-1].final:
+            raise ValueError("Unexpected 'else' at line {}.".format(line))
+        conditional = self.__conditionals[-1]
+        conditional.final = final
+        conditional.branch(condition)
+        self.__update()
+
+    def leave(self, line: int) -> None:
+        """End the current conditional (``endif``).
+
+        Parameters
+        ----------
+        line : int
+            The line of the directive.
+
+        Raises
+        ------
+        ValueError
+            If there is no conditional.
+        """
+        if not self.__conditionals:
+            raise ValueError("Unexpected 'endif' at line {}.".format(line))
+        self.__conditionals = self.__conditionals[:-1]
+        self.__update()
+
+    def close(self) -> None:
+        """Check that all the conditionals ended.
+
+        Raises
+        ------
+        ValueError
+            If a conditional has no ``endif``.
+        """
+        if self.__conditionals:
+            raise ValueError("Missing 'endif' of the conditional at line {}.".format(
+                self.__conditionals[-1].line))
+
+    @property
+    def enclosing_live(self) -> bool:
+        """Whether the lines enclosing the current conditional (if any) are
+        kept, i.e. whether the conditions of its branches are evaluated."""
+        return all(conditional.live for conditional in self.__conditionals[:-1])
+
+    def __update(self) -> None:
+        """Compute the state of the current line."""
+        self.live = all(conditional.live for conditional in self.__conditionals)
+        guard = self.__outer
+        for conditional in self.__conditionals:
+            guard += conditional.guard
+        self.guard = guard
@@ -0,0 +1,419 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The emitter module.
+
+This module contains the building blocks used to emit a batch file: the fixed
+snippets every batch file contains and a writer that collects the parts of
+the batch file and joins them in bulk.
+"""
+
+import re
+from typing import Iterable, Iterator, List, Optional
+
+HEADER = "@echo off\n\n"
+"""The first lines of every batch file."""
+
+ERROR_LABEL = ''':error
+    IF "%1"=="" (
+        ECHO make: *** No targets specified and no makefile found.  Stop.
+    ) ELSE (
+        ECHO make: *** No rule to make target '%1%'. Stop.
+    )
+    GOTO :EOF
+'''
+"""The label reached when the requested target does not exist."""
+
+
+DISPATCH_MODES = ('if', 'goto')
+"""The ways a batch file can dispatch the requested target to its label.
+
+* ``if``: a chain of ``IF`` statements, one for each target.
+* ``goto``: a lookup of the target in a precomputed list of targets followed
+  by a single ``GOTO``.
+"""
+
+LOOKUP_CHUNK_SIZE = 3500
+"""The maximum length of each list of targets used by the ``goto`` dispatch.
+
+The lists are kept short enough that the expanded lines that use them stay
+below the maximum length of a command line.
+"""
+
+
+def if_dispatch(targets: Iterable[str], default: Optional[str]) -> Iterator[str]:
+    """Generate the lines dispatching the requested target with ``IF``
+    statements.
+
+    Parameters
+    ----------
+    targets : Iterable[str]
+        The targets of the Makefile.
+    default : Optional[str]
+        The target run when none is requested, if any.
+
+    Yields
+    ------
+    str
+        The lines of the dispatch.
+    """
+    for target in targets:
+        yield '''IF /I "%1"=="''' + target + '''" GOTO ''' + target + "\n"
+    if default is not None:
+        yield '''IF /I "%1"=="" GOTO ''' + default + "\n"
+    yield "GOTO error\n\n"
+
+
+def goto_dispatch(targets: Iterable[str], default: Optional[str]) -> Iterator[str]:
+    """Generate the lines dispatching the requested target with a computed
+    ``GOTO``.
+
+    The requested target is looked up in space-separated lists of the
+    targets, by removing it from the list and checking whether the list has
+    changed. Each list is checked with a single statement, so dispatching
+    takes a constant number of statements for any Makefile with fewer than a
+    few hundred targets.
+
+    Parameters
+    ----------
+    targets : Iterable[str]
+        The targets of the Makefile.
+    default : Optional[str]
+        The target run when none is requested, if any.
+
+    Yields
+    ------
+    str
+        The lines of the dispatch.
+    """
+    yield '''IF "%~1"=="" GOTO ''' + (default or 'error') + "\n"
+
+    chunks = []  # type: List[List[str]]
+    length = LOOKUP_CHUNK_SIZE
+    for target in targets:
+        if length + len(target) + 1 > LOOKUP_CHUNK_SIZE:
+            chunks.append([])
+            length = 1
+        chunks[-1].append(target)
+        length += len(target) + 1
+
+    for index, chunk in enumerate(chunks):
+        name = "_MTB_TARGETS_{}".format(index)
+        yield '''SET "''' + name + "= " + " ".join(chunk) + ''' "\n'''
+        yield '''CALL SET "_MTB_FOUND=%%''' + name + ''': %~1 =%%"\n'''
+        yield '''IF NOT "%_MTB_FOUND%"=="%''' + name + '''%" GOTO %~1\n'''
+    yield "GOTO error\n\n"
+
+
+SCOPE_HEADER = '''IF /I "%_MTB_BUILD%"=="%~f0" GOTO _mtb_start
+SETLOCAL
+SET "_MTB_BUILD=%~f0"
+FOR /F "delims==" %%V IN ('SET _MTB_DONE_ 2^>NUL') DO SET "%%V="
+'''
+"""The lines starting the environment of a build.
+
+Only the first invocation of the batch file starts a local environment, which
+the recursive invocations share and which is discarded when the build ends.
+The recursive invocations skip the lines up to ``SCOPE_START``, so the
+variables are set once per build.
+
+The build is marked with the full path of the batch file, so the batch file
+of another Makefile run by a recipe (e.g. ``cd sub && $(MAKE)``) starts its
+own build, forgetting the targets the enclosing build already ran.
+"""
+
+SCOPE_START = ":_mtb_start\n"
+"""The label ending the initialization of the environment of a build."""
+
+
+NEWER_SUBROUTINE = ''':_mtb_newer
+    REM Mark the target %1 as out of date if the file %2 is newer than it
+    FOR /F %%N IN ('XCOPY /D /L /Y "%~2" "%~1" 2^>NUL ^| FIND /C /V ""') DO IF %%N GTR 1 SET "_MTB_STALE=1"
+    GOTO :EOF
+
+'''
+"""The subroutine comparing the modification times of two files.
+
+``XCOPY /D /L`` lists the source file (followed by a summary line) only if it
+is newer than the destination, so counting the lines of its output tells
+whether the target is out of date.
+"""
+
+
+JOB_DISPATCH = '''IF "%~1"=="_mtb_job" GOTO _mtb_job
+'''
+"""The line dispatching the invocations of the batch file running a job."""
+
+JOB_SUBROUTINES = ''':_mtb_job
+    REM Run the target %3, then write its exit code to the file %2
+    CALL :%~3
+    >"%~2.tmp" ECHO %ERRORLEVEL%
+    MOVE /Y "%~2.tmp" "%~2" >NUL
+    GOTO :EOF
+
+:_mtb_wait
+    REM Wait for the jobs writing their exit code to the files given as arguments
+    FOR %%M IN (%*) DO IF NOT EXIST "%%~M" (
+        PING -n 2 127.0.0.1 >NUL
+        GOTO _mtb_wait
+    )
+    FOR %%M IN (%*) DO (
+        FOR /F "usebackq" %%E IN ("%%~M") DO IF NOT "%%E"=="0" SET "_MTB_FAILED=1"
+        DEL "%%~M"
+    )
+    GOTO :EOF
+
+'''
+"""The subroutines running targets concurrently.
+
+Each job is a new process running the batch file, which writes the exit code
+of its target to a file once done. The parent waits for all the files to
+exist and marks the build as failed if any job failed.
+"""
+
+
+def path(name: str) -> str:
+    """Convert the name of a file in a Makefile to a Windows path.
+
+    Parameters
+    ----------
+    name : str
+        The name of the file.
+
+    Returns
+    -------
+    str
+        The same name, using backslashes as separators.
+    """
+    return name.replace('/', '\\')
+
+
+_shard_component_pattern = re.compile(r"[A-Za-z0-9_+@-][A-Za-z0-9_.+@-]*")
+_reserved_names = frozenset(['CON', 'PRN', 'AUX', 'NUL'] + ['COM{}'.format(i) for i in range(1, 10)] +
+                            ['LPT{}'.format(i) for i in range(1, 10)])
+
+
+def shard_path(target: str) -> Optional[str]:
+    """Get the path of the sub-script running a target, in the sharded
+    layout.
+
+    Parameters
+    ----------
+    target : str
+        The target's name.
+
+    Returns
+    -------
+    Optional[str]
+        The path of the sub-script, relative to the directory of the
+        sub-scripts, with forward slashes as separators. None if the target's
+        name can not be used as a path on Windows: if it contains characters
+        other than letters, digits, ``_.+@-`` and slashes, if one of its
+        components ends with a dot or if it is a reserved device name.
+    """
+    for component in target.split('/'):
+        if (not _shard_component_pattern.fullmatch(component) or component.endswith('.') or
+                component.split('.', 1)[0].upper() in _reserved_names):
+            return None
+    return target + '.bat'
+
+
+def shard_dispatch(directory: str, default: Optional[str]) -> str:
+    """Get the lines dispatching the requested target to its sub-script, in
+    the sharded layout.
+
+    The sub-script is found with a single ``IF EXIST``, so dispatching takes
+    the same time for any number of targets. The targets without a
+    sub-script are dispatched by the lines that follow.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the sub-scripts, relative to the dispatcher.
+    default : Optional[str]
+        The target run when none is requested, if it has a sub-script.
+
+    Returns
+    -------
+    str
+        The lines of the dispatch. They set ``_MTB_SHARDS`` to the directory
+        of the sub-scripts and ``_MTB_MAKE`` to the dispatcher, which the
+        sub-scripts call.
+    """
+    lines = ['SET "_MTB_SHARDS=%~dp0' + path(directory) + '"\n', 'SET "_MTB_MAKE=%~f0"\n']
+    if default is not None:
+        lines.append('IF "%~1"=="" (\n    CALL "%_MTB_SHARDS%\\' + path(default) + '.bat"\n    GOTO :EOF\n)\n')
+    lines.append(SHARD_LOOKUP)
+    return ''.join(lines)
+
+
+SHARD_LOOKUP = r'''SET "_MTB_TARGET=%~1"
+IF DEFINED _MTB_TARGET SET "_MTB_TARGET=%_MTB_TARGET:/=\%"
+IF DEFINED _MTB_TARGET IF EXIST "%_MTB_SHARDS%\%_MTB_TARGET%.bat" (
+    CALL "%_MTB_SHARDS%\%_MTB_TARGET%.bat"
+    GOTO :EOF
+)
+'''
+"""The lines running the sub-script of the requested target, if it has one."""
+
+
+_argument_pattern = re.compile(r"[A-Za-z0-9_.+@/\\-]+")
+_argument_references = re.compile(r"%[~*0-9]")
+_argument_before = frozenset(' \t"\'<>|&(')
+_argument_after = frozenset(' \t"\'<>|&)')
+
+
+def recipe_label(index: int) -> str:
+    """Get the label of a recipe shared by many targets.
+
+    Parameters
+    ----------
+    index : int
+        The index of the recipe.
+
+    Returns
+    -------
+    str
+        The label of the subroutine running the recipe.
+    """
+    return "_mtb_recipe_{}".format(index)
+
+
+def parameterize(lines: Iterable[str], argument: str) -> Optional[List[str]]:
+    """Replace the occurrences of a word in some lines with the first argument
+    of the subroutine running them (``%~1``).
+
+    Only the whole words are replaced, i.e. the occurrences delimited by
+    blanks, quotes, redirections, pipes or parentheses.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        The lines.
+    argument : str
+        The word, which becomes the argument of the subroutine.
+
+    Returns
+    -------
+    Optional[List[str]]
+        The lines using the argument. None if the word can not be passed
+        safely as an argument (e.g. it contains ``%`` or ``=``), or if the
+        lines already reference the arguments of the batch file.
+    """
+    if not _argument_pattern.fullmatch(argument):
+        return None
+    length = len(argument)
+    parameterized = []  # type: List[str]
+    for line in lines:
+        if _argument_references.search(line):
+            return None
+        start = line.find(argument)
+        if start == -1:
+            parameterized.append(line)
+            continue
+        parts = []  # type: List[str]
+        end = 0
+        while start != -1:
+            stop = start + length
+            if ((start == 0 or line[start - 1] in _argument_before) and
+                    (stop == len(line) or line[stop] in _argument_after)):
+                parts.append(line[end:start])
+                parts.append("%~1")
+                end = stop
+                start = line.find(argument, stop)
+            else:
+                start = line.find(argument, start + 1)
+        parts.append(line[end:])
+        parameterized.append(''.join(parts))
+    return parameterized
+
+
+def marker_name(target: str) -> str:
+    """Get the name of the environment variable marking a target as run.
+
+    Parameters
+    ----------
+    target : str
+        The target's name.
+
+    Returns
+    -------
+    str
+        The name of the variable. The characters that are not letters, digits,
+        dots or dashes are escaped, so that different targets never share the
+        same variable.
+    """
+    return "_MTB_DONE_" + ''.join(
+        char if char.isalnum() or char in '.-' else '_{:X}_'.format(ord(char))
+        for char in target
+    )
+
+
+class BatchWriter:
+    """A buffer collecting the parts of a batch file.
+
+    The parts are appended to a list and are only joined when the buffer is
+    drained, so building a batch file takes time linear in its size.
+
+    Attributes
+    ----------
+    chunk_size : int
+        The number of parts after which the buffer is considered full.
+    """
+
+    def __init__(self, chunk_size: int = 8192):
+        """Create an empty writer.
+
+        Parameters
+        ----------
+        chunk_size : int
+            The number of parts after which the buffer is considered full.
+        """
+        self.chunk_size = chunk_size
+        self.__parts = []  # type: List[str]
+
+    def write(self, *parts: str) -> None:
+        """Append some parts to the buffer.
+
+        Parameters
+        ----------
+        *parts : str
+            The parts to be appended.
+        """
+        self.__parts.extend(parts)
+
+    @property
+    def full(self) -> bool:
+        """Whether the buffer should be drained."""
+        return len(self.__parts) >= self.chunk_size
+
+    def drain(self) -> str:
+        """Join the buffered parts and empty the buffer.
+
+        Returns
+        -------
+        str
+            The content of the buffer.
+        """
+        content = ''.join(self.__parts)
+        self.__parts = []
+        return content
@@ -0,0 +1,314 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The file index.
+
+This module contains an in-memory index of the files under a directory, used
+to expand the wildcards and to instantiate the pattern rules of the Makefiles
+at conversion time. The directory is scanned once, and the files of each
+subdirectory are grouped by suffix, so that the common patterns (e.g.
+``src/*.c``) are a dictionary look-up instead of a scan of the directory.
+
+The indexes are shared by all the Makefiles converted by a process. An index
+is built again only if the modification time of one of its directories
+changes, i.e. if a file was added to it, removed from it or renamed.
+Directories whose name starts with a dot are not indexed.
+
+The module also writes the files of the tool (the batch files, the cache
+entries and the compiled look-up tables) atomically.
+"""
+
+import contextlib
+import fnmatch
+import glob
+import os
+import re
+from collections import OrderedDict
+from typing import IO, Any, Dict, Iterator, List
+
+DEFAULT_MAX_TREES = 64
+"""The default number of directory trees remembered by an index."""
+
+_wildcard_pattern = re.compile(r"[*?[]")
+
+
+def is_pattern(path: str) -> bool:
+    """Check if a path contains wildcards.
+
+    Parameters
+    ----------
+    path : str
+        The path.
+
+    Returns
+    -------
+    bool
+        Whether the path contains ``*``, ``?`` or ``[``.
+    """
+    return _wildcard_pattern.search(path) is not None
+
+
+@contextlib.contextmanager
+def atomic_file(path: str, mode: str = "w") -> Iterator[IO[Any]]:
+    """Open a file to be written atomically.
+
+    The file is written aside and moved in place only once it is closed
+    without errors, so it is either the old or the new file, never a partial
+    one. If writing fails, the partial file is removed.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    mode : str
+        The mode the file is opened with: ``"w"`` or ``"wb"``.
+
+    Yields
+    ------
+    IO[Any]
+        The file to be written.
+    """
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary, mode) as f:
+            yield f
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _suffix(name: str) -> str:
+    """Get the suffix of a file name, including its dot (or '')."""
+    index = name.rfind('.')
+    return name[index:] if index > 0 else ''
+
+
+class DirectoryTree:
+    """The index of the files under a directory.
+
+    Attributes
+    ----------
+    root : str
+        The absolute path of the directory.
+    """
+
+    def __init__(self, root: str):
+        """Scan a directory.
+
+        Parameters
+        ----------
+        root : str
+            The directory.
+        """
+        self.root = os.path.abspath(root)
+        # For each directory (relative to the root, with forward slashes):
+        # the names of its files and subdirectories, by suffix
+        self.__directories = {}  # type: Dict[str, Dict[str, List[str]]]
+        self.__mtimes = {}  # type: Dict[str, int]
+        pending = ['']
+        while pending:
+            directory = pending.pop()
+            path = os.path.join(self.root, directory) if directory else self.root
+            try:
+                self.__mtimes[directory] = os.stat(path).st_mtime_ns
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            suffixes = {}  # type: Dict[str, List[str]]
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                suffix = _suffix(entry.name)
+                if suffix not in suffixes:
+                    suffixes[suffix] = [entry.name]
+                else:
+                    suffixes[suffix].append(entry.name)
+                # As in os.walk, the symbolic links to directories are not
+                # followed: they could loop, or index a tree twice
+                if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                    pending.append(directory + '/' + entry.name if directory else entry.name)
+            self.__directories[directory] = suffixes
+
+    def is_current(self) -> bool:
+        """Check if the index is up to date.
+
+        Returns
+        -------
+        bool
+            Whether the modification times of all the indexed directories are
+            unchanged.
+        """
+        for directory, mtime in self.__mtimes.items():
+            try:
+                if os.stat(os.path.join(self.root, directory)).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def exists(self, path: str) -> bool:
+        """Check if a file or a directory exists.
+
+        Parameters
+        ----------
+        path : str
+            The path, relative to the root.
+
+        Returns
+        -------
+        bool
+            Whether the path exists. Paths outside the root are looked up on
+            disk.
+        """
+        directory, _, name = path.rpartition('/')
+        names = self.__directories.get(directory)
+        if names is not None and name in names.get(_suffix(name), ()):
+            return True
+
+        # The path may need to be normalized first
+        path = os.path.normpath(path).replace('\\', '/')
+        if path == '.':
+            return True
+        if os.path.isabs(path) or path.startswith('../'):
+            return os.path.exists(os.path.join(self.root, path))
+        directory, name = path.rpartition('/')[::2]
+        names = self.__directories.get(directory)
+        return names is not None and name in names.get(_suffix(name), ())
+
+    def glob(self, pattern: str) -> List[str]:
+        """Find the files matching a pattern, as ``glob.glob`` does.
+
+        Parameters
+        ----------
+        pattern : str
+            The pattern, relative to the root. Its wildcards do not match the
+            names starting with a dot, unless the pattern starts with a dot.
+
+        Returns
+        -------
+        List[str]
+            The matching paths, sorted, as written in the pattern (e.g. with
+            the same leading ``./``). Patterns outside the root are looked up
+            on disk.
+        """
+        normalized = os.path.normpath(pattern).replace('\\', '/')
+        if os.path.isabs(normalized) or normalized.startswith('../'):
+            prefix = os.path.join(self.root, '')
+            return sorted(path[len(prefix):] if path.startswith(prefix) else path
+                          for path in glob.glob(os.path.join(self.root, pattern)))
+
+        prefix = './' if pattern.startswith('./') else ''
+        directory_pattern, name_pattern = normalized.rpartition('/')[::2]
+        if is_pattern(directory_pattern):
+            depth = directory_pattern.count('/')
+            directories = [directory for directory in self.__directories
+                           if directory and directory.count('/') == depth
+                           and fnmatch.fnmatchcase(directory, directory_pattern)]
+        else:
+            directories = [directory_pattern]
+
+        matches = []  # type: List[str]
+        for directory in directories:
+            names = self.__directories.get(directory)
+            if names is None:
+                continue
+            head = prefix + directory + '/' if directory else prefix
+            if not is_pattern(name_pattern):
+                if name_pattern in names.get(_suffix(name_pattern), ()):
+                    matches.append(head + name_pattern)
+                continue
+
+            suffix = _suffix(name_pattern)
+            if name_pattern == '*' + suffix and suffix and not is_pattern(suffix):
+                # The common case: all the files with a suffix
+                candidates = names.get(suffix, [])
+            else:
+                candidates = [name for group in names.values() for name in group]
+                candidates = fnmatch.filter(candidates, name_pattern)
+            hidden = name_pattern.startswith('.')
+            matches.extend(head + name for name in candidates if hidden or not name.startswith('.'))
+        return sorted(matches)
+
+
+class FileIndex:
+    """A cache of directory trees.
+
+    The least recently used trees are forgotten when the index holds more
+    than its maximum number of trees.
+
+    Attributes
+    ----------
+    max_trees : int
+        The maximum number of trees remembered.
+    hits : int
+        The number of times an up-to-date tree was found in the index.
+    misses : int
+        The number of times a directory was scanned.
+    """
+
+    def __init__(self, max_trees: int = DEFAULT_MAX_TREES):
+        """Create an empty index.
+
+        Parameters
+        ----------
+        max_trees : int
+            The maximum number of trees remembered.
+        """
+        self.max_trees = max_trees
+        self.hits = 0
+        self.misses = 0
+        self.__trees = OrderedDict()  # type: OrderedDict[str, DirectoryTree]
+
+    def tree(self, root: str) -> DirectoryTree:
+        """Get the index of the files under a directory.
+
+        Parameters
+        ----------
+        root : str
+            The directory.
+
+        Returns
+        -------
+        DirectoryTree
+            The index of the directory, scanned again if any of its
+            directories changed.
+        """
+        root = os.path.abspath(root)
+        tree = self.__trees.get(root)
+        if tree is not None and tree.is_current():
+            self.hits += 1
+        else:
+            self.misses += 1
+            tree = self.__trees[root] = DirectoryTree(root)
+        self.__trees.move_to_end(root)
+        while len(self.__trees) > self.max_trees:
+            self.__trees.popitem(last=False)
+        return tree
+
+    def clear(self) -> None:
+        """Forget all the trees and reset the statistics."""
+        self.__trees.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+default_file_index = FileIndex()
+"""The index shared by the Makefiles that are not given one."""
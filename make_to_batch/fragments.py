@@ -0,0 +1,115 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The fragment cache.
+
+This module contains an in-memory cache of the files included by Makefiles.
+Makefiles often include the same fragments (e.g. the definition of a
+toolchain), so each fragment is tokenized once and its tokens are reused by
+every Makefile including it. A fragment is tokenized again only if its
+modification time or its size change.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Tuple
+
+import make_to_batch.lexer as lexer
+
+DEFAULT_MAX_FRAGMENTS = 1024
+"""The default number of fragments remembered by a cache."""
+
+
+class FragmentCache:
+    """A cache of tokenized Makefile fragments.
+
+    The least recently used fragments are forgotten when the cache holds
+    more than its maximum number of fragments.
+
+    Attributes
+    ----------
+    max_fragments : int
+        The maximum number of fragments remembered.
+    hits : int
+        The number of times a fragment was found in the cache.
+    misses : int
+        The number of times a fragment was tokenized.
+    """
+
+    def __init__(self, max_fragments: int = DEFAULT_MAX_FRAGMENTS):
+        """Create an empty cache.
+
+        Parameters
+        ----------
+        max_fragments : int
+            The maximum number of fragments remembered.
+        """
+        self.max_fragments = max_fragments
+        self.hits = 0
+        self.misses = 0
+        # For each fragment: its modification time, its size and its tokens
+        self.__fragments = OrderedDict()  # type: OrderedDict[str, Tuple[int, int, Tuple[lexer.Token, ...]]]
+
+    def tokens(self, path: str) -> Tuple[lexer.Token, ...]:
+        """Get the tokens of a fragment.
+
+        Parameters
+        ----------
+        path : str
+            The path of the fragment.
+
+        Returns
+        -------
+        Tuple[lexer.Token, ...]
+            The tokens of the fragment.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the fragment does not exist.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.__fragments.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            self.hits += 1
+            self.__fragments.move_to_end(path)
+            return cached[2]
+
+        self.misses += 1
+        with open(path, "r") as f:
+            tokens = tuple(lexer.tokenize(f))
+        self.__fragments[path] = (stat.st_mtime_ns, stat.st_size, tokens)
+        self.__fragments.move_to_end(path)
+        while len(self.__fragments) > self.max_fragments:
+            self.__fragments.popitem(last=False)
+        return tokens
+
+    def clear(self) -> None:
+        """Forget all the fragments and reset the statistics."""
+        self.__fragments.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+default_fragment_cache = FragmentCache()
+"""The cache shared by the Makefiles that are not given one."""
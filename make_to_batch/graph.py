@@ -0,0 +1,173 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The dependency graph module.
+
+This module contains the algorithms working on the dependency graph of a
+Makefile. A dependency graph is a mapping from each target to the list of the
+targets it depends on.
+"""
+
+from typing import Dict, FrozenSet, List, Mapping, Optional, Sequence
+
+
+class CyclicDependencyError(Exception):
+    """Raised when the targets of a Makefile depend on each other.
+
+    Attributes
+    ----------
+    cycle : List[str]
+        The targets forming the cycle, the first one being repeated at the end.
+    """
+
+    def __init__(self, cycle: List[str]):
+        super().__init__("Circular dependency: {}.".format(' -> '.join(cycle)))
+        self.cycle = cycle
+
+
+def topological_order(graph: Mapping[str, Sequence[str]]) -> List[str]:
+    """Sort the targets of a dependency graph.
+
+    Parameters
+    ----------
+    graph : Mapping[str, Sequence[str]]
+        The dependency graph. Dependencies that are not keys of the graph are
+        ignored.
+
+    Returns
+    -------
+    List[str]
+        The targets, each one following all of its dependencies.
+
+    Raises
+    ------
+    CyclicDependencyError
+        If the graph contains a cycle.
+    """
+    # 1: being visited, 2: visited
+    state = {}  # type: Dict[str, int]
+    order = []  # type: List[str]
+    for root in graph:
+        if root in state:
+            continue
+        state[root] = 1
+        path = [root]
+        stack = [iter(graph[root])]
+        while stack:
+            for dependency in stack[-1]:
+                if dependency not in graph:
+                    continue
+                if state.get(dependency) == 1:
+                    raise CyclicDependencyError(path[path.index(dependency):] + [dependency])
+                if dependency not in state:
+                    state[dependency] = 1
+                    path.append(dependency)
+                    stack.append(iter(graph[dependency]))
+                    break
+            else:
+                stack.pop()
+                target = path.pop()
+                state[target] = 2
+                order.append(target)
+    return order
+
+
+def reachable(graph: Mapping[str, Sequence[str]], target: str,
+              memo: Optional[Dict[str, FrozenSet[str]]] = None) -> FrozenSet[str]:
+    """Get the targets reachable from a target.
+
+    Parameters
+    ----------
+    graph : Mapping[str, Sequence[str]]
+        The dependency graph. It must not contain cycles.
+    target : str
+        The starting target.
+    memo : Optional[Dict[str, FrozenSet[str]]]
+        The sets already computed, which is updated with the new ones. Sharing
+        it between calls avoids visiting the same targets again.
+
+    Returns
+    -------
+    FrozenSet[str]
+        The target itself and all the targets it depends on, directly or not.
+    """
+    if memo is None:
+        memo = {}
+    stack = [target]
+    while stack:
+        current = stack[-1]
+        if current in memo:
+            stack.pop()
+            continue
+        missing = [dependency for dependency in graph.get(current, ())
+                   if dependency not in memo and dependency != current]
+        if missing:
+            stack.extend(missing)
+            continue
+        stack.pop()
+        result = {current}
+        for dependency in graph.get(current, ()):
+            if dependency != current:
+                result.update(memo[dependency])
+        memo[current] = frozenset(result)
+    return memo[target]
+
+
+def independent_groups(graph: Mapping[str, Sequence[str]], targets: Sequence[str], size: int,
+                       memo: Optional[Dict[str, FrozenSet[str]]] = None) -> List[List[str]]:
+    """Split a list of targets into groups that can be run concurrently.
+
+    The targets of a group share no dependency (direct or not) and do not
+    depend on each other, so running them at the same time never runs the
+    same target twice. The order of the targets is kept: running the groups
+    one after another runs the targets in their original order.
+
+    Parameters
+    ----------
+    graph : Mapping[str, Sequence[str]]
+        The dependency graph. It must not contain cycles.
+    targets : Sequence[str]
+        The targets to be split.
+    size : int
+        The maximum number of targets of a group.
+    memo : Optional[Dict[str, FrozenSet[str]]]
+        The memo passed to ``reachable``.
+
+    Returns
+    -------
+    List[List[str]]
+        The groups of targets.
+    """
+    if memo is None:
+        memo = {}
+    groups = []  # type: List[List[str]]
+    # A group has at most size targets, so their closures are merged a few
+    # times at most
+    used = frozenset()  # type: FrozenSet[str]
+    for target in targets:
+        closure = reachable(graph, target, memo)
+        if not groups or len(groups[-1]) >= size or not used.isdisjoint(closure):
+            groups.append([])
+            used = frozenset()
+        groups[-1].append(target)
+        used |= closure
+    return groups
@@ -0,0 +1,328 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The lexer module.
+
+This module contains a single-pass, line-oriented lexer for Makefiles. The
+lexer reads the physical lines of a Makefile once, strips comments, folds
+continued lines and emits a stream of tokens. Each physical line is looked at
+only once and the only lookahead needed is the one required to fold a
+continued line (or a ``define`` block), so the time spent lexing is linear in
+the size of the input.
+
+The kinds of token emitted are the following:
+
+* ``VARIABLE``: a variable assignment. ``name`` is the variable's name,
+  ``operator`` is the assignment operator (``=``, ``:=``, ``::=``, ``?=``,
+  ``+=`` or ``!=``) and ``value`` is the assigned value.
+* ``RULE``: a rule's header. ``name`` contains the targets, ``operator`` is
+  either ``:`` or ``::`` and ``value`` contains the prerequisites.
+* ``RECIPE``: a command of the last rule's recipe, stored in ``value``.
+* ``DIRECTIVE``: a directive such as ``include`` or ``ifeq``. ``name`` is the
+  directive's keyword and ``value`` is its argument.
+"""
+
+import re
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+VARIABLE = 'variable'
+RULE = 'rule'
+RECIPE = 'recipe'
+DIRECTIVE = 'directive'
+
+Token = NamedTuple('Token', [
+    ('kind', str),
+    ('line', int),
+    ('name', str),
+    ('operator', str),
+    ('value', str),
+])
+
+DIRECTIVES = frozenset([
+    'include', '-include', 'sinclude',
+    'ifeq', 'ifneq', 'ifdef', 'ifndef', 'else', 'endif',
+    'export', 'unexport', 'override', 'vpath',
+])
+"""The keywords that start a directive line."""
+
+CONDITIONAL_DIRECTIVES = frozenset(['ifeq', 'ifneq', 'ifdef', 'ifndef', 'else', 'endif'])
+"""The directives that can appear inside a recipe without ending it."""
+
+_comment_pattern = re.compile(r'(?<!\\)#')
+_assignment_pattern = re.compile(r'^([^:#=\s]+)\s*(::=|:=|\?=|\+=|!=|=)\s*(.*?)\s*$')
+_define_pattern = re.compile(r'^define\s+([^:#=\s]+)\s*(::=|:=|\?=|\+=|!=|=)?\s*$')
+
+
+def _strip_comment(line: str) -> str:
+    """Remove the comment (if any) from a physical line.
+
+    Parameters
+    ----------
+    line : str
+        A physical line, without its line terminator.
+
+    Returns
+    -------
+    str
+        The line without the comment.
+    """
+    if '#' not in line:
+        return line
+    match = _comment_pattern.search(line)
+    return line[:match.start()] if match else line
+
+
+def _is_recipe_line(line: str) -> bool:
+    """Check if a logical line is indented as a recipe line."""
+    return line.startswith('\t') or line.startswith('    ')
+
+
+def _split_keyword(line: str) -> Tuple[str, str]:
+    """Split a stripped logical line into its first word and the rest."""
+    parts = line.split(None, 1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+def strip_comments(lines: Iterable[str]) -> Iterator[str]:
+    """Remove the line terminators and the comments from the physical lines
+    of a Makefile.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        The physical lines of a Makefile. The line terminators are optional.
+
+    Yields
+    ------
+    str
+        Each line, without its terminator and its comment.
+    """
+    for line in lines:
+        yield _strip_comment(line.rstrip('\r\n'))
+
+
+def fold_lines(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Fold the physical lines of a Makefile, already without comments, into
+    logical lines.
+
+    Each line ending with a backslash is joined to the following one with a
+    single space, dropping the whitespace around the line break.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        The physical lines of a Makefile, as yielded by ``strip_comments``.
+
+    Yields
+    ------
+    Tuple[int, str]
+        A pair containing the number of the first physical line and the
+        folded logical line.
+    """
+    pending = None  # type: Optional[List[str]]
+    start = 0
+    for number, line in enumerate(lines, 1):
+        stripped = line.rstrip()
+        continued = stripped.endswith('\\')
+        if continued:
+            line = stripped[:-1].rstrip()
+        if pending is None:
+            pending = [line]
+            start = number
+        else:
+            pending.append(line.lstrip())
+        if not continued:
+            yield start, ' '.join(pending)
+            pending = None
+    if pending is not None:
+        yield start, ' '.join(pending)
+
+
+def logical_lines(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Fold the physical lines of a Makefile into logical lines.
+
+    Comments are removed and each line ending with a backslash is joined to
+    the following one with a single space, dropping the whitespace around the
+    line break.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        The physical lines of a Makefile. The line terminators are optional.
+
+    Yields
+    ------
+    Tuple[int, str]
+        A pair containing the number of the first physical line and the
+        folded logical line.
+    """
+    return fold_lines(strip_comments(lines))
+
+
+def rule_starts(lines: Sequence[str], start: int = 0, end: Optional[int] = None) -> Tuple[List[int], bool]:
+    """Find the physical lines starting the headers of the rules.
+
+    The lexer is in the same state at the start of each rule, so the
+    Makefile can be split at these lines into blocks that are tokenized apart
+    (e.g. to tokenize again only the blocks that changed). A few rules may be
+    missed (e.g. the ones whose header is indented), which only makes the
+    blocks larger.
+
+    Parameters
+    ----------
+    lines : Sequence[str]
+        The physical lines of a Makefile, without their line terminators.
+    start : int
+        The first line to be scanned. It must start a logical line, outside a
+        ``define`` block.
+    end : Optional[int]
+        The line following the last line to be scanned. Defaults to the end
+        of the lines.
+
+    Returns
+    -------
+    Tuple[List[int], bool]
+        The indexes of the lines starting the rules, and whether the line
+        ``end`` starts a logical line outside a ``define`` block.
+    """
+    starts = []  # type: List[int]
+    in_define = False
+    continued = False
+    for index in range(start, len(lines) if end is None else end):
+        line = _strip_comment(lines[index]).rstrip()
+        was_continued = continued
+        continued = line.endswith('\\')
+        if was_continued or not line or line[0] in ' \t':
+            continue
+        if in_define:
+            in_define = line != 'endef'
+            continue
+
+        keyword, argument = _split_keyword(line)
+        if keyword in ('export', 'override') and argument:
+            if _assignment_pattern.match(argument) or _define_pattern.match(argument):
+                line = argument
+                keyword, argument = _split_keyword(line)
+        if _define_pattern.match(line):
+            in_define = True
+        elif ':' in line and keyword not in DIRECTIVES and not _assignment_pattern.match(line):
+            starts.append(index)
+    return starts, not (in_define or continued)
+
+
+def tokenize(lines: Iterable[str]) -> Iterator[Token]:
+    """Tokenize a Makefile in a single pass.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        The physical lines of a Makefile. Any iterable is accepted, so an open
+        file object can be tokenized without reading it all in memory.
+
+    Returns
+    -------
+    Iterator[Token]
+        The tokens of the Makefile, in the order they appear.
+    """
+    return tokenize_logical(logical_lines(lines))
+
+
+def tokenize_logical(lines: Iterable[Tuple[int, str]]) -> Iterator[Token]:
+    """Tokenize the logical lines of a Makefile.
+
+    Parameters
+    ----------
+    lines : Iterable[Tuple[int, str]]
+        The logical lines of a Makefile, as yielded by ``logical_lines``.
+
+    Yields
+    ------
+    Token
+        The tokens of the Makefile, in the order they appear.
+    """
+    in_recipe = False
+    define = None  # type: Optional[Token]
+    define_body = []  # type: List[str]
+
+    for number, line in lines:
+        if define is not None:
+            if line.strip() == 'endef':
+                yield define._replace(value='\n'.join(define_body))
+                define = None
+                define_body = []
+            else:
+                define_body.append(line)
+            continue
+
+        if in_recipe and _is_recipe_line(line):
+            command = line.strip()
+            if command:
+                yield Token(RECIPE, number, '', '', command)
+            continue
+
+        line = line.strip()
+        if not line:
+            continue
+
+        keyword, argument = _split_keyword(line)
+        if keyword in ('export', 'override') and argument:
+            # An assignment can be prefixed by one of these keywords
+            if _assignment_pattern.match(argument) or _define_pattern.match(argument):
+                line = argument
+                keyword, argument = _split_keyword(line)
+
+        match = _define_pattern.match(line)
+        if match:
+            in_recipe = False
+            define = Token(VARIABLE, number, match.group(1), match.group(2) or '=', '')
+            continue
+
+        match = _assignment_pattern.match(line)
+        if match:
+            in_recipe = False
+            yield Token(VARIABLE, number, match.group(1), match.group(2), match.group(3))
+            continue
+
+        if keyword in DIRECTIVES:
+            in_recipe = in_recipe and keyword in CONDITIONAL_DIRECTIVES
+            yield Token(DIRECTIVE, number, keyword, '', argument)
+            continue
+
+        targets, colon, prerequisites = line.partition(':')
+        if colon:
+            operator = ':'
+            if prerequisites.startswith(':'):
+                operator = '::'
+                prerequisites = prerequisites[1:]
+            prerequisites, semicolon, command = prerequisites.partition(';')
+            in_recipe = True
+            yield Token(RULE, number, targets.strip(), operator, prerequisites.strip())
+            command = command.strip()
+            if semicolon and command:
+                yield Token(RECIPE, number, '', '', command)
+            continue
+
+        # Anything else is not understood: it also ends the current recipe
+        in_recipe = False
+
+    if define is not None:
+        yield define._replace(value='\n'.join(define_body))
@@ -38,11 +38,49 @@ keys:
   Unix one.
 * ``options``: a dictionary containing, for each option of the Unix command,
   the corresponding option in Windows.
+
+A key can also be a Unix command followed by one of its options (e.g. ``rm
+-r``): its entry translates the commands having that option, which may need
+another Windows command (e.g. ``RMDIR`` instead of ``DEL``). Its options must
+also translate the option selecting it, usually to an empty string.
+
+More look-up tables with the same structure can be read from JSON or TOML
+files and merged with the built-in one. Before being used, the tables are
+compiled: each option is indexed by its name, and the single-letter options
+(e.g. ``-r``) are also indexed by their letter, so that combined flags (e.g.
+``-rf``) can be split. The compiled tables can be cached on disk, so that
+large tables are not read and compiled again by each invocation.
 """
-from typing import Dict
-from typing_extensions import TypedDict
+import json
+import marshal
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+if TYPE_CHECKING:
+    # typing_extensions is slow to import, and the type is only needed by the
+    # type checker
+    from typing_extensions import TypedDict
+
+    LookUpTableContent = TypedDict('LookUpTableContent', {'command': str, 'options': Dict[str, str]})
+else:
+    # At run time, the type is still importable by the users of the module
+    LookUpTableContent = Dict[str, Union[str, Dict[str, str]]]
+
+_recursive_rm = {
+    'command': 'RMDIR /S /Q',
+    'options': {
+        '--help': '/?',
+        '-f': '',
+        '-r': '',
+        '-R': '',
+        '--recursive': '',
+    },
+}  # type: LookUpTableContent
 
-LookUpTableContent = TypedDict('LookUpTableContent', {'command': str, 'options': Dict[str, str]})
+CompiledTable = Dict[str, Tuple[str, Dict[str, str], Dict[str, str]]]
+"""A compiled look-up table: for each program, the batch command, the
+translation of each option and the translation of each single-letter option,
+by letter."""
 
 linux_to_dos = {
     'mkdir': {
@@ -59,6 +97,10 @@ linux_to_dos = {
             '-f': '/F',
         },
     },
+    # DEL /S deletes the files of the subdirectories, but not the directories
+    'rm -r': _recursive_rm,
+    'rm -R': _recursive_rm,
+    'rm --recursive': _recursive_rm,
     'ls': {
         'command': 'DIR',
         'options': {
@@ -72,6 +114,254 @@ linux_to_dos = {
         'command': 'XCOPY /Y',
         'options': {
             '--help': '/?',
+            '-r': '/E /I',
+            '-R': '/E /I',
+            '--recursive': '/E /I',
         },
     },
 }  # type: Dict[str, LookUpTableContent]
+
+
+def read_table(path: str) -> Dict[str, 'LookUpTableContent']:
+    """Read a look-up table from a file.
+
+    Parameters
+    ----------
+    path : str
+        The file: a JSON file or, if its name ends with ``.toml``, a TOML
+        file. The ``options`` of a program may be left out.
+
+    Returns
+    -------
+    Dict[str, LookUpTableContent]
+        The look-up table.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a valid look-up table, or if it is a TOML file and
+        no TOML parser is available (Python 3.11 or the tomli package).
+    """
+    if path.endswith('.toml'):
+        try:
+            import tomllib  # type: ignore
+        except ImportError:
+            try:
+                import tomli as tomllib  # type: ignore
+            except ImportError:
+                raise ValueError("Reading '{}' requires Python 3.11 or the tomli package.".format(path))
+        with open(path, "rb") as binary:
+            try:
+                content = tomllib.load(binary)
+            except tomllib.TOMLDecodeError as e:
+                raise ValueError("'{}' is not a valid TOML file: {}".format(path, e))
+    else:
+        with open(path, "r") as f:
+            try:
+                content = json.load(f)
+            except ValueError as e:
+                raise ValueError("'{}' is not a valid JSON file: {}".format(path, e))
+
+    if not isinstance(content, dict):
+        raise ValueError("'{}' is not a look-up table.".format(path))
+    table = {}  # type: Dict[str, LookUpTableContent]
+    for program, entry in content.items():
+        options = entry.get('options', {}) if isinstance(entry, dict) else None
+        if (not isinstance(entry, dict) or not isinstance(entry.get('command'), str) or
+                not isinstance(options, dict) or
+                not all(isinstance(value, str) for value in options.values())):
+            raise ValueError("The entry of '{}' in '{}' must have a 'command' string and an 'options' object "
+                             "of strings.".format(program, path))
+        table[program] = {'command': entry['command'], 'options': dict(options)}
+    return table
+
+
+def merge_tables(tables: Iterable[Dict[str, 'LookUpTableContent']]) -> Dict[str, 'LookUpTableContent']:
+    """Merge look-up tables.
+
+    Parameters
+    ----------
+    tables : Iterable[Dict[str, LookUpTableContent]]
+        The tables, from the lowest to the highest priority.
+
+    Returns
+    -------
+    Dict[str, LookUpTableContent]
+        The merged table. The command of a program is taken from the last
+        table containing it, and its options are merged.
+    """
+    merged = {}  # type: Dict[str, LookUpTableContent]
+    for table in tables:
+        for program, content in table.items():
+            options = dict(merged[program]['options']) if program in merged else {}
+            options.update(content.get('options', {}))
+            merged[program] = {'command': content['command'], 'options': options}
+    return merged
+
+
+def compile_table(table: Dict[str, 'LookUpTableContent']) -> CompiledTable:
+    """Compile a look-up table.
+
+    Parameters
+    ----------
+    table : Dict[str, LookUpTableContent]
+        The look-up table.
+
+    Returns
+    -------
+    CompiledTable
+        The compiled table.
+    """
+    compiled = {}  # type: CompiledTable
+    for program, content in table.items():
+        options = dict(content.get('options', {}))
+        flags = {option[1]: translation for option, translation in options.items()
+                 if len(option) == 2 and option[0] == '-' and option[1] != '-'}
+        compiled[program] = (content['command'], options, flags)
+    return compiled
+
+
+def select_entry(program: str, options: List[str], table: CompiledTable) -> str:
+    """Select the entry of a compiled look-up table translating a command.
+
+    Parameters
+    ----------
+    program : str
+        The program of the command, which is in the table.
+    options : List[str]
+        The options of the command.
+    table : CompiledTable
+        The compiled look-up table.
+
+    Returns
+    -------
+    str
+        The key of the entry: the program followed by the first of its
+        options having an entry of its own (also as one of combined flags, if
+        that entry knows all of them), or else the program.
+    """
+    for option in options:
+        variant = program + ' ' + option
+        if variant in table:
+            return variant
+        if len(option) > 2 and option[0] == '-' and option[1] != '-':
+            for flag in option[1:]:
+                variant = program + ' -' + flag
+                entry = table.get(variant)
+                if entry is not None and all(letter in entry[2] for letter in option[1:]):
+                    return variant
+    return program
+
+
+def translate_option(option: str, options: Dict[str, str], flags: Dict[str, str]) -> str:
+    """Translate an option with a compiled look-up table.
+
+    Parameters
+    ----------
+    option : str
+        The option.
+    options : Dict[str, str]
+        The translation of each option of the program.
+    flags : Dict[str, str]
+        The translation of each single-letter option of the program, by
+        letter.
+
+    Returns
+    -------
+    str
+        The translated option. Combined flags (e.g. ``-rf``) are translated
+        flag by flag if all of them are known. Unknown options are returned
+        unchanged.
+    """
+    translation = options.get(option)
+    if translation is not None:
+        return translation
+    if len(option) > 2 and option[0] == '-' and option[1] != '-' and all(flag in flags for flag in option[1:]):
+        return ' '.join(flags[flag] for flag in option[1:] if flags[flag])
+    return option
+
+
+def signatures(paths: Sequence[str]) -> List[Tuple[str, int, int]]:
+    """Get the signatures of the files of look-up tables.
+
+    Parameters
+    ----------
+    paths : Sequence[str]
+        The files.
+
+    Returns
+    -------
+    List[Tuple[str, int, int]]
+        The absolute path, the modification time (in nanoseconds) and the
+        size of each file. The tables are unchanged as long as their
+        signatures are.
+
+    Raises
+    ------
+    OSError
+        If a file does not exist.
+    """
+    result = []
+    for path in paths:
+        stat = os.stat(path)
+        result.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+    return result
+
+
+def load_tables(paths: Sequence[str] = (), cache_directory: Optional[str] = None) -> CompiledTable:
+    """Merge the built-in look-up table with the tables read from files, and
+    compile them.
+
+    Parameters
+    ----------
+    paths : Sequence[str]
+        The files of the tables, from the lowest to the highest priority.
+    cache_directory : Optional[str]
+        The directory where the compiled tables are cached, if any. A
+        compiled table is used as long as the modification times and the
+        sizes of its files are unchanged.
+
+    Returns
+    -------
+    CompiledTable
+        The compiled table.
+
+    Raises
+    ------
+    ValueError
+        If a file is not a valid look-up table.
+    """
+    if not paths:
+        return compile_table(linux_to_dos)
+
+    current = signatures(paths)
+    cached = None
+    if cache_directory is not None:
+        import hashlib
+        from make_to_batch import __version__
+
+        # The built-in table is part of the key: it may change without the
+        # version changing (e.g. while it is developed)
+        key = hashlib.sha256(json.dumps([__version__, linux_to_dos, [path for path, _, _ in current]],
+                                        sort_keys=True).encode()).hexdigest()
+        cached = os.path.join(cache_directory, 'tables', key + '.marshal')
+        try:
+            with open(cached, "rb") as binary:
+                cached_signatures, compiled = marshal.loads(binary.read())
+            if cached_signatures == current:
+                return compiled
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    compiled = compile_table(merge_tables([linux_to_dos] + [read_table(path) for path in paths]))
+    if cached is not None:
+        from make_to_batch.filesystem import atomic_file
+
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            with atomic_file(cached, "wb") as binary:
+                binary.write(marshal.dumps((current, compiled)))
+        except OSError:
+            # The table is compiled again next time
+            pass
+    return compiled
@@ -26,11 +26,48 @@ This module contains a series of definition that are used to represent a
 Makefile.
 """
 
-from typing import List, Any
-import make_to_batch.look_up_table as look_up_table
-import make_to_batch.parser as parser
+import functools
+import glob
+import os
 import re
-import logging
+import time
+from collections import Counter
+from typing import (Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Match, Optional, Sequence, Set, TextIO,
+                    Tuple)
+import make_to_batch.conditionals as conditionals
+import make_to_batch.emitter as emitter
+import make_to_batch.graph as graph
+import make_to_batch.lexer as lexer
+from make_to_batch.filesystem import DirectoryTree, FileIndex, atomic_file, default_file_index, is_pattern
+from make_to_batch.fragments import FragmentCache, default_fragment_cache
+from make_to_batch.rules import PatternRule, RuleTable, instantiate, pattern_stem
+from make_to_batch.stats import Statistics
+from make_to_batch.translator import CommandTranslator, batch_references, default_translator
+from make_to_batch.variables import VariableTable, references
+
+_make_call_pattern = re.compile(r"CALL make\.bat ([^\s&|<>]+)(?=\s*(?:&&|$))")
+_directory_change_pattern = re.compile(r"(?:^|[\s&|(])(?:PUSHD|CD|CHDIR)(?=[\s/.\\]|$)", re.IGNORECASE)
+_make_reference_pattern = re.compile(r"\$[({]MAKE[)}]((?:[ \t]+[^\s&|;<>]+)*)")
+
+INCLUDE_DIRECTIVES = frozenset(['include', '-include', 'sinclude'])
+"""The directives including other files."""
+
+_token_phases = {lexer.VARIABLE: 'variables', lexer.RULE: 'rules', lexer.RECIPE: 'rules'}
+
+
+def _save(path: str, chunks: Iterable[str]) -> None:
+    """Write a file atomically, one chunk at a time.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    chunks : Iterable[str]
+        The chunks of the file's content.
+    """
+    with atomic_file(path) as f:
+        for chunk in chunks:
+            f.write(chunk)
 
 
 class Makefile:
@@ -41,84 +78,599 @@ class Makefile:
 
     Attributes
     ----------
-    __rules : Dict[str, Dict[List[str], List[str]]
+    __rules : RuleTable
         The rules of the Makefile.
-    __variables : Dict[str, Any]
+    __patterns : List[PatternRule]
+        The pattern rules of the Makefile, in the order they were defined.
+    __variables : VariableTable
         The variables of the Makefile.
+    __phony : Set[str]
+        The targets declared as phony, i.e. not corresponding to files.
+    __included : List[str]
+        The files included while parsing the Makefile.
+    stats : Optional[Statistics]
+        The statistics updated while parsing and converting the Makefile. If
+        None, no statistics are collected.
+    passthrough : Optional[Counter[str]]
+        The commands copied as they are while converting the Makefile, as
+        they have no batch equivalent, counted by program. If None, they are
+        not counted. Unlike the statistics, counting them does not measure
+        the time spent converting.
+    overrides : Dict[str, str]
+        The variables whose values are given when converting (as with
+        ``make VAR=value``), overriding their assignments in the Makefile.
     """
 
-    def __init__(self):
+    def __init__(self, translator: Optional[CommandTranslator] = None,
+                 fragments: Optional[FragmentCache] = None, stats: Optional[Statistics] = None,
+                 files: Optional[FileIndex] = None, reuse_sections: bool = False,
+                 overrides: Optional[Dict[str, str]] = None):
         """Create an empty Makefile
+
+        Parameters
+        ----------
+        translator : Optional[CommandTranslator]
+            The translator used to convert the recipes' commands. Defaults to
+            a translator shared by all the Makefiles.
+        fragments : Optional[FragmentCache]
+            The cache of the included files. Defaults to a cache shared by
+            all the Makefiles.
+        stats : Optional[Statistics]
+            The statistics updated while parsing and converting the Makefile.
+        files : Optional[FileIndex]
+            The index of the files matched by the wildcards and by the
+            pattern rules. Defaults to an index shared by all the Makefiles.
+        reuse_sections : bool
+            Whether the section of the batch file converting each rule is
+            kept, to be reused by the next conversion if the rule does not
+            change (e.g. when watching a Makefile). This trades memory for
+            speed.
+        overrides : Optional[Dict[str, str]]
+            The variables whose values are given when converting. They are
+            set before parsing, and the Makefile can not change them.
+        """
+        self.__rules = RuleTable()
+        self.__patterns = []  # type: List[PatternRule]
+        self.__variables = VariableTable({'wildcard': self.__wildcard})
+        self.__phony = set()  # type: Set[str]
+        self.__included = []  # type: List[str]
+        self.__translator = translator or default_translator
+        self.__fragments = fragments or default_fragment_cache
+        self.__files = files or default_file_index
+        # The directory the wildcards are relative to, and its index (only
+        # looked up when needed, once per parsing and per conversion)
+        self.__directory = '.'
+        self.__tree = None  # type: Optional[DirectoryTree]
+        self.__depends_on_files = False
+        self.__sections = {} if reuse_sections else None  # type: Optional[Dict[Tuple[str, Tuple[str, ...], str], str]]
+        self.__sections_context = None  # type: Optional[Tuple[Any, ...]]
+        # The variables assigned in the branches of the conditionals that
+        # depend on the environment, set in order at run time (each with the
+        # conditions guarding it), and whether the Makefile has conditionals
+        self.__runtime_variables = []  # type: List[Tuple[conditionals.Guard, str, str]]
+        self.__runtime_names = set()  # type: Set[str]
+        self.__conditional = False
+        self.stats = stats
+        self.passthrough = None  # type: Optional[Counter[str]]
+        self.overrides = dict(overrides or {})
+
+    def clear(self) -> None:
+        """Remove all the rules and the variables from the Makefile.
+        """
+        self.__rules.clear()
+        self.__patterns.clear()
+        self.__variables.clear()
+        self.__phony.clear()
+        self.__included.clear()
+        self.__tree = None
+        self.__depends_on_files = False
+        self.__runtime_variables.clear()
+        self.__runtime_names.clear()
+        self.__conditional = False
+
+    @property
+    def included(self) -> List[str]:
+        """The files included while parsing the Makefile, in the order they
+        were first included."""
+        return list(self.__included)
+
+    @property
+    def depends_on_files(self) -> bool:
+        """Whether the Makefile looked up the files on disk, to expand a
+        wildcard, to instantiate a pattern rule, to include the files matching
+        a pattern or to skip an optional included file that does not exist. If
+        so, the batch file also depends on which files exist."""
+        return self.__depends_on_files
+
+    def __file_tree(self) -> DirectoryTree:
+        """Get the index of the files under the directory of the Makefile."""
+        if self.__tree is None:
+            self.__tree = self.__files.tree(self.__directory)
+            self.__depends_on_files = True
+        return self.__tree
+
+    def __wildcard(self, argument: str) -> str:
+        """Expand the ``wildcard`` function.
+
+        Parameters
+        ----------
+        argument : str
+            The patterns, separated by spaces. As in the values of the
+            variables, the paths use backslashes.
+
+        Returns
+        -------
+        str
+            The existing files matching the patterns, separated by spaces.
         """
-        self.__rules = {}
-        self.__variables = {}
+        tree = self.__file_tree()
+        paths = []  # type: List[str]
+        for pattern in argument.replace('\\', '/').split():
+            if is_pattern(pattern):
+                paths.extend(tree.glob(pattern))
+            elif tree.exists(pattern):
+                paths.append(pattern)
+        return ' '.join(paths).replace('/', '\\')
 
-    def parse_file(self, file_content: str) -> None:
+    def parse_file(self, file_content: str, directory: str = '.') -> None:
         """Parse an existing Makefile.
 
         Parameters
         ----------
         file_content : str
             The content of an existing Makefile.
+        directory : str
+            The directory the included files are relative to.
         """
-        file_content = re.sub(r'''(?<!\\)\#.*?$''', '', file_content, flags=re.M) # Remove comments
-        file_content = re.sub(r'''\s*?\\\s*?\n\s*''', ' ', file_content) # Transform all the multiline commands to single-line
-        variable_pattern = re.compile(r'''^([^:#= ]*?) *?= *(?:\\?\n\s*|)("\s*?.*?\s*?"|.*?)$''', re.MULTILINE)
-        target_pattern = re.compile(r'''^(.*?):\s*?(.*?)\s*?\n((?:(?:\t| {4}).*?\n)*)''', re.MULTILINE)
-        matches = variable_pattern.findall(file_content)
+        self.parse_stream(file_content.splitlines(), directory)
 
-        for match in matches:
-            self.add_variable(match[0], re.sub(r'/', r'\\', match[1]))
+    def parse_stream(self, lines: Iterable[str], directory: str = '.') -> None:
+        """Parse an existing Makefile, one line at a time.
 
-        matches = target_pattern.findall(file_content)
-        for match in matches:
-            target_name = match[0]
-            if target_name == ".PHONY":
-                continue
-            prerequisites = match[1]
-            recipe = match[2]
-            self.add_rule(
-                target_name,
-                Makefile.__prerequisites_from_string(prerequisites),
-                Makefile.__recipe_from_string(recipe)
-            )
+        The lines are consumed lazily, so an open file object can be parsed
+        without reading it all in memory. If statistics are collected, each
+        phase of the parsing is instead run to completion before the next one,
+        to measure them apart.
+
+        Parameters
+        ----------
+        lines : Iterable[str]
+            The lines of an existing Makefile (e.g. an open file object).
+        directory : str
+            The directory the included files are relative to.
+
+        Raises
+        ------
+        FileNotFoundError
+            If a file included with ``include`` does not exist.
+        ValueError
+            If a file includes itself (eventually), or if a conditional is
+            not valid.
+        """
+        stats = self.stats
+        if stats is None:
+            self.parse_tokens(lexer.tokenize(lines), directory)
+            return
+
+        with stats.phase('read'):
+            lines = list(lines)
+        with stats.phase('strip comments'):
+            lines = list(lexer.strip_comments(lines))
+        with stats.phase('fold continuations'):
+            logical = list(lexer.fold_lines(lines))
+        with stats.phase('tokenize'):
+            tokens = list(lexer.tokenize_logical(logical))
+        stats.count('makefiles')
+        stats.count('lines', len(lines))
+        self.parse_tokens(Makefile.__measure_tokens(tokens, stats), directory)
+
+    def parse_tokens(self, tokens: Iterable[lexer.Token], directory: str = '.') -> None:
+        """Parse an existing Makefile, already tokenized.
+
+        Parameters
+        ----------
+        tokens : Iterable[lexer.Token]
+            The tokens of an existing Makefile, as produced by the lexer.
+        directory : str
+            The directory the included files are relative to.
+
+        Raises
+        ------
+        FileNotFoundError
+            If a file included with ``include`` does not exist.
+        ValueError
+            If a file includes itself (eventually), or if a conditional is
+            not valid.
+        """
+        self.__directory = directory
+        self.__tree = None
+        for name, value in self.overrides.items():
+            self.__variables.assign(name, '=', value.replace('/', '\\'))
+        self.__parse_tokens(tokens, directory, [])
+
+    def replace_rules(self, old_tokens: Sequence[lexer.Token], new_tokens: Sequence[lexer.Token],
+                      after: Optional[str] = None) -> bool:
+        """Replace the rules parsed from some tokens with the rules parsed
+        from other tokens, without parsing the whole Makefile again.
+
+        This is only possible if the tokens are rules and recipes, whose
+        targets are not defined by other rules and whose headers reference
+        no variables, no wildcards and no patterns. Otherwise, the Makefile
+        is left unchanged and must be parsed again.
+
+        Parameters
+        ----------
+        old_tokens : Sequence[lexer.Token]
+            The tokens of a part of the Makefile, as they were parsed.
+        new_tokens : Sequence[lexer.Token]
+            The tokens replacing them.
+        after : Optional[str]
+            The target of the last rule preceding the tokens. If None, the
+            tokens are at the start of the Makefile.
+
+        Returns
+        -------
+        bool
+            Whether the rules were replaced.
+        """
+        if self.__conditional:
+            # The tokens may be in a branch of a conditional
+            return False
+        old_targets = []  # type: List[str]
+        new_rules = []  # type: List[Tuple[str, List[str], List[str]]]
+        for tokens in (old_tokens, new_tokens):
+            for token in tokens:
+                if token.kind == lexer.RECIPE:
+                    if tokens is new_tokens and new_rules:
+                        new_rules[-1][2].append(token.value)
+                    continue
+                if (token.kind != lexer.RULE or token.name.startswith('.') or
+                        any(char in token.name + token.value for char in '%$') or
+                        is_pattern(token.name + token.value)):
+                    return False
+                if tokens is old_tokens:
+                    old_targets.append(token.name)
+                else:
+                    new_rules.append((token.name, self.__prerequisites_from_string(token.value), []))
+
+        new_targets = [target for target, _, _ in new_rules]
+        if (len(set(old_targets)) != len(old_targets) or len(set(new_targets)) != len(new_targets) or
+                any(target not in self.__rules for target in old_targets) or
+                any(target in self.__rules and target not in old_targets for target in new_targets) or
+                after in old_targets or (after is not None and after not in self.__rules)):
+            return False
+
+        for target in old_targets:
+            self.__rules.remove(target)
+        position = self.__rules.index(after) + 1 if after is not None else 0
+        for target, prerequisites, recipe in new_rules:
+            self.__rules.add(target, prerequisites, recipe, position)
+            position += 1
+        return True
 
     @staticmethod
-    def __prerequisites_from_string(string: str) -> List[str]:
+    def __measure_tokens(tokens: Iterable[lexer.Token], stats: Statistics) -> Iterator[lexer.Token]:
+        """Measure the time spent handling each token.
+
+        The time between yielding a token and being asked for the next one is
+        the time spent handling it, which is added to the phase of its kind.
+
+        Parameters
+        ----------
+        tokens : Iterable[lexer.Token]
+            The tokens to be measured.
+        stats : Statistics
+            The statistics the times are added to.
+
+        Yields
+        ------
+        lexer.Token
+            The same tokens.
         """
-        Get a rule's prerequisites from a string.
+        for token in tokens:
+            start = time.perf_counter()
+            yield token
+            phase = _token_phases.get(token.kind)
+            if phase is not None:
+                stats.add_time(phase, time.perf_counter() - start)
+
+    def __parse_tokens(self, tokens: Iterable[lexer.Token], directory: str, active: List[str],
+                       guard: conditionals.Guard = ()) -> None:
+        """Build the Makefile from a stream of tokens.
+
+        The conditionals are evaluated as they are read, and only the tokens
+        of the branches that hold are kept. The tokens of the branches whose
+        condition depends on the environment are kept too, guarded by it.
 
         Parameters
         ----------
-        string : str
-            A string containing the prerequisites.
+        tokens : Iterable[lexer.Token]
+            The tokens produced by the lexer.
+        directory : str
+            The directory the included files are relative to.
+        active : List[str]
+            The files being included, used to detect recursive inclusions.
+        guard : conditionals.Guard
+            The conditions guarding all the tokens at run time.
+        """
+        stack = conditionals.ConditionalStack(guard)
+        live = True
+        rule = None  # type: Optional[int]
+        # The recipe of a pattern rule is collected in the rule itself
+        pattern = False
+        recipe = []  # type: List[str]
+        for token in tokens:
+            if token.kind == lexer.RECIPE:
+                if live and (rule is not None or pattern):
+                    recipe.append(conditionals.guard_command(stack.guard, token.value))
+                continue
+            if rule is not None and recipe:
+                # The recipe is complete, or interrupted by a conditional
+                self.__rules.extend_recipe(rule, recipe)
+                recipe = []
+
+            if token.kind == lexer.DIRECTIVE and token.name in lexer.CONDITIONAL_DIRECTIVES:
+                self.__conditional = True
+                self.__enter_conditional(stack, token)
+                live = stack.live
+                continue
+            if not live:
+                rule = None
+                pattern = False
+                recipe = []
+                continue
+
+            if token.kind == lexer.RULE:
+                rule = None
+                pattern = False
+                recipe = []
+                prerequisites = self.__prerequisites_from_string(token.value)
+                if token.name == ".PHONY":
+                    self.__phony.update(prerequisites)
+                    continue
+                if '%' in token.name:
+                    pattern = True
+                    recipe = self.__add_patterns(token.name.split(), prerequisites, bool(stack.guard))
+                    continue
+                rule = self.__add_rule(self.__expand_names(token.name), prerequisites, bool(stack.guard))
+            elif token.kind == lexer.VARIABLE:
+                self.__assign(stack.guard, token.name, token.operator, token.value.replace('/', '\\'))
+            elif token.kind == lexer.DIRECTIVE and token.name in INCLUDE_DIRECTIVES:
+                rule = None
+                pattern = False
+                recipe = []
+                self.__include(token, directory, active, stack.guard)
+        if rule is not None and recipe:
+            self.__rules.extend_recipe(rule, recipe)
+        stack.close()
+
+    def __enter_conditional(self, stack: conditionals.ConditionalStack, token: lexer.Token) -> None:
+        """Handle a conditional directive.
+
+        Parameters
+        ----------
+        stack : conditionals.ConditionalStack
+            The conditionals enclosing the directive.
+        token : lexer.Token
+            The directive.
+
+        Raises
+        ------
+        ValueError
+            If the directive is not valid.
+        """
+        if token.name == 'endif':
+            stack.leave(token.line)
+            return
+        if token.name != 'else':
+            condition = self.__evaluate(stack.live, token.name, token.value, token.line)
+            stack.enter(condition, token.line)
+            return
+        words = token.value.split(None, 1)
+        if not words:
+            stack.alternative(True, token.line, True)
+        elif words[0] in conditionals.KEYWORDS:
+            condition = self.__evaluate(stack.enclosing_live, words[0], (words[1:] or [''])[0], token.line)
+            stack.alternative(condition, token.line, False)
+        else:
+            raise ValueError("Invalid conditional at line {}: 'else {}'.".format(token.line, token.value))
+
+    def __evaluate(self, live: bool, keyword: str, argument: str, line: int) -> conditionals.Condition:
+        """Evaluate the condition of a directive, unless the directive is in a
+        part of the Makefile that is not kept (as its condition is then never
+        expanded)."""
+        if not live:
+            return False
+        try:
+            return conditionals.evaluate(keyword, argument, self.__variables)
+        except ValueError as e:
+            raise ValueError("Invalid conditional at line {}: '{} {}'.".format(line, keyword, argument)) from e
+
+    def __add_rule(self, target: str, prerequisites: List[str], guarded: bool) -> int:
+        """Add a rule read from the Makefile.
+
+        A rule whose recipe is guarded adds its prerequisites and its
+        commands to the rule of the same target (if any), so that the rules of
+        all the branches of a conditional that depends on the environment are
+        kept.
+
+        Parameters
+        ----------
+        target : str
+            The target's name.
+        prerequisites : List[str]
+            The target's prerequisites.
+        guarded : bool
+            Whether the rule is in the branch of a conditional that depends
+            on the environment.
+
+        Returns
+        -------
+        int
+            The id of the target.
+        """
+        existing = self.__rules.get(target) if guarded else None
+        if existing is None:
+            return self.__rules.add(target, prerequisites, ())
+        old_prerequisites = self.__rules.prerequisites(existing)
+        prerequisites = old_prerequisites + [name for name in prerequisites if name not in old_prerequisites]
+        return self.__rules.add(target, prerequisites, existing.commands)
+
+    def __assign(self, guard: conditionals.Guard, name: str, operator: str, value: str) -> None:
+        """Assign a variable read from the Makefile.
+
+        A variable assigned in the branch of a conditional that depends on
+        the environment is only known at run time: from then on, it is set by
+        the batch file, in the order of its assignments.
+
+        Parameters
+        ----------
+        guard : conditionals.Guard
+            The conditions guarding the assignment at run time.
+        name : str
+            The variable's name.
+        operator : str
+            The assignment operator.
+        value : str
+            The assigned value.
+        """
+        if name in self.overrides:
+            return
+        if not guard and name not in self.__runtime_names:
+            self.__variables.assign(name, operator, value)
+            return
+
+        if name in self.__variables:
+            # The value assigned so far is set first
+            self.__runtime_variables.append(((), name, self.__variables.resolve(name)[0]))
+            self.__variables.remove(name)
+        self.__runtime_names.add(name)
+        if operator == '+=':
+            value = '$(' + name + ') ' + value
+        elif operator == '?=':
+            guard += ('NOT DEFINED ' + name,)
+        self.__runtime_variables.append((guard, name, self.__variables.expand(value)[0]))
+
+    def __include(self, token: lexer.Token, directory: str, active: List[str],
+                  guard: conditionals.Guard) -> None:
+        """Parse the files named by an include directive.
+
+        Each file is tokenized once per process: its tokens are kept in the
+        fragment cache and replayed into every Makefile including it.
+
+        Parameters
+        ----------
+        token : lexer.Token
+            The include directive.
+        directory : str
+            The directory the included files are relative to.
+        active : List[str]
+            The files being included, used to detect recursive inclusions.
+        guard : conditionals.Guard
+            The conditions guarding the directive at run time.
+        """
+        # The names can reference variables, whose values use backslashes
+        names = self.__variables.expand(token.value)[0].replace('\\', '/')
+        for name in names.split():
+            name = os.path.join(directory, name)
+            if any(char in name for char in '*?['):
+                paths = sorted(glob.glob(name))
+                self.__depends_on_files = True
+            else:
+                paths = [name]
+            for path in paths:
+                path = os.path.normpath(path)
+                if path in active:
+                    raise ValueError("The file '{}' includes itself.".format(path))
+                start = time.perf_counter()
+                try:
+                    tokens = self.__fragments.tokens(path)  # type: Iterable[lexer.Token]
+                except FileNotFoundError:
+                    if token.name == 'include':
+                        raise FileNotFoundError("The included file '{}' does not exists.".format(path))
+                    # The file can be created later, changing the conversion
+                    self.__depends_on_files = True
+                    continue
+                if path not in self.__included:
+                    self.__included.append(path)
+                if self.stats is not None:
+                    self.stats.add_time('read', time.perf_counter() - start)
+                    self.stats.count('included files')
+                    tokens = Makefile.__measure_tokens(tokens, self.stats)
+                active.append(path)
+                self.__parse_tokens(tokens, os.path.dirname(path), active, guard)
+                active.pop()
+
+    def __add_patterns(self, targets: List[str], prerequisites: List[str], guarded: bool = False) -> List[str]:
+        """Add the pattern rules of some target patterns, sharing their
+        prerequisites and their recipe.
+
+        A pattern rule with the same target and the same prerequisites as an
+        existing one replaces it.
+
+        Parameters
+        ----------
+        targets : List[str]
+            The target patterns.
+        prerequisites : List[str]
+            The prerequisite patterns.
+        guarded : bool
+            Whether the rules are in the branch of a conditional that depends
+            on the environment. If so, a single pattern rule with the same
+            target and the same prerequisites as an existing one adds its
+            commands to the existing recipe instead.
 
         Returns
         -------
         List[str]
-            A list of prerequisites.
+            The recipe of the rules, to be filled with their commands.
         """
-        string = string.strip()
-        string = re.sub(r'''^(?:\|\s*)''', '', string)
-        prerequisites = string.split(" ")
-        return prerequisites if prerequisites != [""] else []
+        if guarded and len(targets) == 1:
+            for rule in self.__patterns:
+                if rule.target == targets[0] and rule.prerequisites == prerequisites:
+                    return rule.recipe
+        recipe = []  # type: List[str]
+        for target in targets:
+            self.__patterns = [rule for rule in self.__patterns
+                               if rule.target != target or rule.prerequisites != prerequisites]
+            self.__patterns.append(PatternRule(target, prerequisites, recipe))
+        return recipe
 
-    @staticmethod
-    def __recipe_from_string(string: str) -> List[str]:
-        """Get a rule's recipe from a string.
+    def __expand_names(self, string: str) -> str:
+        """Expand the references to variables in the targets or in the
+        prerequisites of a rule, as they are expanded when the rule is read."""
+        if '$' not in string:
+            return string
+        # The values of the variables use backslashes
+        return self.__variables.expand(string)[0].replace('\\', '/')
+
+    def __prerequisites_from_string(self, string: str) -> List[str]:
+        """
+        Get a rule's prerequisites from a string.
+
+        The references to variables are expanded and the wildcards are
+        replaced by the matching files (if any).
 
         Parameters
         ----------
         string : str
-            A string containing the rule's recipe.
+            A string containing the prerequisites.
 
         Returns
         -------
         List[str]
-            A list of commands forming the recipe.
+            A list of prerequisites.
         """
-        recipe = string.strip().split('\n')
-        return recipe if recipe != [""] else []
+        prerequisites = []  # type: List[str]
+        # The order-only separator is not a prerequisite
+        for prerequisite in self.__expand_names(string).split():
+            if prerequisite == '|':
+                continue
+            if is_pattern(prerequisite):
+                prerequisites.extend(self.__file_tree().glob(prerequisite) or [prerequisite])
+            else:
+                prerequisites.append(prerequisite)
+        return prerequisites
 
     def add_rule(self, target: str, prerequisites: List[str], recipe: List[str]) -> None:
         """Add a rule to the Makefile.
@@ -132,10 +684,22 @@ class Makefile:
         recipe : List[str]
             The new target's recipe.
         """
-        self.__rules[target] = {
-            'prerequisites': prerequisites,
-            'recipe': recipe
-        }
+        self.__rules.add(target, prerequisites, recipe)
+
+    @property
+    def phony(self) -> FrozenSet[str]:
+        """The targets declared as phony, i.e. not corresponding to files."""
+        return frozenset(self.__phony)
+
+    def add_phony(self, target: str) -> None:
+        """Declare a target as phony.
+
+        Parameters
+        ----------
+        target : str
+            The target's name.
+        """
+        self.__phony.add(target)
 
     def remove_rule(self, target: str) -> None:
         """Remove a rule from the Makefile.
@@ -147,8 +711,7 @@ class Makefile:
         target : str
             The target to be removed.
         """
-        if target in self.__rules:
-            del self.__rules[target]
+        self.__rules.remove(target)
 
     def remove_variable(self, variable: str) -> None:
         """Remove a variable from the Makefile.
@@ -160,8 +723,7 @@ class Makefile:
         variable : str
             The variable to be removed.
         """
-        if variable in self.__rules:
-            del self.__variables[variable]
+        self.__variables.remove(variable)
 
     def add_variable(self, name: str, value: Any) -> None:
         """Add a variable to the Makefile.
@@ -173,91 +735,1037 @@ class Makefile:
         value : Any
             The new variable's value.
         """
-        self.__variables[name] = value
+        self.__variables.assign(name, '=', str(value))
 
-    @staticmethod
-    def __convert_command_to_batch(old_command: str) -> str:
-        """Convert a Makefile command to a batch command.
+    def to_batch(self, **options: Any) -> str:
+        """Convert the Makefile to a Batch file.
 
         Parameters
         ----------
-        old_command : str
-            The command to be converted.
+        **options : Any
+            The options of the conversion, as accepted by iter_batch.
 
         Returns
         -------
         str
-            The equivalent command in batch. If no equivalent command is found, return the starting command.
+            The batch file's content.
+        """
+        return ''.join(self.iter_batch(**options))
+
+    def save_batch(self, path: str, **options: Any) -> None:
+        """Convert the Makefile to a Batch file and save it.
+
+        The batch file is written aside and moved in place only once the
+        conversion succeeded, so the file is either the old or the new batch
+        file, never a partial one.
+
+        Parameters
+        ----------
+        path : str
+            The path of the batch file.
+        **options : Any
+            The options of the conversion, as accepted by iter_batch.
+        """
+        _save(path, self.iter_batch(**options))
+
+    def write_batch(self, file: TextIO, **options: Any) -> None:
+        """Convert the Makefile to a Batch file and write it to a file object.
+
+        The batch file is written incrementally, so it is never held in memory
+        as a whole.
+
+        Parameters
+        ----------
+        file : TextIO
+            The file object the batch file is written to.
+        **options : Any
+            The options of the conversion, as accepted by iter_batch.
+        """
+        for chunk in self.iter_batch(**options):
+            file.write(chunk)
+
+    def iter_shards(self, directory: str = 'make.d', *, dispatch: str = 'if', once: bool = False,
+                    subroutines: bool = False, incremental: bool = False, jobs: int = 1,
+                    inline_variables: bool = False, targets: Optional[Sequence[str]] = None,
+                    share_recipes: bool = False) -> Iterator[Tuple[str, str]]:
+        """Convert the Makefile to a dispatcher batch file and a sub-script per
+        target.
+
+        A single batch file is slow to run when it is large, because ``cmd``
+        finds a label by reading the file from its start. In the sharded
+        layout, the dispatcher finds the sub-script of the requested target
+        with a single ``IF EXIST``, and each sub-script calls the sub-scripts
+        of its prerequisites directly, so running a target takes the same
+        time for any size of the Makefile.
+
+        The targets whose names can not be used as file names (see
+        ``emitter.shard_path``) stay as labels of the dispatcher. As the names
+        of the files and the labels are case-insensitive, the targets can not
+        differ only by case. As with
+        ``subroutines``, the prerequisites that are not targets of the
+        Makefile are skipped, and the calls to ``$(MAKE)`` with a single
+        target run its sub-script.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the sub-scripts, relative to the dispatcher.
+        dispatch : str
+            How the dispatcher jumps to the labels of the targets without a
+            sub-script.
+        once : bool
+            Whether each target is run at most once per build.
+        subroutines : bool
+            Whether the prerequisites are run as subroutines. Not supported:
+            the sub-scripts always call the sub-scripts of their
+            prerequisites.
+        incremental : bool
+            Whether the recipe of a target is skipped when the target is up to
+            date.
+        jobs : int
+            The maximum number of prerequisites run concurrently. Only 1 is
+            supported.
+        inline_variables : bool
+            Whether the references to constant variables in the recipes are
+            replaced by the variables' values.
+        targets : Optional[Sequence[str]]
+            The only targets the batch files must be able to make.
+        share_recipes : bool
+            Whether the recipes shared by many targets are written once. Not
+            supported: each sub-script holds its own recipe.
+
+        Yields
+        ------
+        Tuple[str, str]
+            The path of each file, relative to the directory of the dispatcher
+            and with forward slashes as separators, and its content. The
+            dispatcher comes first, with an empty path.
+
+        Raises
+        ------
+        CyclicDependencyError
+            If ``once`` is True and the targets depend on each other.
+        RecursiveVariableError
+            If the variables reference each other.
+        ValueError
+            If ``subroutines`` is True, if ``jobs`` is not 1, if
+            ``share_recipes`` is True, if one of the ``targets`` has no rule,
+            or if two targets differ only by case.
+        """
+        if dispatch not in emitter.DISPATCH_MODES:
+            raise ValueError("Unknown dispatch mode '{}'.".format(dispatch))
+        if subroutines:
+            raise ValueError("The sharded layout always calls the sub-scripts of the prerequisites.")
+        if jobs != 1:
+            raise ValueError("The sharded layout does not run parallel jobs.")
+        if share_recipes:
+            raise ValueError("The sharded layout does not share recipes.")
+
+        rules, variables = self.__rules_to_convert(targets)
+        if once:
+            graph.topological_order(Makefile.__dependency_graph(rules))
+        translate = self.__translation()
+        if self.stats is not None:
+            self.__count_input(self.stats)
+
+        # The sub-script of each target. As the labels, the names of the
+        # files are case-insensitive: a target differing from another only by
+        # case would run the other one, or overwrite its sub-script
+        shards = {}  # type: Dict[str, str]
+        labels = []  # type: List[str]
+        first = {}  # type: Dict[str, str]
+        for target, _ in rules.items():
+            name = first.setdefault(target.lower(), target)
+            if name != target:
+                raise ValueError("The targets '{}' and '{}' differ only by case, so the sharded layout can not tell "
+                                 "them apart.".format(name, target))
+            shard = emitter.shard_path(target)
+            if shard is None:
+                labels.append(target)
+            else:
+                shards[target] = shard
+        call = functools.partial(Makefile.__call_shard, rules, shards)
+
+        writer = emitter.BatchWriter()
+        writer.write(emitter.HEADER)
+        if once:
+            writer.write(emitter.SCOPE_HEADER)
+        self.__write_variables(writer, inline_variables, variables)
+        if once:
+            writer.write(emitter.SCOPE_START)
+        default = "all" if "all" in rules else None
+        writer.write(emitter.shard_dispatch(directory, default if default in shards else None))
+        dispatch_lines = emitter.if_dispatch if dispatch == 'if' else emitter.goto_dispatch
+        for line in dispatch_lines(labels, default if default not in shards else None):
+            writer.write(line)
+        for target in labels:
+            writer.write(":", target, "\n")
+            self.__write_shard_section(writer, target, rules, shards, call, once, incremental, translate,
+                                       inline_variables)
+        if incremental and labels:
+            writer.write(emitter.NEWER_SUBROUTINE)
+        writer.write(emitter.ERROR_LABEL)
+        yield '', writer.drain()
+
+        for target, shard in shards.items():
+            writer.write("@echo off\n")
+            self.__write_shard_section(writer, target, rules, shards, call, once, incremental, translate,
+                                       inline_variables)
+            if incremental and target not in self.__phony:
+                writer.write(emitter.NEWER_SUBROUTINE)
+            yield directory + '/' + shard, writer.drain()
+
+    def save_shards(self, path: str, **options: Any) -> List[str]:
+        """Convert the Makefile to the sharded layout and save it.
+
+        The sub-scripts are saved in the directory named as the dispatcher,
+        with the ``.d`` extension instead of its own (e.g. ``make.d`` for
+        ``make.bat``). The batch files left in that directory by previous
+        conversions are removed. Each file is written atomically, and only
+        once the whole conversion succeeded.
+
+        Parameters
+        ----------
+        path : str
+            The path of the dispatcher.
+        **options : Any
+            The options of the conversion, as accepted by iter_shards.
+
+        Returns
+        -------
+        List[str]
+            The paths of the files written, the dispatcher first.
+        """
+        parent = os.path.dirname(path)
+        directory = os.path.splitext(os.path.basename(path))[0] + '.d'
+        files = list(self.iter_shards(directory, **options))
+
+        written = []  # type: List[str]
+        for relative, content in files:
+            file_path = os.path.join(parent, *relative.split('/')) if relative else path
+            if relative:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            _save(file_path, (content,))
+            written.append(file_path)
+
+        kept = set(os.path.abspath(file_path) for file_path in written)
+        for root, _, names in os.walk(os.path.join(parent, directory)):
+            for name in names:
+                file_path = os.path.join(root, name)
+                if name.endswith('.bat') and os.path.abspath(file_path) not in kept:
+                    os.remove(file_path)
+        return written
+
+    def __write_shard_section(self, writer: emitter.BatchWriter, target: str, rules: RuleTable,
+                              shards: Dict[str, str], call: Callable[[Match], str], once: bool, incremental: bool,
+                              translate: Callable[[str], str], inline_variables: bool) -> None:
+        """Write the lines running a target, in the sharded layout.
+
+        Parameters
+        ----------
+        writer : emitter.BatchWriter
+            The writer of the batch file.
+        target : str
+            The target's name.
+        rules : RuleTable
+            The rules of the Makefile.
+        shards : Dict[str, str]
+            The path of the sub-script of each target having one.
+        call : Callable[[Match], str]
+            The function replacing the invocations of the batch file with a
+            single target.
+        once : bool
+            Whether each target is run at most once per build.
+        incremental : bool
+            Whether the recipe is skipped when the target is up to date.
+        translate : Callable[[str], str]
+            The function translating a command.
+        inline_variables : bool
+            Whether the references to constant variables are replaced by
+            their values.
+        """
+        rule = rules.get(target)
+        assert rule is not None
+        prerequisites = rules.prerequisites(rule)
+        if once:
+            marker = emitter.marker_name(target)
+            writer.write("\tIF DEFINED ", marker, " GOTO :EOF\n\tSET \"", marker, "=1\"\n")
+        for prerequisite in prerequisites:
+            if prerequisite in rules:
+                writer.write("\t", Makefile.__shard_command(rules, shards, prerequisite), "\n")
+        if incremental and target not in self.__phony:
+            self.__write_freshness_check(writer, target, prerequisites)
+        self.__write_commands(writer, rule.commands, translate, inline_variables, call)
+        writer.write("\tGOTO :EOF\n\n")
+
+    @staticmethod
+    def __shard_command(rules: RuleTable, shards: Dict[str, str], target: str) -> str:
+        """Get the command running a target of the Makefile, in the sharded
+        layout: a call to its sub-script or, if it has none, to the
+        dispatcher."""
+        shard = shards.get(target)
+        if shard is not None:
+            return '''CALL "%_MTB_SHARDS%\\''' + emitter.path(shard) + '"'
+        return '''CALL "%_MTB_MAKE%" ''' + target
+
+    @staticmethod
+    def __call_shard(rules: RuleTable, shards: Dict[str, str], match: Match) -> str:
+        """Turn an invocation of the batch file into a call to the sub-script
+        of the target, if the target is defined in the Makefile."""
+        if match.group(1) in rules:
+            return Makefile.__shard_command(rules, shards, match.group(1))
+        return match.group(0)
+
+    @staticmethod
+    def __call_subroutine(rules: RuleTable, match: Match) -> str:
+        """Turn an invocation of the batch file into a subroutine call, if the
+        target is defined in the Makefile."""
+        if match.group(1) in rules:
+            return "CALL :" + match.group(1)
+        return match.group(0)
+
+    def dependency_graph(self) -> Dict[str, List[str]]:
+        """Get the dependency graph of the rules.
+
+        The pattern rules are instantiated for the targets they apply to.
+
+        Returns
+        -------
+        Dict[str, List[str]]
+            For each target, the prerequisites that are targets of the
+            Makefile. The other prerequisites are plain files.
+        """
+        self.__tree = None
+        return Makefile.__dependency_graph(self.__concrete_rules())
+
+    @staticmethod
+    def __dependency_graph(rules: RuleTable) -> Dict[str, List[str]]:
+        """Get the dependency graph of some rules."""
+        return {
+            target: [prerequisite for prerequisite in rules.prerequisites(rule) if prerequisite in rules]
+            for target, rule in rules.items()
+        }
+
+    def __concrete_rules(self) -> RuleTable:
+        """Instantiate the pattern rules.
+
+        A pattern rule applies to a target without a recipe (or to a
+        prerequisite without a rule) matching its target pattern, if all of
+        its prerequisites exist or can be made, by another rule or (in turn)
+        by a pattern rule. The first pattern rule that applies is chosen.
+
+        Returns
+        -------
+        RuleTable
+            The rules of the Makefile, plus a concrete rule for each target
+            a pattern rule applies to. If the Makefile has no pattern rules,
+            its own rule table.
         """
-        commands_list = old_command.strip().split("&&")
-        batch_commands = []
+        if not self.__patterns:
+            return self.__rules
 
-        number_of_dir_changed = 0
-        for command in commands_list:
-            command = command.strip()
-            parsed_command = parser.Parser(command)
+        rules = self.__rules.copy()
+        matches = {}  # type: Dict[str, Optional[Tuple[PatternRule, str]]]
+        pending = []  # type: List[str]
+        for target, rule in self.__rules.items():
+            if not rule.recipe:
+                pending.append(target)
+            pending.extend(self.__rules.prerequisites(rule))
 
-            logging.info("FOUND COMMAND: {}\n".format(parsed_command.program) +
-                         "\tOPTIONS: {}\n".format(parsed_command.options) +
-                         "\tPARAMETERS: {}".format(parsed_command.parameters))
+        instantiated = 0
+        seen = set()  # type: Set[str]
+        while pending:
+            target = pending.pop()
+            if target in seen:
+                continue
+            seen.add(target)
+            explicit = rules.get(target)
+            if explicit is not None and explicit.recipe:
+                continue
+            match = self.__match_pattern(target, rules, matches, [])
+            if match is None:
+                continue
+            extra = rules.prerequisites(explicit) if explicit is not None else []
+            prerequisites, recipe = instantiate(match[0], target, match[1], extra)
+            rules.add(target, prerequisites, recipe)
+            instantiated += 1
+            pending.extend(prerequisites)
+
+        if self.stats is not None:
+            self.stats.count('instantiated rules', instantiated)
+        return rules
+
+    def __match_pattern(self, target: str, rules: RuleTable, matches: Dict[str, Optional[Tuple[PatternRule, str]]],
+                        active: List[str]) -> Optional[Tuple[PatternRule, str]]:
+        """Find the pattern rule applying to a target.
 
-            match = re.match(r"^cd (.*?)$", command)
-            if match:
-                number_of_dir_changed += 1
-                batch_commands.append("PUSHD " + str(match.group(1)))
+        Parameters
+        ----------
+        target : str
+            The target.
+        rules : RuleTable
+            The rules of the Makefile.
+        matches : Dict[str, Optional[Tuple[PatternRule, str]]]
+            The memo of the pattern rules applying to each target.
+        active : List[str]
+            The targets being matched, which can not be made by a chain of
+            pattern rules including them.
+
+        Returns
+        -------
+        Optional[Tuple[PatternRule, str]]
+            The pattern rule and the stem of the target, or None if no pattern
+            rule applies.
+        """
+        if target in matches:
+            return matches[target]
+        tree = self.__file_tree()
+        active.append(target)
+        match = None  # type: Optional[Tuple[PatternRule, str]]
+        for pattern in self.__patterns:
+            stem = pattern_stem(pattern.target, target)
+            if stem is None or not pattern.recipe:
                 continue
-            if parsed_command.program in look_up_table.linux_to_dos:
-                current_command = look_up_table.linux_to_dos[parsed_command.program]
-                options = [current_command['options'][opt] if opt in current_command['options'] else opt for opt in parsed_command.options]
-                batch_commands.append(current_command['command'] + " " + ' '.join(parsed_command.parameters) + ' ' + ' '.join(options))
+            if all(prerequisite in rules or tree.exists(prerequisite) or
+                   (prerequisite not in active and
+                    self.__match_pattern(prerequisite, rules, matches, active) is not None)
+                   for prerequisite in (p.replace('%', stem, 1) for p in pattern.prerequisites)):
+                match = pattern, stem
+                break
+        active.pop()
+        if not active or match is not None:
+            # A failure may depend on the targets being matched
+            matches[target] = match
+        return match
+
+    def iter_batch(self, *, dispatch: str = 'if', once: bool = False, subroutines: bool = False,
+                   incremental: bool = False, jobs: int = 1, inline_variables: bool = False,
+                   targets: Optional[Sequence[str]] = None, share_recipes: bool = False) -> Iterator[str]:
+        """Convert the Makefile to a Batch file, one chunk at a time.
+
+        Parameters
+        ----------
+        dispatch : str
+            How the batch file jumps to the label of the requested target: one
+            of the modes in ``emitter.DISPATCH_MODES``. The ``if`` mode checks
+            each target in turn, the ``goto`` mode looks the target up in a
+            precomputed list and then jumps straight to its label.
+        once : bool
+            Whether each target is run at most once per build, as GNU make
+            does. Each target sets a marker when it starts and returns at
+            once if the marker is already set, so shared prerequisites are not
+            run again for every target depending on them.
+        subroutines : bool
+            Whether the prerequisites (and the calls to ``$(MAKE)`` with a
+            single target) are run as subroutines of the same invocation of
+            the batch file, instead of invoking the batch file again. The
+            prerequisites that are not targets of the Makefile are skipped.
+        incremental : bool
+            Whether the recipe of a target is skipped when the target is up to
+            date, as GNU make does: the target's file exists and is newer
+            than the files of all of its prerequisites. Phony targets, and the
+            targets depending on them, are always out of date.
+        jobs : int
+            The maximum number of prerequisites of a target run concurrently.
+            The prerequisites are split into groups sharing no dependency, and
+            the targets of each group are run by parallel processes. If any
+            of them fails, the target fails too. The limit is per target, so
+            nested targets can run more jobs overall.
+        inline_variables : bool
+            Whether the references to constant variables in the recipes are
+            replaced by the variables' values. The constant variables are then
+            not set by the batch file. The other variables are always set,
+            with their values resolved as far as possible, in an order such
+            that each variable is set after the variables it references.
+        targets : Optional[Sequence[str]]
+            The only targets the batch file must be able to make. If given,
+            only the rules reachable from them (through their prerequisites
+            or the calls to ``$(MAKE)`` in their recipes) are converted, and
+            only the variables referenced by these recipes are set.
+        share_recipes : bool
+            Whether the recipes shared by many targets are written once, as
+            subroutines the targets call. The recipes differing only by the
+            name of their target are shared too, passing the name as an
+            argument. A recipe is only shared if that makes the batch file
+            smaller.
+
+        Yields
+        ------
+        str
+            The next chunk of the batch file's content.
+
+        Raises
+        ------
+        CyclicDependencyError
+            If ``once`` is True or ``jobs`` is greater than 1, and the
+            targets depend on each other.
+        RecursiveVariableError
+            If the variables reference each other.
+        ValueError
+            If one of the ``targets`` has no rule.
+        """
+        chunks = self.__iter_batch(dispatch, once, subroutines, incremental, jobs, inline_variables, targets,
+                                   share_recipes)
+        if self.stats is None:
+            yield from chunks
+            return
+
+        stats = self.stats
+        self.__count_input(stats)
+        while True:
+            # The time spent translating is measured apart
+            start = time.perf_counter()
+            translating = stats.timings['translate']
+            chunk = next(chunks, None)
+            stats.add_time('emit', time.perf_counter() - start - (stats.timings['translate'] - translating))
+            if chunk is None:
+                return
+            yield chunk
+
+    def __count_input(self, stats: Statistics) -> None:
+        """Count the rules, the recipe lines and the variables converted."""
+        stats.count('rules', len(self.__rules))
+        stats.count('recipe lines', sum(len(rule.commands) for _, rule in self.__rules.items()))
+        stats.count('variables', len(self.__variables))
+
+    def __iter_batch(self, dispatch: str, once: bool, subroutines: bool, incremental: bool, jobs: int,
+                     inline_variables: bool, targets: Optional[Sequence[str]],
+                     share_recipes: bool) -> Iterator[str]:
+        """Convert the Makefile to a Batch file, one chunk at a time.
+
+        The parameters are the ones of ``iter_batch``.
+        """
+        if dispatch not in emitter.DISPATCH_MODES:
+            raise ValueError("Unknown dispatch mode '{}'.".format(dispatch))
+        if jobs < 1:
+            raise ValueError("The number of jobs must be at least 1.")
+
+        rules, variables = self.__rules_to_convert(targets)
+
+        # The dependency graph is only needed to check for cycles and to
+        # group the jobs
+        dependencies = {}  # type: Dict[str, List[str]]
+        if once or jobs > 1:
+            dependencies = Makefile.__dependency_graph(rules)
+            graph.topological_order(dependencies)
+        closures = {}  # type: Dict[str, FrozenSet[str]]
+
+        translate = self.__translation()
+        writer = emitter.BatchWriter()
+        scoped = once or subroutines or jobs > 1
+        writer.write(emitter.HEADER)
+        if scoped:
+            writer.write(emitter.SCOPE_HEADER)
+        self.__write_variables(writer, inline_variables, variables)
+        if scoped:
+            writer.write(emitter.SCOPE_START)
+        if jobs > 1:
+            writer.write(emitter.JOB_DISPATCH)
+
+        default = "all" if "all" in rules else None
+        dispatch_lines = emitter.if_dispatch if dispatch == 'if' else emitter.goto_dispatch
+        for line in dispatch_lines(rules, default):
+            writer.write(line)
+            if writer.full:
+                yield writer.drain()
+
+        call_subroutine = functools.partial(Makefile.__call_subroutine, rules)
+        call = call_subroutine if subroutines else None  # type: Optional[Callable[[Match], str]]
+        shared = {}  # type: Dict[str, Tuple[int, bool]]
+        recipes = []  # type: List[Sequence[str]]
+        if share_recipes:
+            shared, recipes = self.__shared_recipes(rules, translate, inline_variables, call)
+
+        # The sections depend on which recipes are shared, so they are not
+        # reused when sharing the recipes
+        sections = None  # type: Optional[Dict[Tuple[str, Tuple[str, ...], str], str]]
+        if jobs == 1 and not share_recipes:
+            sections = self.__reusable_sections(rules, (dispatch, once, subroutines, incremental, inline_variables))
+        new_sections = {}  # type: Dict[Tuple[str, Tuple[str, ...], str], str]
+        for rule, content in rules.items():
+            prerequisites = rules.prerequisites(content)
+            section_writer = writer
+            if sections is not None:
+                key = (rule, tuple(prerequisites), content.recipe)
+                section = sections.get(key)
+                if section is not None:
+                    new_sections[key] = section
+                    writer.write(section)
+                    continue
+                # The section is written apart, to be kept
+                section_writer = emitter.BatchWriter()
+
+            section_writer.write(":", rule, "\n")
+            if once:
+                marker = emitter.marker_name(rule)
+                section_writer.write("\tIF DEFINED ", marker, " GOTO :EOF\n\tSET \"", marker, "=1\"\n")
+            if jobs == 1:
+                for prerequisite in prerequisites:
+                    Makefile.__write_prerequisite(section_writer, rules, prerequisite, subroutines)
+            else:
+                Makefile.__write_parallel_prerequisites(section_writer, rules, prerequisites, subroutines, once,
+                                                        jobs, dependencies, closures)
+            if incremental and rule not in self.__phony:
+                self.__write_freshness_check(section_writer, rule, prerequisites)
+            recipe = shared.get(rule)
+            if recipe is None:
+                self.__write_commands(section_writer, content.commands, translate, inline_variables, call)
+            elif recipe[1]:
+                section_writer.write("\tCALL :", emitter.recipe_label(recipe[0]), ' "', rule, '"\n')
             else:
-                batch_commands.append(command)
+                section_writer.write("\tCALL :", emitter.recipe_label(recipe[0]), "\n")
+            section_writer.write("\tGOTO :EOF\n\n")
+            if sections is not None:
+                section = new_sections[key] = section_writer.drain()
+                writer.write(section)
+            if writer.full:
+                yield writer.drain()
+        if sections is not None:
+            # Only the sections of the current rules are kept
+            self.__sections = new_sections
 
-        for _ in range(number_of_dir_changed):
-            batch_commands.append("POPD")
+        for index, lines in enumerate(recipes):
+            writer.write(":", emitter.recipe_label(index), "\n")
+            for line in lines:
+                writer.write("\t", line, "\n")
+            writer.write("\tGOTO :EOF\n\n")
+            if writer.full:
+                yield writer.drain()
+        if incremental:
+            writer.write(emitter.NEWER_SUBROUTINE)
+        if jobs > 1:
+            writer.write(emitter.JOB_SUBROUTINES)
+        writer.write(emitter.ERROR_LABEL)
+        yield writer.drain()
 
-        batch_commands_str = re.sub(r"\$[({](.*?)[)}]", r"%\1%", " && ".join(batch_commands))
-        batch_commands_str = re.sub(r"%MAKE%", r"CALL make.bat", batch_commands_str)
-        return batch_commands_str
+    def __rules_to_convert(self, targets: Optional[Sequence[str]]) -> Tuple[RuleTable, Optional[Set[str]]]:
+        """Get the rules and the variables a conversion needs.
 
-    def to_batch(self) -> str:
-        """Convert the Makefile to a Batch file.
+        Parameters
+        ----------
+        targets : Optional[Sequence[str]]
+            The only targets the batch file must be able to make, if any.
+
+        Returns
+        -------
+        Tuple[RuleTable, Optional[Set[str]]]
+            The concrete rules (only the ones reachable from the targets, if
+            given) and the variables to be set (None if all of them).
+        """
+        # The files may have changed since the Makefile was parsed
+        self.__tree = None
+        rules = self.__concrete_rules()
+        variables = None  # type: Optional[Set[str]]
+        if targets is not None:
+            rules = Makefile.__reachable_rules(rules, targets)
+            variables = self.__referenced_variables(rules)
+        return rules, variables
+
+    def __write_variables(self, writer: emitter.BatchWriter, inline_variables: bool,
+                          variables: Optional[Set[str]]) -> None:
+        """Write the lines setting the variables.
+
+        Parameters
+        ----------
+        writer : emitter.BatchWriter
+            The writer of the batch file.
+        inline_variables : bool
+            Whether the constant variables are inlined, and not set.
+        variables : Optional[Set[str]]
+            The variables to be set, or None if all of them.
+        """
+        # The variables only known at run time are set first, as the others
+        # can reference them
+        for guard, var, value in self.__runtime_variables:
+            writer.write(conditionals.guard_prefix(guard), "SET ", var, "=", batch_references(value), "\n")
+        for var, value, constant in self.__variables.resolved_items():
+            if not (inline_variables and constant) and (variables is None or var in variables):
+                writer.write("SET ", var, "=", batch_references(value), "\n")
+        writer.write("\n")
+
+    def __write_commands(self, writer: emitter.BatchWriter, commands: Sequence[str],
+                         translate: Callable[[str], str], inline_variables: bool,
+                         call: Optional[Callable[[Match], str]]) -> None:
+        """Write the translated commands of a recipe.
+
+        Parameters
+        ----------
+        writer : emitter.BatchWriter
+            The writer of the batch file.
+        commands : Sequence[str]
+            The commands.
+        translate : Callable[[str], str]
+            The function translating a command.
+        inline_variables : bool
+            Whether the references to constant variables are replaced by
+            their values.
+        call : Optional[Callable[[Match], str]]
+            The function replacing the invocations of the batch file with a
+            single target, if they are replaced.
+        """
+        for command in commands:
+            writer.write("\t", self.__translate_command(command, translate, inline_variables, call), "\n")
+
+    def __translate_command(self, command: str, translate: Callable[[str], str], inline_variables: bool,
+                            call: Optional[Callable[[Match], str]]) -> str:
+        """Translate a command of a recipe. The parameters are the ones of
+        ``__write_commands``."""
+        guard, command = conditionals.split_guard(command)
+        if guard:
+            return guard + self.__translate_command(command, translate, inline_variables, call)
+        if inline_variables:
+            command = self.__variables.expand(command)[0]
+        command = translate(command)
+        if call is not None and "CALL make.bat " in command:
+            command = _make_call_pattern.sub(functools.partial(Makefile.__call_in_place, call), command)
+        return command
+
+    @staticmethod
+    def __call_in_place(call: Callable[[Match], str], match: Match) -> str:
+        """Replace an invocation of the batch file with a call, unless the
+        command changes directory before it: the invocation then runs the
+        batch file of another Makefile."""
+        if _directory_change_pattern.search(match.string, 0, match.start()):
+            return match.group(0)
+        return call(match)
+
+    def __shared_recipes(self, rules: RuleTable, translate: Callable[[str], str], inline_variables: bool,
+                         call: Optional[Callable[[Match], str]]) -> Tuple[Dict[str, Tuple[int, bool]],
+                                                                          List[Sequence[str]]]:
+        """Find the recipes worth sharing between targets.
+
+        The recipes are compared once translated. A recipe is shared if many
+        targets have it (possibly with the name of each target in place of
+        the argument of the subroutine) and if calling it takes less room
+        than writing it.
+
+        Parameters
+        ----------
+        rules : RuleTable
+            The rules.
+        translate : Callable[[str], str]
+            The function translating a command.
+        inline_variables : bool
+            Whether the references to constant variables are replaced by
+            their values.
+        call : Optional[Callable[[Match], str]]
+            The function replacing the invocations of the batch file with a
+            single target, if they are replaced.
+
+        Returns
+        -------
+        Tuple[Dict[str, Tuple[int, bool]], List[Sequence[str]]]
+            For each target running a shared recipe, the index of the recipe
+            and whether the target is passed to it as an argument; and the
+            lines of each shared recipe.
+        """
+        # The same recipe is only translated once
+        translations = {}  # type: Dict[str, List[str]]
+        groups = {}  # type: Dict[Tuple[str, ...], List[str]]
+        for target, rule in rules.items():
+            if not rule.recipe:
+                continue
+            lines = translations.get(rule.recipe)
+            if lines is None:
+                lines = translations[rule.recipe] = [
+                    self.__translate_command(command, translate, inline_variables, call)
+                    for command in rule.commands]
+            template = emitter.parameterize(lines, target)
+            groups.setdefault(tuple(template if template is not None else lines), []).append(target)
+
+        shared = {}  # type: Dict[str, Tuple[int, bool]]
+        recipes = []  # type: List[Sequence[str]]
+        for recipe, targets in groups.items():
+            if len(targets) < 2:
+                continue
+            parameterized = any("%~1" in line for line in recipe)
+            label = emitter.recipe_label(len(recipes))
+            calling = len(label) + 8 + (len(targets[0]) + 3 if parameterized else 0)
+            if sum(len(line) + 2 for line in recipe) <= calling:
+                continue
+            for target in targets:
+                shared[target] = len(recipes), parameterized
+            recipes.append(recipe)
+        if self.stats is not None:
+            self.stats.count('shared recipes', len(recipes))
+        return shared, recipes
+
+    @staticmethod
+    def __reachable_rules(rules: RuleTable, targets: Sequence[str]) -> RuleTable:
+        """Keep only the rules needed to make some targets.
+
+        Parameters
+        ----------
+        rules : RuleTable
+            The rules.
+        targets : Sequence[str]
+            The targets.
+
+        Returns
+        -------
+        RuleTable
+            The rules of the targets, of their prerequisites and of the
+            targets made by calling ``$(MAKE)`` in their recipes, recursively,
+            in their original order.
+
+        Raises
+        ------
+        ValueError
+            If a target has no rule.
+        """
+        for target in targets:
+            if target not in rules:
+                raise ValueError("No rule to make target '{}'.".format(target))
+
+        reachable = set()  # type: Set[str]
+        pending = list(targets)
+        while pending:
+            target = pending.pop()
+            rule = rules.get(target)
+            if target in reachable or rule is None:
+                continue
+            reachable.add(target)
+            pending.extend(rules.prerequisites(rule))
+            for command in rule.commands:
+                if 'MAKE' in command:
+                    for match in _make_reference_pattern.finditer(command):
+                        pending.extend(match.group(1).split())
+
+        if len(reachable) == len(rules):
+            return rules
+        pruned = RuleTable()
+        for target, rule in rules.items():
+            if target in reachable:
+                pruned.add(target, rules.prerequisites(rule), rule.commands)
+        return pruned
+
+    def __referenced_variables(self, rules: RuleTable) -> Set[str]:
+        """Find the variables needed by some rules.
+
+        Parameters
+        ----------
+        rules : RuleTable
+            The rules.
+
+        Returns
+        -------
+        Set[str]
+            The variables referenced by the recipes of the rules, and the
+            variables referenced by their values, recursively.
+        """
+        dependencies = self.__variables.dependencies()
+        pending = []  # type: List[str]
+        for _, rule in rules.items():
+            for command in rule.commands:
+                texts = [command]
+                while texts:
+                    # The references nested in others (e.g. in a function
+                    # call) are found too
+                    for _, _, content in references(texts.pop()):
+                        if content in dependencies:
+                            pending.append(content)
+                        elif '$' in content:
+                            texts.append(content)
+
+        variables = set()  # type: Set[str]
+        while pending:
+            name = pending.pop()
+            if name not in variables:
+                variables.add(name)
+                pending.extend(dependencies[name])
+        return variables
+
+    def __reusable_sections(self, rules: RuleTable,
+                            options: Tuple[Any, ...]) -> Optional[Dict[Tuple[str, Tuple[str, ...], str], str]]:
+        """Get the sections of the batch file kept from the last conversion.
+
+        The section of a rule only depends on the rule, as long as the
+        options of the conversion, the phony targets and (if the variables
+        are inlined) the variables do not change. If the prerequisites are
+        run as subroutines, the section also depends on which targets have a
+        rule. The sections are not reused when the prerequisites run
+        concurrently, as they then depend on the whole dependency graph.
+
+        Parameters
+        ----------
+        rules : RuleTable
+            The rules being converted.
+        options : Tuple[Any, ...]
+            The options of the conversion: the dispatch mode, ``once``,
+            ``subroutines``, ``incremental`` and ``inline_variables``.
+
+        Returns
+        -------
+        Optional[Dict[Tuple[str, Tuple[str, ...], str], str]]
+            For each target, its prerequisites and its recipe, the section of
+            the batch file converting it. None if the sections are not kept.
+        """
+        if self.__sections is None:
+            return None
+        _, _, subroutines, _, inline_variables = options
+        context = (
+            options,
+            frozenset(self.__phony),
+            tuple(self.__variables.resolved_items()) if inline_variables else None,
+            frozenset(rules) if subroutines else None,
+        )  # type: Tuple[Any, ...]
+        if context != self.__sections_context:
+            self.__sections_context = context
+            self.__sections = {}
+        return self.__sections
+
+    def __translation(self) -> Callable[[str], str]:
+        """Get the function translating the commands, updating the statistics
+        and the passthrough counter if they are collected."""
+        if self.stats is not None:
+            return functools.partial(self.__measure_translation, self.stats)
+        if self.passthrough is not None:
+            return functools.partial(self.__count_passthrough, self.passthrough)
+        return self.__translator.translate
+
+    def __count_passthrough(self, passthrough: 'Counter[str]', command: str) -> str:
+        """Translate a command, counting the programs copied as they are.
+
+        Parameters
+        ----------
+        passthrough : Counter[str]
+            The counter to be updated.
+        command : str
+            The command to be translated.
 
         Returns
         -------
         str
-            The batch file's content.
+            The translated command.
+        """
+        batch_command, programs = self.__translator.translate_with_programs(command)
+        for program, translated in programs:
+            if not translated and program:
+                passthrough[program] += 1
+        return batch_command
+
+    def __measure_translation(self, stats: Statistics, command: str) -> str:
+        """Translate a command, updating the statistics.
+
+        Parameters
+        ----------
+        stats : Statistics
+            The statistics to be updated.
+        command : str
+            The command to be translated.
+
+        Returns
+        -------
+        str
+            The translated command.
         """
-        batch_content = "@echo off\n\n"
-        for var in self.__variables:
-            batch_content += "SET {var}={val}\n".format(var=var, val=self.__variables[var])
+        start = time.perf_counter()
+        batch_command, programs = self.__translator.translate_with_programs(command)
+        stats.add_time('translate', time.perf_counter() - start)
+        for program, translated in programs:
+            if translated:
+                stats.count('translated commands')
+                stats.programs[program] += 1
+            else:
+                stats.count('passthrough commands')
+                if program:
+                    stats.passthrough[program] += 1
+                    if self.passthrough is not None:
+                        self.passthrough[program] += 1
+        return batch_command
+
+    @staticmethod
+    def __write_prerequisite(writer: emitter.BatchWriter, rules: RuleTable, prerequisite: str,
+                             subroutines: bool) -> None:
+        """Write the line running a prerequisite.
 
-        batch_content += "\n"
+        Parameters
+        ----------
+        writer : emitter.BatchWriter
+            The writer of the batch file.
+        rules : RuleTable
+            The rules of the Makefile.
+        prerequisite : str
+            The prerequisite's name.
+        subroutines : bool
+            Whether the prerequisite is run as a subroutine.
+        """
+        if not subroutines:
+            writer.write("\tCALL make.bat ", prerequisite, "\n")
+        elif prerequisite in rules:
+            writer.write("\tCALL :", prerequisite, "\n")
 
-        for rule in self.__rules:
-            batch_content += '''IF /I "%1"=="{rule}" GOTO {rule}\n'''.format(rule=rule)
-        if "all" in self.__rules:
-            batch_content += '''IF /I "%1"=="" GOTO all\n'''
-        batch_content += '''GOTO error\n'''
+    @staticmethod
+    def __write_parallel_prerequisites(writer: emitter.BatchWriter, rules: RuleTable, prerequisites: List[str],
+                                       subroutines: bool, once: bool, jobs: int,
+                                       dependencies: Dict[str, List[str]],
+                                       closures: Dict[str, FrozenSet[str]]) -> None:
+        """Write the lines running the prerequisites of a target concurrently.
 
-        batch_content += "\n"
+        Parameters
+        ----------
+        writer : emitter.BatchWriter
+            The writer of the batch file.
+        rules : RuleTable
+            The rules of the Makefile.
+        prerequisites : List[str]
+            The prerequisites' names.
+        subroutines : bool
+            Whether the prerequisites run one at a time are run as subroutines.
+        once : bool
+            Whether each target is run at most once per build.
+        jobs : int
+            The maximum number of prerequisites run concurrently.
+        dependencies : Dict[str, List[str]]
+            The dependency graph of the Makefile.
+        closures : Dict[str, FrozenSet[str]]
+            The memo of the targets reachable from each target.
+        """
+        # The prerequisites without a rule cannot be run concurrently
+        targets = []  # type: List[str]
+        for prerequisite in prerequisites:
+            if prerequisite in rules:
+                targets.append(prerequisite)
+            else:
+                Makefile.__write_prerequisite(writer, rules, prerequisite, subroutines)
 
-        for rule in self.__rules:
-            batch_content += ":{}\n".format(rule)
-            for prerequisite in self.__rules[rule]["prerequisites"]:
-                batch_content += "\tCALL make.bat {}\n".format(prerequisite)
-            for command in self.__rules[rule]["recipe"]:
-                batch_content += "\t" + Makefile.__convert_command_to_batch(command) + "\n"
-            batch_content += "\tGOTO :EOF\n\n"
+        for group in graph.independent_groups(dependencies, targets, jobs, closures):
+            if len(group) == 1:
+                Makefile.__write_prerequisite(writer, rules, group[0], subroutines)
+                continue
 
-        batch_content += ''':error
-    IF "%1"=="" (
-        ECHO make: *** No targets specified and no makefile found.  Stop.
-    ) ELSE (
-        ECHO make: *** No rule to make target '%1%'. Stop.
-    )
-    GOTO :EOF'''
+            writer.write('''\tSET "_MTB_JOB=%TEMP%\\_mtb_%RANDOM%%RANDOM%"\n\tSET "_MTB_FAILED="\n''')
+            markers = []
+            for index, target in enumerate(group):
+                marker = '''"%_MTB_JOB%_{}"'''.format(index)
+                markers.append(marker)
+                writer.write('''\tSTART "" /B CMD /C CALL "%~f0" _mtb_job ''', marker, " ", target, "\n")
+            writer.write("\tCALL :_mtb_wait ", " ".join(markers), "\n\tIF DEFINED _MTB_FAILED EXIT /B 1\n")
+            if once:
+                # The jobs ran in other processes, so their markers are lost
+                done = set()  # type: Set[str]
+                for target in group:
+                    done.update(closures[target])
+                for target in sorted(done):
+                    writer.write('''\tSET "''', emitter.marker_name(target), '''=1"\n''')
 
-        batch_content += "\n"
+    def __write_freshness_check(self, writer: emitter.BatchWriter, target: str, prerequisites: List[str]) -> None:
+        """Write the lines skipping the recipe of an up-to-date target.
 
-        return batch_content
+        Parameters
+        ----------
+        writer : emitter.BatchWriter
+            The writer of the batch file.
+        target : str
+            The target's name.
+        prerequisites : List[str]
+            The target's prerequisites.
+        """
+        if any(prerequisite in self.__phony for prerequisite in prerequisites):
+            # A target depending on a phony target is always out of date
+            return
+        writer.write('''\tSET "_MTB_STALE="\n\tIF NOT EXIST "''', emitter.path(target), '''" SET "_MTB_STALE=1"\n''')
+        for prerequisite in prerequisites:
+            writer.write('''\tIF NOT DEFINED _MTB_STALE CALL :_mtb_newer "''', emitter.path(target),
+                         '''" "''', emitter.path(prerequisite), '''"\n''')
+        writer.write("\tIF NOT DEFINED _MTB_STALE GOTO :EOF\n")
@@ -24,11 +24,15 @@
 This module contains the class Parser, that can be used to parse a command.
 """
 
+import make_to_batch.shell as shell
+
+
 class Parser:
     """A command parser.
 
-    This class parses a command and exposes the program called, its arguments
-    and its options.
+    This class parses a simple command and exposes the program called, its
+    arguments and its options. The words of the command are split as the
+    shell does, so quoted arguments and repeated whitespace are handled.
 
     Attributes
     ----------
@@ -42,16 +46,8 @@ class Parser:
 
     def __init__(self, command: str):
         """Take a command as a string and parses it."""
-        segments = command.split(' ')
-        self.program = segments[0]
-        segments = segments[1:]
-        self.options = list()
-        self.parameters = list()
-        all_parameters = False
-        for segment in segments:
-            if segment == '--':
-                all_parameters = True
-            elif segment.startswith('-') and not all_parameters:
-                self.options.append(segment)
-            else:
-                self.parameters.append(segment)
+        try:
+            words = shell.split_words(command)
+        except shell.ShellSyntaxError:
+            words = command.split()
+        self.program, self.options, self.parameters = shell.program_arguments(shell.SimpleCommand(tuple(words), ()))
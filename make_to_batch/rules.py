@@ -0,0 +1,564 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The rules module.
+
+This module contains the compact representation of the rules of a Makefile.
+Large Makefiles name the same targets over and over (as targets and as
+prerequisites of other targets), so each name is stored once in a symbol
+table and the rules refer to the names by their integer id:
+
+* the targets and the prerequisites of the rules are ids;
+* the prerequisites of the rules are stored in arrays of machine integers,
+  instead of lists of strings;
+* the recipe of a rule is stored as a single string, shared by all the rules
+  with the same recipe.
+
+The rules can be replaced and removed many times (e.g. while watching a
+Makefile): the prerequisites of the old rules are compacted away once they
+take most of their array, and the recipes no rule uses are dropped. The names
+of the old targets and prerequisites are only released when the table is
+cleared, i.e. when the whole Makefile is parsed again (by each request of the
+server, and by each change of the watcher that is not incremental).
+
+The pattern rules (e.g. ``%.o: %.c``) are kept apart, as they are: they are
+instantiated into concrete rules when the Makefile is converted.
+"""
+
+import sys
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from make_to_batch.variables import references
+
+RECIPE_SEPARATOR = '\n'
+"""The separator of the commands of a recipe (which never contain it)."""
+
+PatternRule = NamedTuple('PatternRule', [
+    ('target', str),
+    ('prerequisites', List[str]),
+    ('recipe', List[str]),
+])
+"""A pattern rule: its target and its prerequisites contain a ``%``, matching
+any non-empty stem."""
+
+
+def pattern_stem(pattern: str, name: str) -> Optional[str]:
+    """Match a name against a pattern.
+
+    Parameters
+    ----------
+    pattern : str
+        The pattern, containing a ``%``.
+    name : str
+        The name.
+
+    Returns
+    -------
+    Optional[str]
+        The non-empty part of the name matched by the ``%``, or None if the
+        name does not match the pattern.
+    """
+    prefix, _, suffix = pattern.partition('%')
+    if len(name) > len(prefix) + len(suffix) and name.startswith(prefix) and name.endswith(suffix):
+        return name[len(prefix):len(name) - len(suffix)]
+    return None
+
+
+def instantiate(rule: PatternRule, target: str, stem: str,
+                extra_prerequisites: Iterable[str] = ()) -> Tuple[List[str], List[str]]:
+    """Instantiate a pattern rule for a target.
+
+    The automatic variables of the recipe are replaced by their values, as
+    they are known at conversion time: ``$@``, ``$*``, ``$<``, ``$^``, ``$+``
+    and ``$?`` (which, as the files are not compared, is the same as ``$^``).
+
+    Parameters
+    ----------
+    rule : PatternRule
+        The pattern rule.
+    target : str
+        The target matching the rule's target.
+    stem : str
+        The stem of the target.
+    extra_prerequisites : Iterable[str]
+        The prerequisites given to the target by explicit rules without a
+        recipe. They follow the prerequisites of the pattern rule.
+
+    Returns
+    -------
+    Tuple[List[str], List[str]]
+        The prerequisites and the recipe of the target.
+    """
+    prerequisites = [prerequisite.replace('%', stem, 1) for prerequisite in rule.prerequisites]
+    prerequisites.extend(extra_prerequisites)
+    unique = ' '.join(sorted(set(prerequisites), key=prerequisites.index))
+    automatic = {
+        '@': target, '*': stem, '<': prerequisites[0] if prerequisites else '',
+        '^': unique, '+': ' '.join(prerequisites), '?': unique,
+    }
+
+    recipe = []  # type: List[str]
+    for command in rule.recipe:
+        parts = []  # type: List[str]
+        last = 0
+        for start, end, content in references(command):
+            if content in automatic:
+                parts.append(command[last:start])
+                parts.append(automatic[content])
+                last = end
+        parts.append(command[last:])
+        recipe.append(''.join(parts))
+    return prerequisites, recipe
+
+
+class SymbolTable:
+    """A table assigning an integer id to each name.
+
+    The ids are consecutive, starting from 0, and a name keeps its id until
+    the table is cleared. The names are never released before: the table
+    grows with every name it has seen, even if no rule uses it any more.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty table."""
+        self.__names = []  # type: List[str]
+        # The id of each name, i.e. its index in __names
+        self.__ids = {}  # type: Dict[str, int]
+
+    def __len__(self) -> int:
+        return len(self.__names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__ids
+
+    def intern(self, name: str) -> int:
+        """Get the id of a name, adding the name to the table if needed.
+
+        Parameters
+        ----------
+        name : str
+            The name.
+
+        Returns
+        -------
+        int
+            The name's id.
+        """
+        symbol = self.__ids.get(name)
+        if symbol is None:
+            symbol = self.__ids[name] = len(self.__names)
+            self.__names.append(name)
+        return symbol
+
+    def intern_all(self, names: Iterable[str]) -> List[int]:
+        """Get the ids of some names, adding the names to the table if
+        needed.
+
+        Parameters
+        ----------
+        names : Iterable[str]
+            The names.
+
+        Returns
+        -------
+        List[int]
+            The names' ids, in the same order.
+        """
+        ids = self.__ids
+        table = self.__names
+        symbols = []  # type: List[int]
+        for name in names:
+            symbol = ids.get(name)
+            if symbol is None:
+                symbol = ids[name] = len(table)
+                table.append(name)
+            symbols.append(symbol)
+        return symbols
+
+    def find(self, name: str) -> Optional[int]:
+        """Get the id of a name, without adding it to the table.
+
+        Parameters
+        ----------
+        name : str
+            The name.
+
+        Returns
+        -------
+        Optional[int]
+            The name's id, or None if the name is not in the table.
+        """
+        return self.__ids.get(name)
+
+    def name(self, symbol: int) -> str:
+        """Get the name of an id.
+
+        Parameters
+        ----------
+        symbol : int
+            The id.
+
+        Returns
+        -------
+        str
+            The name.
+        """
+        return self.__names[symbol]
+
+    def names(self, symbols: Iterable[int]) -> List[str]:
+        """Get the names of some ids.
+
+        Parameters
+        ----------
+        symbols : Iterable[int]
+            The ids.
+
+        Returns
+        -------
+        List[str]
+            The names, in the same order.
+        """
+        names = self.__names
+        return [names[symbol] for symbol in symbols]
+
+    def clear(self) -> None:
+        """Remove all the names from the table."""
+        self.__ids.clear()
+        self.__names.clear()
+
+
+class Rule:
+    """A rule of a Makefile.
+
+    The rules are not stored as such: a rule is a read-only view of the
+    arrays of the rule table, created when the rule is requested.
+
+    Attributes
+    ----------
+    target : int
+        The id of the rule's target.
+    prerequisites : array
+        The ids of the rule's prerequisites.
+    recipe : str
+        The commands of the rule's recipe, separated by ``RECIPE_SEPARATOR``.
+    """
+
+    __slots__ = ('target', 'prerequisites', 'recipe')
+
+    def __init__(self, target: int, prerequisites: array, recipe: str):
+        """Create a rule.
+
+        Parameters
+        ----------
+        target : int
+            The id of the rule's target.
+        prerequisites : array
+            The ids of the rule's prerequisites.
+        recipe : str
+            The commands of the rule's recipe, separated by
+            ``RECIPE_SEPARATOR``.
+        """
+        self.target = target
+        self.prerequisites = prerequisites
+        self.recipe = recipe
+
+    @property
+    def commands(self) -> List[str]:
+        """The commands of the rule's recipe."""
+        return self.recipe.split(RECIPE_SEPARATOR) if self.recipe else []
+
+
+class RuleTable:
+    """The rules of a Makefile, in the order they were defined.
+
+    Redefining a rule keeps its place, removing it and adding it again moves
+    it to the end.
+
+    The rules are stored by column, in arrays indexed by the id of their
+    target: the prerequisites of all the rules are stored one after another
+    in a single array of ids, and each rule only stores where its own
+    prerequisites start and how many they are. A rule therefore takes a few
+    machine words, plus one per prerequisite.
+
+    Attributes
+    ----------
+    symbols : SymbolTable
+        The names of the targets and of the prerequisites.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty table."""
+        self.symbols = SymbolTable()
+        # For each id: the recipe of its rule (None if it has no rule), the
+        # start and the number of the rule's prerequisites in __edges
+        self.__recipes = []  # type: List[Optional[str]]
+        self.__starts = array('q')
+        self.__lengths = array('i')
+        self.__edges = array('i')
+        # The ids of the targets, in the order of their rules
+        self.__order = array('i')
+        # The number of entries of __edges no longer used by any rule
+        self.__dead_edges = 0
+        # The number of rules using each recipe, and the distinct recipes,
+        # each stored once
+        self.__recipe_references = Counter()  # type: Counter[str]
+        self.__distinct_recipes = {}  # type: Dict[str, str]
+
+    def __len__(self) -> int:
+        return len(self.__order)
+
+    def __contains__(self, target: str) -> bool:
+        symbol = self.symbols.find(target)
+        return symbol is not None and self.__recipes[symbol] is not None
+
+    def __sizeof__(self) -> int:
+        """The memory taken by the rules, as reported by ``sys.getsizeof``
+        (the names of the symbol table are not counted)."""
+        return (object.__sizeof__(self) + sys.getsizeof(self.__recipes) + sys.getsizeof(self.__starts) +
+                sys.getsizeof(self.__lengths) + sys.getsizeof(self.__edges) + sys.getsizeof(self.__order) +
+                sys.getsizeof(self.__recipe_references) + sys.getsizeof(self.__distinct_recipes) +
+                sum(sys.getsizeof(recipe) for recipe in self.__distinct_recipes))
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the names of the targets."""
+        return iter(self.symbols.names(self.__order))
+
+    def __rule(self, symbol: int) -> Rule:
+        """Get the rule of a target, given the target's id."""
+        start = self.__starts[symbol]
+        return Rule(symbol, self.__edges[start:start + self.__lengths[symbol]], self.__recipes[symbol] or '')
+
+    def items(self) -> Iterator[Tuple[str, Rule]]:
+        """Iterate over the rules.
+
+        Yields
+        ------
+        Tuple[str, Rule]
+            The name of the target and the rule, for each rule.
+        """
+        name = self.symbols.name
+        for symbol in self.__order:
+            yield name(symbol), self.__rule(symbol)
+
+    def get(self, target: str) -> Optional[Rule]:
+        """Get the rule of a target.
+
+        Parameters
+        ----------
+        target : str
+            The target's name.
+
+        Returns
+        -------
+        Optional[Rule]
+            The rule, or None if the target has no rule.
+        """
+        symbol = self.symbols.find(target)
+        if symbol is None or self.__recipes[symbol] is None:
+            return None
+        return self.__rule(symbol)
+
+    def __grow(self) -> None:
+        """Make room for the rules of the names added to the symbol table."""
+        missing = len(self.symbols) - len(self.__recipes)
+        if missing:
+            self.__recipes.extend([None] * missing)
+            self.__starts.extend([0] * missing)
+            self.__lengths.extend([0] * missing)
+
+    def add(self, target: str, prerequisites: Iterable[str], recipe: Iterable[str],
+            position: Optional[int] = None) -> int:
+        """Add a rule, replacing the rule of the same target (if any).
+
+        Parameters
+        ----------
+        target : str
+            The target's name.
+        prerequisites : Iterable[str]
+            The names of the prerequisites.
+        recipe : Iterable[str]
+            The commands of the recipe.
+        position : Optional[int]
+            The place of the rule among the rules. Defaults to the end. A
+            replaced rule keeps its place.
+
+        Returns
+        -------
+        int
+            The id of the target.
+        """
+        symbol = self.symbols.intern(target)
+        edges = self.symbols.intern_all(prerequisites)
+        self.__grow()
+        if self.__recipes[symbol] is None:
+            if position is None:
+                self.__order.append(symbol)
+            else:
+                self.__order.insert(position, symbol)
+        else:
+            self.__release_edges(symbol)
+        self.__set_recipe(symbol, '')
+
+        self.__starts[symbol] = len(self.__edges)
+        self.__lengths[symbol] = len(edges)
+        self.__edges.extend(edges)
+
+        self.extend_recipe(symbol, recipe)
+        return symbol
+
+    def __set_recipe(self, symbol: int, recipe: Optional[str]) -> None:
+        """Set the recipe of a rule (None if the target has no rule), sharing
+        it with the other rules and dropping the old one if no rule uses it
+        anymore."""
+        old_recipe = self.__recipes[symbol]
+        if old_recipe:
+            self.__recipe_references[old_recipe] -= 1
+            if not self.__recipe_references[old_recipe]:
+                del self.__recipe_references[old_recipe]
+                del self.__distinct_recipes[old_recipe]
+        if recipe:
+            recipe = self.__distinct_recipes.setdefault(recipe, recipe)
+            self.__recipe_references[recipe] += 1
+        self.__recipes[symbol] = recipe
+
+    def __release_edges(self, symbol: int) -> None:
+        """Mark the prerequisites of a rule as unused, compacting the array of
+        the prerequisites once most of it is unused. The amortized cost is
+        constant, as compacting it takes at least as many releases as the
+        entries it copies."""
+        self.__dead_edges += self.__lengths[symbol]
+        self.__lengths[symbol] = 0
+        if self.__dead_edges * 2 <= len(self.__edges):
+            return
+        edges = array('i')
+        for rule in self.__order:
+            start = self.__starts[rule]
+            self.__starts[rule] = len(edges)
+            edges.extend(self.__edges[start:start + self.__lengths[rule]])
+        self.__edges = edges
+        self.__dead_edges = 0
+
+    def extend_recipe(self, target: int, commands: Iterable[str]) -> None:
+        """Append some commands to the recipe of a rule.
+
+        Parameters
+        ----------
+        target : int
+            The id of the rule's target.
+        commands : Iterable[str]
+            The commands to be appended.
+        """
+        recipe = RECIPE_SEPARATOR.join(commands)
+        if not recipe:
+            return
+        old_recipe = self.__recipes[target]
+        if old_recipe:
+            recipe = old_recipe + RECIPE_SEPARATOR + recipe
+        self.__set_recipe(target, recipe)
+
+    def index(self, target: str) -> int:
+        """Get the place of a rule among the rules.
+
+        Parameters
+        ----------
+        target : str
+            The target's name.
+
+        Returns
+        -------
+        int
+            The number of rules defined before the rule.
+
+        Raises
+        ------
+        ValueError
+            If the target has no rule.
+        """
+        symbol = self.symbols.find(target)
+        if symbol is None or self.__recipes[symbol] is None:
+            raise ValueError("The target '{}' has no rule.".format(target))
+        return self.__order.index(symbol)
+
+    def remove(self, target: str) -> None:
+        """Remove the rule of a target.
+
+        If the target has no rule, do nothing.
+
+        Parameters
+        ----------
+        target : str
+            The target's name.
+        """
+        symbol = self.symbols.find(target)
+        if symbol is not None and self.__recipes[symbol] is not None:
+            self.__order.remove(symbol)
+            self.__set_recipe(symbol, None)
+            self.__release_edges(symbol)
+
+    def prerequisites(self, rule: Rule) -> List[str]:
+        """Get the names of the prerequisites of a rule.
+
+        Parameters
+        ----------
+        rule : Rule
+            The rule.
+
+        Returns
+        -------
+        List[str]
+            The names of the prerequisites.
+        """
+        return self.symbols.names(rule.prerequisites)
+
+    def copy(self) -> 'RuleTable':
+        """Copy the table.
+
+        Returns
+        -------
+        RuleTable
+            A table with the same rules, that can be changed independently.
+        """
+        table = RuleTable()
+        table.symbols.intern_all(self.symbols.names(range(len(self.symbols))))
+        table.__recipes = list(self.__recipes)
+        table.__starts = array('q', self.__starts)
+        table.__lengths = array('i', self.__lengths)
+        table.__edges = array('i', self.__edges)
+        table.__order = array('i', self.__order)
+        table.__dead_edges = self.__dead_edges
+        table.__recipe_references = Counter(self.__recipe_references)
+        table.__distinct_recipes = dict(self.__distinct_recipes)
+        return table
+
+    def clear(self) -> None:
+        """Remove all the rules and all the names."""
+        self.symbols.clear()
+        self.__recipes.clear()
+        self.__starts = array('q')
+        self.__lengths = array('i')
+        self.__edges = array('i')
+        self.__order = array('i')
+        self.__dead_edges = 0
+        self.__recipe_references.clear()
+        self.__distinct_recipes.clear()
@@ -0,0 +1,324 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+
+"""The conversion server.
+
+This module converts Makefiles for long-lived clients (e.g. editors or build
+systems), which would otherwise pay the start-up of the interpreter and of
+the tool for each conversion. The server also keeps the memoized translations
+and the parsed included files from one request to the next.
+
+The server reads requests from its standard input, or from the connections
+to a Unix socket, and writes a response to each request. Requests and
+responses are JSON objects, one per line. A request contains:
+
+* ``makefile``: the content of a Makefile, or ``input``: the path of a
+  Makefile;
+* ``directory`` (optional): the directory the included files and the
+  wildcards are relative to. Defaults to the directory of ``input``, or to
+  the working directory of the server;
+* ``output`` (optional): the path of the batch file to be written. If not
+  given, the batch file is returned in the response;
+* ``options`` (optional): the options of the conversion, named as the
+  command line options: ``dispatch``, ``once``, ``subroutines``,
+  ``incremental``, ``parallel``, ``inline_variables``, ``targets`` (a
+  list) and ``share_recipes``;
+* ``defines`` (optional): an object with the variables defined when
+  converting, overriding the Makefile (as the ``-D`` command line option);
+* ``id`` (optional): any value, copied to the response.
+
+A response contains the ``id`` of its request, ``ok`` (whether the
+conversion succeeded), ``batch`` (the batch file, unless an ``output`` is
+given) and ``diagnostics``: a list of objects with a ``level`` (``error`` or
+``warning``) and a ``message``.
+"""
+
+import argparse
+import json
+import os
+import stat
+import sys
+from collections import Counter
+from typing import Any, Dict, List, Optional, TextIO
+
+import make_to_batch.look_up_table as look_up_table
+from make_to_batch.cache import default_directory
+from make_to_batch.makefile import Makefile
+from make_to_batch.translator import CommandTranslator
+
+OPTIONS = {
+    'dispatch': 'dispatch',
+    'once': 'once',
+    'subroutines': 'subroutines',
+    'incremental': 'incremental',
+    'parallel': 'jobs',
+    'inline_variables': 'inline_variables',
+    'targets': 'targets',
+    'share_recipes': 'share_recipes',
+}
+"""The options accepted by the requests, and the options of
+``Makefile.iter_batch`` they set."""
+
+
+class Server:
+    """A conversion server.
+
+    Attributes
+    ----------
+    makefile : Makefile
+        The Makefile reused by each conversion.
+    requests : int
+        The number of requests handled.
+    """
+
+    def __init__(self, translator: Optional[CommandTranslator] = None) -> None:
+        """Create a server.
+
+        Parameters
+        ----------
+        translator : Optional[CommandTranslator]
+            The translator of the commands. Defaults to the default
+            translator.
+        """
+        self.makefile = Makefile(translator)
+        self.requests = 0
+
+    @staticmethod
+    def __options(options: Any) -> Dict[str, Any]:
+        """Convert the options of a request to the options of a conversion.
+
+        Raises
+        ------
+        ValueError
+            If the options are not an object or an option is unknown.
+        """
+        if not isinstance(options, dict):
+            raise ValueError("The options must be an object.")
+        unknown = sorted(set(options) - set(OPTIONS))
+        if unknown:
+            raise ValueError("Unknown options: {}.".format(', '.join(unknown)))
+        return {OPTIONS[name]: value for name, value in options.items()}
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle a request.
+
+        Parameters
+        ----------
+        request : Dict[str, Any]
+            The request.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The response. The errors are reported in the response, never
+            raised.
+        """
+        self.requests += 1
+        response = {'id': request.get('id')}  # type: Dict[str, Any]
+        passthrough = Counter()  # type: Counter[str]
+        try:
+            options = Server.__options(request.get('options', {}))
+            defines = request.get('defines', {})
+            if not isinstance(defines, dict) or not all(isinstance(value, str) for value in defines.values()):
+                raise ValueError("The defines must be an object of strings.")
+            self.makefile.clear()
+            self.makefile.overrides = defines
+            self.makefile.passthrough = passthrough
+            if 'makefile' in request:
+                self.makefile.parse_file(request['makefile'], request.get('directory', '.'))
+            elif 'input' in request:
+                input_path = request['input']
+                if not os.path.isfile(input_path):
+                    raise FileNotFoundError("The Makefile '{}' does not exists.".format(input_path))
+                with open(input_path, "r") as f:
+                    self.makefile.parse_stream(f, request.get('directory', os.path.dirname(input_path) or '.'))
+            else:
+                raise ValueError("The request contains neither 'makefile' nor 'input'.")
+
+            output_path = request.get('output')
+            if output_path is not None:
+                os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+                self.makefile.save_batch(output_path, **options)
+            else:
+                response['batch'] = self.makefile.to_batch(**options)
+        except Exception as e:
+            response['ok'] = False
+            response['diagnostics'] = [{'level': 'error', 'message': str(e) or type(e).__name__}]
+            return response
+        finally:
+            self.makefile.passthrough = None
+
+        response['ok'] = True
+        response['diagnostics'] = [
+            {'level': 'warning',
+             'message': "'{}' has no batch equivalent: {} command{} copied as it is.".format(
+                 program, amount, ' was' if amount == 1 else 's were')}
+            for program, amount in sorted(passthrough.items())
+        ]
+        return response
+
+    def handle_line(self, line: str) -> str:
+        """Handle a request encoded as a line of JSON.
+
+        Parameters
+        ----------
+        line : str
+            The request.
+
+        Returns
+        -------
+        str
+            The response, encoded as a line of JSON (without the line
+            terminator).
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            request = e
+        if not isinstance(request, dict):
+            self.requests += 1
+            message = "The request is not a JSON object{}".format(
+                ": {}".format(request) if isinstance(request, ValueError) else '.')
+            response = {'id': None, 'ok': False,
+                        'diagnostics': [{'level': 'error', 'message': message}]}  # type: Dict[str, Any]
+        else:
+            response = self.handle(request)
+        return json.dumps(response)
+
+    def serve_stream(self, requests: TextIO, responses: TextIO) -> None:
+        """Handle the requests read from a stream, until it ends.
+
+        Parameters
+        ----------
+        requests : TextIO
+            The stream the requests are read from.
+        responses : TextIO
+            The stream the responses are written to. It is flushed after
+            each response.
+        """
+        for line in requests:
+            if line.strip():
+                responses.write(self.handle_line(line) + '\n')
+                responses.flush()
+
+    def serve_socket(self, path: str, max_connections: Optional[int] = None) -> None:
+        """Handle the requests sent to a Unix socket.
+
+        The connections are served one at a time, each until the client
+        closes it.
+
+        Parameters
+        ----------
+        path : str
+            The path of the socket. A socket left there by another server is
+            replaced, and the socket is removed when the server stops.
+        max_connections : Optional[int]
+            The number of connections after which the server stops. If None,
+            it stops only when interrupted.
+
+        Raises
+        ------
+        OSError
+            If Unix sockets are not supported (e.g. on Windows), or if the
+            path exists and it is not a socket.
+        """
+        import socket
+
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError("Unix sockets are not supported on this platform.")
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise OSError("'{}' exists and it is not a socket.".format(path))
+            os.remove(path)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(path)
+            try:
+                listener.listen(1)
+                connections = 0
+                while max_connections is None or connections < max_connections:
+                    connection, _ = listener.accept()
+                    connections += 1
+                    with connection, connection.makefile('rw', encoding='utf-8', newline='\n') as stream:
+                        self.serve_stream(stream, stream)
+            finally:
+                os.remove(path)
+
+
+def run(argv: Optional[List[str]] = None) -> Optional[int]:
+    """Run the conversion server, until its input ends or it is interrupted.
+
+    Parameters
+    ----------
+    argv : Optional[List[str]]
+        The command line arguments following ``serve``. Defaults to the
+        arguments of the process following ``serve``.
+
+    Returns
+    -------
+    Optional[int]
+        The exit status of the server: 1 if a look-up table is not valid or
+        if the socket can not be created.
+    """
+    parser = argparse.ArgumentParser(
+        prog='make-to-batch serve',
+        description='Convert Makefiles to Batch (Windows) files on request. The requests and the '
+                    'responses are JSON objects, one per line.'
+    )
+    parser.add_argument(
+        '--socket',
+        metavar='PATH',
+        help="read the requests from the connections to a Unix socket "
+             "instead of the standard input"
+    )
+    parser.add_argument(
+        '--table',
+        action='append',
+        default=[],
+        metavar='FILE',
+        help="translate the commands also with the look-up table in FILE "
+             "(JSON, or TOML if its name ends with '.toml'). Can be given many "
+             "times: later tables take precedence"
+    )
+    args = parser.parse_args(sys.argv[2:] if argv is None else argv)
+
+    try:
+        translator = None
+        if args.table:
+            translator = CommandTranslator(compiled=look_up_table.load_tables(args.table, default_directory()))
+    except (OSError, ValueError) as e:
+        print("ERROR: {}".format(e), file=sys.stderr)
+        return 1
+
+    server = Server(translator)
+    try:
+        if args.socket is None:
+            server.serve_stream(sys.stdin, sys.stdout)
+        else:
+            server.serve_socket(args.socket)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("ERROR: {}".format(e), file=sys.stderr)
+        return 1
+    return None
@@ -0,0 +1,360 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The shell module.
+
+This module contains a single-pass lexer and parser for the shell commands of
+the recipes. A command is parsed into a small syntax tree:
+
+* a ``CommandList`` is a sequence of pipelines separated by ``&&``, ``||``,
+  ``;`` or ``&``;
+* a ``Pipeline`` is a sequence of simple commands separated by ``|``;
+* a ``SimpleCommand`` is a sequence of words followed by redirections.
+
+The words keep their quotes and the references to variables they contain
+(e.g. ``$(CC)``, whose parentheses may enclose spaces). Compound commands
+(e.g. ``if`` or subshells) are not recognized: their keywords and parentheses
+are parsed as plain words.
+
+The syntax trees are made of tuples, so they are immutable and they are
+memoized: parsing the same command again returns the same tree.
+"""
+
+import functools
+import re
+from typing import List, NamedTuple, Tuple
+
+WORD = 'word'
+OPERATOR = 'operator'
+REDIRECTION = 'redirection'
+
+LIST_OPERATORS = ('&&', '||', ';', '&')
+"""The operators separating the pipelines of a command list."""
+
+DEFAULT_CACHE_SIZE = 4096
+"""The number of parsed commands remembered."""
+
+Redirection = NamedTuple('Redirection', [
+    ('operator', str),
+    ('target', str),
+])
+
+SimpleCommand = NamedTuple('SimpleCommand', [
+    ('words', Tuple[str, ...]),
+    ('redirections', Tuple[Redirection, ...]),
+])
+
+Pipeline = NamedTuple('Pipeline', [
+    ('commands', Tuple[SimpleCommand, ...]),
+])
+
+CommandList = NamedTuple('CommandList', [
+    ('pipelines', Tuple[Pipeline, ...]),
+    ('operators', Tuple[str, ...]),
+])
+
+_blanks = ' \t\n'
+_metacharacters = ' \t\n|&;<>'
+
+# The common tokens, recognized by a single regular expression: a reference
+# can contain up to two levels of nested parentheses. The tokens it does not
+# recognize are scanned one character at a time.
+_reference = r"\$\((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\)|\$\{[^}]*\}"
+_token_pattern = re.compile(
+    r"""[ \t\n]*(?:"""
+    r"""(?P<redirection>\d*(?:&>>?|[<>]&|>>|[<>]))|"""
+    r"""(?P<operator>&&|\|\||[|;&])|"""
+    r"""(?P<word>(?:[^\s|&;<>'"\\$]+|\\.|'[^']*'|"(?:[^"\\]|\\.)*"|""" + _reference + r"""|\$(?![({]))+(?=[\s|&;<>]|$))"""
+    r""")[ \t\n]*"""
+)
+
+# The commands without quotes, operators, redirections or references
+# containing blanks (or not terminated), whose words are separated by blanks
+_special_pattern = re.compile(r"""['"\\|&;<>]|\$[({][^)}]*(?:\s|$)""")
+
+
+class ShellSyntaxError(ValueError):
+    """Raised when a command is not valid shell syntax."""
+
+
+def _scan_word(command: str, index: int) -> int:
+    """Find the end of the word starting at an index.
+
+    Parameters
+    ----------
+    command : str
+        The command.
+    index : int
+        The start of the word.
+
+    Returns
+    -------
+    int
+        The index following the word.
+
+    Raises
+    ------
+    ShellSyntaxError
+        If a quote or a reference is not terminated.
+    """
+    length = len(command)
+    while index < length:
+        char = command[index]
+        if char in _metacharacters:
+            break
+        if char == '\\':
+            index += 2
+        elif char == "'":
+            end = command.find("'", index + 1)
+            if end == -1:
+                raise ShellSyntaxError("Unterminated quote in: {}".format(command))
+            index = end + 1
+        elif char == '"':
+            index += 1
+            while index < length and command[index] != '"':
+                index += 2 if command[index] == '\\' else 1
+            if index >= length:
+                raise ShellSyntaxError("Unterminated quote in: {}".format(command))
+            index += 1
+        elif char == '$' and index + 1 < length and command[index + 1] in '({':
+            opening = command[index + 1]
+            closing = ')' if opening == '(' else '}'
+            depth = 1
+            index += 2
+            while index < length and depth:
+                if command[index] == opening:
+                    depth += 1
+                elif command[index] == closing:
+                    depth -= 1
+                index += 1
+            if depth:
+                raise ShellSyntaxError("Unterminated reference in: {}".format(command))
+        else:
+            index += 1
+    return min(index, length)
+
+
+def tokenize(command: str) -> List[Tuple[str, str]]:
+    """Split a command into tokens, in a single pass.
+
+    The common tokens are recognized with a regular expression, falling back
+    to scanning the command one character at a time.
+
+    Parameters
+    ----------
+    command : str
+        The command.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        The kind (``WORD``, ``OPERATOR`` or ``REDIRECTION``) and the text of
+        each token. The text of a redirection is its operator (including the
+        file descriptor, if any) and its target, separated by a space.
+
+    Raises
+    ------
+    ShellSyntaxError
+        If the command is not valid shell syntax.
+    """
+    tokens = []  # type: List[Tuple[str, str]]
+    length = len(command)
+    index = 0
+    redirection = None
+    while index < length:
+        match = _token_pattern.match(command, index)
+        if match is None or match.end() == index:
+            break
+        if match.lastgroup == 'word' and redirection is not None:
+            tokens.append((REDIRECTION, redirection + ' ' + match.group('word')))
+            redirection = None
+        elif redirection is not None:
+            break
+        elif match.lastgroup == 'redirection':
+            redirection = match.group('redirection')
+        elif match.lastgroup == 'operator':
+            tokens.append((OPERATOR, match.group('operator')))
+        else:
+            tokens.append((WORD, match.group('word')))
+        index = match.end()
+    else:
+        if redirection is None:
+            return tokens
+    if redirection is not None:
+        # Scan the redirection again
+        index = command.rindex(redirection, 0, index)
+
+    while index < length:
+        char = command[index]
+        if char in _blanks:
+            index += 1
+            continue
+
+        # A file descriptor immediately followed by a redirection
+        start = index
+        while index < length and command[index].isdigit():
+            index += 1
+        if index == start or index >= length or command[index] not in '<>':
+            index = start
+
+        char = command[index]
+        if char in '<>' or command.startswith('&>', index):
+            operator_end = index + (2 if char == '&' else 1)
+            if command.startswith('>', operator_end) and char != '<':
+                operator_end += 1
+            elif command.startswith('&', operator_end):
+                operator_end += 1
+            operator = command[start:operator_end]
+            index = operator_end
+            if operator.endswith('&') and index < length and (command[index].isdigit() or command[index] == '-'):
+                # Duplicating a file descriptor (e.g. 2>&1)
+                target_end = index + 1
+                while target_end < length and command[target_end].isdigit():
+                    target_end += 1
+            else:
+                while index < length and command[index] in _blanks:
+                    index += 1
+                target_end = _scan_word(command, index)
+                if target_end == index:
+                    raise ShellSyntaxError("Missing target of '{}' in: {}".format(operator, command))
+            tokens.append((REDIRECTION, operator + ' ' + command[index:target_end]))
+            index = target_end
+        elif char in '|&;':
+            operator = command[index:index + 2]
+            if operator not in ('&&', '||'):
+                operator = char
+            tokens.append((OPERATOR, operator))
+            index += len(operator)
+        else:
+            end = _scan_word(command, index)
+            tokens.append((WORD, command[index:end]))
+            index = end
+    return tokens
+
+
+def split_words(command: str) -> List[str]:
+    """Split a command into its words, leaving out its operators and its
+    redirections.
+
+    Parameters
+    ----------
+    command : str
+        The command.
+
+    Returns
+    -------
+    List[str]
+        The words of the command.
+
+    Raises
+    ------
+    ShellSyntaxError
+        If the command is not valid shell syntax.
+    """
+    if not _special_pattern.search(command):
+        return command.split()
+    return [text for kind, text in tokenize(command) if kind == WORD]
+
+
+@functools.lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def parse(command: str) -> CommandList:
+    """Parse a command into its syntax tree.
+
+    The trees are memoized, so parsing a command again is a lookup.
+
+    Parameters
+    ----------
+    command : str
+        The command.
+
+    Returns
+    -------
+    CommandList
+        The syntax tree of the command.
+
+    Raises
+    ------
+    ShellSyntaxError
+        If the command is not valid shell syntax.
+    """
+    if command.strip() and not _special_pattern.search(command):
+        return CommandList((Pipeline((SimpleCommand(tuple(command.split()), ()),)),), ())
+
+    pipelines = []  # type: List[Pipeline]
+    operators = []  # type: List[str]
+    commands = []  # type: List[SimpleCommand]
+    words = []  # type: List[str]
+    redirections = []  # type: List[Redirection]
+
+    # An empty operator marks the end of the command
+    for kind, text in tokenize(command) + [(OPERATOR, '')]:
+        if kind == WORD:
+            words.append(text)
+        elif kind == REDIRECTION:
+            operator, target = text.split(' ', 1)
+            redirections.append(Redirection(operator, target))
+            continue
+        else:
+            if words or redirections:
+                commands.append(SimpleCommand(tuple(words), tuple(redirections)))
+                words, redirections = [], []
+            elif commands or text not in (';', ''):
+                # Only a list can end without a command, e.g. "a; b;"
+                raise ShellSyntaxError("Missing command {} in: {}".format(
+                    "before '{}'".format(text) if text else 'at the end', command))
+            if text == '|':
+                continue
+            if commands:
+                pipelines.append(Pipeline(tuple(commands)))
+                operators.append(text)
+                commands = []
+
+    # The last operator only terminates the list
+    return CommandList(tuple(pipelines), tuple(operators[:-1]))
+
+
+def program_arguments(command: SimpleCommand) -> Tuple[str, List[str], List[str]]:
+    """Split a simple command into its program, its options and its
+    parameters.
+
+    Parameters
+    ----------
+    command : SimpleCommand
+        The command.
+
+    Returns
+    -------
+    Tuple[str, List[str], List[str]]
+        The program, the options (the words starting with a dash, before a
+        ``--`` word) and the other words.
+    """
+    options = []  # type: List[str]
+    parameters = []  # type: List[str]
+    all_parameters = False
+    for word in command.words[1:]:
+        if word == '--':
+            all_parameters = True
+        elif word.startswith('-') and not all_parameters:
+            options.append(word)
+        else:
+            parameters.append(word)
+    return (command.words[0] if command.words else ''), options, parameters
@@ -0,0 +1,162 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The statistics module.
+
+This module contains the statistics collected while converting Makefiles:
+the time spent in each phase of the conversion and a few counters. The
+statistics are only collected when a ``Statistics`` object is given to the
+Makefile, so a conversion without statistics pays nothing for them.
+"""
+
+import contextlib
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterator
+
+PHASES = (
+    'read', 'strip comments', 'fold continuations', 'tokenize',
+    'variables', 'rules', 'translate', 'emit',
+)
+"""The phases of a conversion, in the order they happen."""
+
+
+class Statistics:
+    """The statistics of one or more conversions.
+
+    Attributes
+    ----------
+    timings : Dict[str, float]
+        The time (in seconds) spent in each phase.
+    counters : Dict[str, int]
+        The counters, e.g. the number of rules or of recipe lines.
+    programs : Counter[str]
+        For each program found in the recipes and translated with the
+        look-up table, the number of times it was found.
+    passthrough : Counter[str]
+        For each program found in the recipes and copied as it is (because
+        the look-up table does not know it), the number of times it was found.
+    """
+
+    def __init__(self) -> None:
+        """Create empty statistics."""
+        self.timings = OrderedDict((phase, 0.0) for phase in PHASES)  # type: Dict[str, float]
+        self.counters = {}  # type: Dict[str, int]
+        self.programs = Counter()  # type: Counter[str]
+        self.passthrough = Counter()  # type: Counter[str]
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        """Add some time to a phase.
+
+        Parameters
+        ----------
+        phase : str
+            The phase's name.
+        seconds : float
+            The time to be added.
+        """
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """Measure the time spent in a block of code.
+
+        Parameters
+        ----------
+        phase : str
+            The phase the time is added to.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        """Increment a counter.
+
+        Parameters
+        ----------
+        counter : str
+            The counter's name.
+        amount : int
+            The increment.
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def merge(self, other: 'Statistics') -> None:
+        """Add the statistics of other conversions to these statistics.
+
+        Parameters
+        ----------
+        other : Statistics
+            The statistics to be added.
+        """
+        for phase, seconds in other.timings.items():
+            self.add_time(phase, seconds)
+        for counter, amount in other.counters.items():
+            self.count(counter, amount)
+        self.programs.update(other.programs)
+        self.passthrough.update(other.passthrough)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the statistics to a dictionary that can be dumped as JSON.
+
+        Returns
+        -------
+        Dict[str, Any]
+            A dictionary containing the ``timings``, the ``counters``, the
+            ``programs`` and the ``passthrough`` programs.
+        """
+        return {
+            'timings': dict(self.timings),
+            'counters': dict(sorted(self.counters.items())),
+            'programs': dict(self.programs.most_common()),
+            'passthrough': dict(self.passthrough.most_common()),
+        }
+
+    def format(self) -> str:
+        """Format the statistics as a human readable report.
+
+        Returns
+        -------
+        str
+            The report.
+        """
+        total = sum(self.timings.values())
+        lines = ["Time spent per phase:"]
+        for phase, seconds in self.timings.items():
+            share = seconds / total * 100 if total else 0.0
+            lines.append("  {:<20}{:>10.2f} ms{:>7.1f}%".format(phase, seconds * 1000, share))
+        lines.append("  {:<20}{:>10.2f} ms".format('total', total * 1000))
+        lines.append("Counters:")
+        for counter, amount in sorted(self.counters.items()):
+            lines.append("  {:<20}{:>10}".format(counter, amount))
+        if self.programs:
+            lines.append("Translated programs:")
+            for program, amount in self.programs.most_common():
+                lines.append("  {:<20}{:>10}".format(program, amount))
+        if self.passthrough:
+            lines.append("Programs copied as they are:")
+            for program, amount in self.passthrough.most_common():
+                lines.append("  {:<20}{:>10}".format(program, amount))
+        return '\n'.join(lines)
@@ -0,0 +1,226 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The command translator.
+
+This module contains the engine used to translate the commands of a recipe to
+their batch equivalent. The look-up table is compiled once, when the
+translator is created, and the translated commands are memoized: Makefiles
+tend to repeat the same commands over and over, and each of them is
+translated only once.
+"""
+
+import functools
+import re
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import make_to_batch.look_up_table as look_up_table
+import make_to_batch.shell as shell
+
+DEFAULT_CACHE_SIZE = 4096
+"""The default number of translated commands remembered by a translator."""
+
+Translation = Tuple[str, Tuple[Tuple[str, bool], ...]]
+"""A translated command, with the program of each of its simple commands and
+whether the simple command was translated."""
+
+_list_operators = {'&&': ' && ', '||': ' || ', ';': ' & ', '&': ' & '}
+_null_devices = {'/dev/null': 'NUL'}
+_variable_pattern = re.compile(r"\$[({](.*?)[)}]")
+_make_pattern = re.compile(r"%MAKE%")
+
+
+def batch_references(text: str) -> str:
+    """Convert the references to variables in a text to their batch syntax.
+
+    Parameters
+    ----------
+    text : str
+        The text to be converted.
+
+    Returns
+    -------
+    str
+        The text, where each ``$(NAME)`` or ``${NAME}`` became ``%NAME%``.
+    """
+    return _variable_pattern.sub(r"%\1%", text)
+
+
+def _log_command(program: str, options: List[str], parameters: List[str]) -> None:
+    """Log a command found in a recipe.
+
+    Logging is slow to import, so it is not imported here: the messages can
+    only be handled if the application configured logging, which imported it.
+    """
+    logging = sys.modules.get('logging')
+    if logging is not None:
+        # The message is only formatted if it is going to be logged
+        logging.getLogger(__name__).info("FOUND COMMAND: %s\n\tOPTIONS: %s\n\tPARAMETERS: %s",
+                                         program, options, parameters)
+
+
+class CommandTranslator:
+    """A translator of Makefile commands to batch commands.
+
+    Attributes
+    ----------
+    table : look_up_table.CompiledTable
+        The compiled look-up table.
+    """
+
+    def __init__(self, table: Dict[str, 'look_up_table.LookUpTableContent'] = look_up_table.linux_to_dos,
+                 cache_size: int = DEFAULT_CACHE_SIZE, compiled: Optional[look_up_table.CompiledTable] = None):
+        """Create a translator.
+
+        Parameters
+        ----------
+        table : Dict[str, LookUpTableContent]
+            The look-up table used to translate the commands. It is compiled
+            now, so later changes to it are ignored.
+        cache_size : int
+            The number of translated commands to be remembered.
+        compiled : Optional[look_up_table.CompiledTable]
+            The look-up table, already compiled (e.g. by
+            ``look_up_table.load_tables``). If given, ``table`` is ignored.
+        """
+        self.table = compiled if compiled is not None else look_up_table.compile_table(table)
+        self.__memo = functools.lru_cache(maxsize=cache_size)(self.__translate)
+
+    def translate(self, command: str) -> str:
+        """Convert a Makefile command to a batch command.
+
+        Parameters
+        ----------
+        command : str
+            The command to be converted.
+
+        Returns
+        -------
+        str
+            The equivalent command in batch. If no equivalent command is found, return the starting command.
+        """
+        return self.__memo(command)[0]
+
+    def translate_with_programs(self, command: str) -> Translation:
+        """Convert a Makefile command to a batch command, telling which of its
+        programs were translated.
+
+        Parameters
+        ----------
+        command : str
+            The command to be converted.
+
+        Returns
+        -------
+        Translation
+            The equivalent command in batch and, for each simple command,
+            its program and whether it was translated or passed through
+            unchanged.
+        """
+        return self.__memo(command)
+
+    def cache_info(self) -> Any:
+        """Get the statistics of the memoized translations.
+
+        Returns
+        -------
+        functools._CacheInfo
+            A named tuple containing the number of ``hits`` and ``misses``,
+            the ``maxsize`` and the ``currsize`` of the memo.
+        """
+        return self.__memo.cache_info()
+
+    def cache_clear(self) -> None:
+        """Forget all the memoized translations and reset the statistics."""
+        self.__memo.cache_clear()
+
+    def __translate(self, old_command: str) -> Translation:
+        """Convert a Makefile command to a batch command, without memoization.
+
+        The command is parsed once into its syntax tree, which is then walked
+        to translate each simple command. Commands that are not valid shell
+        syntax are passed through unchanged.
+
+        Parameters
+        ----------
+        old_command : str
+            The command to be converted.
+
+        Returns
+        -------
+        Translation
+            The equivalent command in batch and the programs of its simple
+            commands.
+        """
+        old_command = old_command.strip()
+        try:
+            tree = shell.parse(old_command)
+        except shell.ShellSyntaxError:
+            program = old_command.split(None, 1)[0] if old_command else ''
+            return self.__finish(old_command), ((program, False),)
+
+        parts = []  # type: List[str]
+        programs = []  # type: List[Tuple[str, bool]]
+        number_of_dir_changed = 0
+        for index, pipeline in enumerate(tree.pipelines):
+            if index:
+                parts.append(_list_operators[tree.operators[index - 1]])
+            commands = []  # type: List[str]
+            for command in pipeline.commands:
+                program, options, parameters = shell.program_arguments(command)
+
+                _log_command(program, options, parameters)
+
+                if program == "cd" and len(pipeline.commands) == 1:
+                    number_of_dir_changed += 1
+                    batch_command = "PUSHD " + ' '.join(command.words[1:])
+                    programs.append((program, True))
+                elif program in self.table:
+                    entry = look_up_table.select_entry(program, options, self.table)
+                    batch_program, batch_options, batch_flags = self.table[entry]
+                    batch_command = (batch_program + " " + ' '.join(parameters) + ' ' +
+                                     ' '.join(look_up_table.translate_option(option, batch_options, batch_flags)
+                                              for option in options))
+                    programs.append((program, True))
+                else:
+                    batch_command = ' '.join(command.words)
+                    programs.append((program, False))
+                for redirection in command.redirections:
+                    target = _null_devices.get(redirection.target, redirection.target)
+                    batch_command += " " + redirection.operator + target
+                commands.append(batch_command)
+            parts.append(' | '.join(commands))
+
+        for _ in range(number_of_dir_changed):
+            parts.append(" && POPD")
+        return self.__finish(''.join(parts)), tuple(programs)
+
+    @staticmethod
+    def __finish(command: str) -> str:
+        """Convert the references to variables and to ``$(MAKE)`` of a
+        translated command."""
+        return _make_pattern.sub(r"CALL make.bat", batch_references(command))
+
+
+default_translator = CommandTranslator()
+"""The translator shared by the Makefiles that are not given one."""
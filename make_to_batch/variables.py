@@ -0,0 +1,357 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The variables module.
+
+This module contains the table holding the variables of a Makefile. The table
+follows the semantics of GNU make: recursively expanded variables (assigned
+with ``=``, ``?=`` or ``+=``) are expanded each time they are used, simply
+expanded variables (assigned with ``:=`` or ``::=``) are expanded once, when
+they are assigned.
+
+The variables are resolved at conversion time whenever possible. A reference
+can not be resolved if it names a variable that is not defined in the Makefile
+(e.g. an environment variable), a function unknown to the table (e.g.
+``$(shell ...)``) or an automatic variable (e.g. ``$@``): such references are
+kept as they are, to be expanded at run time. A variable is constant if its value contains no such
+reference, directly or through the variables it references.
+"""
+
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import make_to_batch.graph as graph
+
+RECURSIVE = 'recursive'
+SIMPLE = 'simple'
+
+
+class RecursiveVariableError(Exception):
+    """Raised when a recursively expanded variable references itself.
+
+    Attributes
+    ----------
+    cycle : List[str]
+        The variables forming the cycle, the first one being repeated at the
+        end.
+    """
+
+    def __init__(self, cycle: List[str]):
+        super().__init__("Recursive variable '{}' references itself (eventually): {}.".format(
+            cycle[0], ' -> '.join(cycle)))
+        self.cycle = cycle
+
+
+def references(text: str) -> Iterator[Tuple[int, int, str]]:
+    """Find the references in a text.
+
+    Parameters
+    ----------
+    text : str
+        The text to be scanned.
+
+    Yields
+    ------
+    Tuple[int, int, str]
+        The start and the end of each reference in the text, and the text
+        between its parentheses (or its only character, for references such
+        as ``$@`` or ``$$``). Nested references are not yielded.
+    """
+    start = text.find('$')
+    while start != -1 and start + 1 < len(text):
+        opening = text[start + 1]
+        if opening not in '({':
+            yield start, start + 2, opening
+            start = text.find('$', start + 2)
+            continue
+
+        closing = ')' if opening == '(' else '}'
+        depth = 1
+        end = start + 2
+        while end < len(text) and depth:
+            if text[end] == opening:
+                depth += 1
+            elif text[end] == closing:
+                depth -= 1
+            end += 1
+        if depth:
+            # An unterminated reference
+            return
+        yield start, end, text[start + 2:end - 1]
+        start = text.find('$', end)
+
+
+def _is_name(name: str) -> bool:
+    """Check if the content of a reference is a plain variable name (and not a
+    function call or a substitution reference)."""
+    return bool(name) and not any(char in name for char in ' \t,:=')
+
+
+def _function_call(content: str) -> Tuple[str, str]:
+    """Split the content of a reference into the name of a function and its
+    argument."""
+    words = content.split(None, 1)
+    return (words[0] if words else ''), (words[1].strip() if len(words) > 1 else '')
+
+
+Function = Callable[[str], str]
+"""A function that can be called at conversion time, given its (expanded)
+argument."""
+
+
+class VariableTable:
+    """The variables of a Makefile.
+
+    The expansions of the recursively expanded variables are memoized, so
+    each variable is expanded at most once however many times it is
+    referenced. The memo is cleared whenever a variable changes.
+    """
+
+    def __init__(self, functions: Optional[Dict[str, Function]] = None) -> None:
+        """Create an empty table.
+
+        Parameters
+        ----------
+        functions : Optional[Dict[str, Function]]
+            The functions called at conversion time, by name (e.g.
+            ``wildcard``). The calls to the other functions are kept as they
+            are.
+        """
+        self.__functions = functions or {}
+        # For each variable: its flavor, its value and whether the value is
+        # constant (only meaningful for simply expanded variables)
+        self.__variables = {}  # type: Dict[str, Tuple[str, str, bool]]
+        self.__memo = {}  # type: Dict[str, Tuple[str, bool]]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__variables
+
+    def __len__(self) -> int:
+        return len(self.__variables)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__variables)
+
+    def value(self, name: str) -> str:
+        """Get the value of a variable, as it was assigned.
+
+        Parameters
+        ----------
+        name : str
+            The variable's name.
+
+        Returns
+        -------
+        str
+            The variable's value. Simply expanded variables are returned
+            already expanded.
+        """
+        return self.__variables[name][1]
+
+    def flavor(self, name: str) -> str:
+        """Get the flavor of a variable: ``RECURSIVE`` or ``SIMPLE``."""
+        return self.__variables[name][0]
+
+    def assign(self, name: str, operator: str, value: str) -> None:
+        """Assign a variable as done by an assignment operator.
+
+        Parameters
+        ----------
+        name : str
+            The variable's name.
+        operator : str
+            The assignment operator: ``=``, ``:=``, ``::=``, ``?=``, ``+=`` or
+            ``!=``. The commands of ``!=`` can not be run at conversion time,
+            so the variable is assigned the command itself.
+        value : str
+            The assigned value.
+        """
+        if operator == '?=' and name in self.__variables:
+            return
+
+        if operator in (':=', '::='):
+            value, constant = self.__expand(value, [])
+            self.__set(name, SIMPLE, value, constant)
+        elif operator == '+=' and name in self.__variables:
+            flavor, old_value, constant = self.__variables[name]
+            if flavor == SIMPLE:
+                value, value_constant = self.__expand(value, [])
+                constant = constant and value_constant
+            if old_value and value:
+                value = old_value + ' ' + value
+            self.__set(name, flavor, value or old_value, constant)
+        else:
+            self.__set(name, RECURSIVE, value, True)
+
+    def __set(self, name: str, flavor: str, value: str, constant: bool) -> None:
+        """Set a variable and clear the memoized expansions."""
+        self.__variables[name] = (flavor, value, constant)
+        self.__memo.clear()
+
+    def remove(self, name: str) -> None:
+        """Remove a variable from the table.
+
+        If the variable is not in the table, do nothing.
+
+        Parameters
+        ----------
+        name : str
+            The variable to be removed.
+        """
+        if name in self.__variables:
+            del self.__variables[name]
+            self.__memo.clear()
+
+    def clear(self) -> None:
+        """Remove all the variables from the table."""
+        self.__variables.clear()
+        self.__memo.clear()
+
+    def resolve(self, name: str) -> Tuple[str, bool]:
+        """Expand a variable.
+
+        Parameters
+        ----------
+        name : str
+            The variable's name.
+
+        Returns
+        -------
+        Tuple[str, bool]
+            The expanded value of the variable and whether it is constant. The
+            references that can not be resolved are kept in the value.
+
+        Raises
+        ------
+        RecursiveVariableError
+            If the variable references itself.
+        """
+        return self.__resolve(name, [])
+
+    def expand(self, text: str) -> Tuple[str, bool]:
+        """Expand the references in a text.
+
+        Parameters
+        ----------
+        text : str
+            The text to be expanded.
+
+        Returns
+        -------
+        Tuple[str, bool]
+            The expanded text and whether it is constant. The references that
+            can not be resolved are kept in the text.
+
+        Raises
+        ------
+        RecursiveVariableError
+            If a referenced variable references itself.
+        """
+        return self.__expand(text, [])
+
+    def __resolve(self, name: str, active: List[str]) -> Tuple[str, bool]:
+        """Expand a variable, given the variables being expanded."""
+        if name in self.__memo:
+            return self.__memo[name]
+
+        flavor, value, constant = self.__variables[name]
+        if flavor == SIMPLE:
+            return value, constant
+
+        if name in active:
+            raise RecursiveVariableError(active[active.index(name):] + [name])
+        active.append(name)
+        result = self.__expand(value, active)
+        active.pop()
+        self.__memo[name] = result
+        return result
+
+    def __expand(self, text: str, active: List[str]) -> Tuple[str, bool]:
+        """Expand the references in a text, given the variables being
+        expanded."""
+        if '$' not in text:
+            return text, True
+
+        parts = []  # type: List[str]
+        constant = True
+        last = 0
+        for start, end, content in references(text):
+            parts.append(text[last:start])
+            last = end
+            if content == '$':
+                parts.append('$')
+                continue
+
+            name, name_constant = self.__expand(content, active) if '$' in content else (content, True)
+            function, argument = _function_call(name) if name_constant and not _is_name(name) else ('', '')
+            if name_constant and _is_name(name) and name in self.__variables:
+                value, value_constant = self.__resolve(name, active)
+                parts.append(value)
+                constant = constant and value_constant
+            elif function in self.__functions:
+                parts.append(self.__functions[function](argument))
+            else:
+                constant = False
+                parts.append(text[start:end] if name == content else '$(' + name + ')')
+        parts.append(text[last:])
+        return ''.join(parts), constant
+
+    def dependencies(self) -> Dict[str, List[str]]:
+        """Get the dependency graph of the variables.
+
+        Returns
+        -------
+        Dict[str, List[str]]
+            For each variable, the defined variables its value references.
+        """
+        result = {}  # type: Dict[str, List[str]]
+        for name, (_, value, _) in self.__variables.items():
+            result[name] = [content for _, _, content in references(value)
+                            if content in self.__variables and _is_name(content)]
+        return result
+
+    def resolved_items(self) -> Iterator[Tuple[str, str, bool]]:
+        """Expand all the variables, in dependency order.
+
+        Yields
+        ------
+        Tuple[str, str, bool]
+            The name, the expanded value of each variable and whether the value
+            is constant. Each variable comes after the variables it
+            references, and otherwise in the order they were defined.
+
+        Raises
+        ------
+        RecursiveVariableError
+            If the variables reference each other.
+        """
+        try:
+            order = graph.topological_order(self.dependencies())
+        except graph.CyclicDependencyError as e:
+            raise RecursiveVariableError(e.cycle) from e
+        for name in order:
+            value, constant = self.__resolve(name, [])
+            yield name, value, constant
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Get the expanded value of a variable, or a default value if the
+        variable is not defined."""
+        return self.resolve(name)[0] if name in self.__variables else default
@@ -0,0 +1,280 @@
+#  MIT License
+#
+#  Copyright (c) 2019 Andrea Esposito
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+
+"""The watch module.
+
+This module keeps the batch file of a Makefile up to date while the Makefile
+is edited. The Makefile and the files it includes are polled, and when they
+change the batch file is converted again, reusing as much as possible of the
+previous conversion:
+
+* the Makefile is split into blocks, each starting with the header of a rule.
+  When only some blocks change, only they are tokenized again, and if they
+  only contain plain rules, these rules are replaced in place, without
+  parsing the whole Makefile again;
+* the sections of the batch file converting the rules that did not change
+  are reused as they are.
+
+Any other change (e.g. to a variable or to an included file) parses the whole
+Makefile again, still reusing the sections of the unchanged rules.
+"""
+
+import bisect
+import os
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import make_to_batch.lexer as lexer
+from make_to_batch.fragments import default_fragment_cache
+from make_to_batch.makefile import Makefile
+from make_to_batch.translator import CommandTranslator
+
+FULL = 'full'
+"""The kind of update parsing the whole Makefile again."""
+
+INCREMENTAL = 'incremental'
+"""The kind of update replacing only the changed rules."""
+
+
+def _common_affixes(old: List[str], new: List[str]) -> Tuple[int, int]:
+    """Get the number of leading and of trailing lines two versions of a
+    file share. The shared lines never overlap."""
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+class Watcher:
+    """A Makefile whose batch file is kept up to date.
+
+    Attributes
+    ----------
+    input_path : str
+        The Makefile.
+    output_path : str
+        The batch file.
+    options : Dict[str, Any]
+        The options of the conversion, as accepted by ``Makefile.iter_batch``.
+    makefile : Makefile
+        The parsed Makefile.
+    """
+
+    def __init__(self, input_path: str, output_path: str, options: Dict[str, Any],
+                 translator: Optional[CommandTranslator] = None, defines: Optional[Dict[str, str]] = None):
+        """Watch a Makefile.
+
+        Parameters
+        ----------
+        input_path : str
+            The Makefile.
+        output_path : str
+            The batch file.
+        options : Dict[str, Any]
+            The options of the conversion.
+        translator : Optional[CommandTranslator]
+            The translator of the commands. Defaults to the default
+            translator.
+        defines : Optional[Dict[str, str]]
+            The variables defined when converting, overriding the Makefile.
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.options = options
+        self.makefile = Makefile(translator, reuse_sections=True, overrides=defines)
+        # The lines of the Makefile, the lines starting its rules and the
+        # number of definitions of each target, as of the last update
+        self.__lines = None  # type: Optional[List[str]]
+        self.__starts = []  # type: List[int]
+        self.__definitions = Counter()  # type: Counter[str]
+        # The modification time and the size of the Makefile and of the
+        # files it includes
+        self.__signatures = {}  # type: Dict[str, Optional[Tuple[int, int]]]
+
+    @staticmethod
+    def __signature(path: str) -> Optional[Tuple[int, int]]:
+        """Get the modification time and the size of a file (None if it does
+        not exist)."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        """Check if the Makefile or the files it includes changed since the
+        last update.
+
+        Returns
+        -------
+        bool
+            Whether the batch file must be updated.
+        """
+        if not self.__signatures:
+            return True
+        return any(Watcher.__signature(path) != signature for path, signature in self.__signatures.items())
+
+    def update(self) -> Optional[str]:
+        """Update the batch file, if the Makefile changed.
+
+        Returns
+        -------
+        Optional[str]
+            The kind of update: ``FULL`` or ``INCREMENTAL``. None if nothing
+            changed.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the Makefile (or a file it includes) does not exist.
+        """
+        if not self.changed():
+            return None
+        included_changed = any(Watcher.__signature(path) != signature
+                               for path, signature in self.__signatures.items() if path != self.input_path)
+        signature = Watcher.__signature(self.input_path)
+        kind = None
+        try:
+            with open(self.input_path, "r") as f:
+                lines = f.read().splitlines()
+            if self.__lines is not None and not included_changed and self.__replace_blocks(lines):
+                kind = INCREMENTAL
+            elif lines != self.__lines or included_changed:
+                self.__parse(lines)
+                kind = FULL
+        except Exception:
+            # The next change parses the whole Makefile again
+            self.__lines = None
+            self.__signatures = {self.input_path: signature}
+            raise
+
+        if kind is not None:
+            self.makefile.save_batch(self.output_path, **self.options)
+        self.__signatures = {path: Watcher.__signature(path) for path in self.makefile.included}
+        self.__signatures[self.input_path] = signature
+        return kind
+
+    def __parse(self, lines: List[str]) -> None:
+        """Parse the whole Makefile.
+
+        Parameters
+        ----------
+        lines : List[str]
+            The lines of the Makefile.
+        """
+        self.__lines = None
+        tokens = list(lexer.tokenize(lines))
+        self.makefile.clear()
+        self.makefile.parse_tokens(tokens, os.path.dirname(self.input_path) or '.')
+
+        definitions = Counter(token.name for token in tokens if token.kind == lexer.RULE)
+        for path in self.makefile.included:
+            definitions.update(token.name for token in default_fragment_cache.tokens(path)
+                               if token.kind == lexer.RULE)
+        self.__definitions = definitions
+        self.__starts = lexer.rule_starts(lines)[0]
+        self.__lines = lines
+
+    def __replace_blocks(self, lines: List[str]) -> bool:
+        """Replace the rules of the blocks of the Makefile that changed.
+
+        Parameters
+        ----------
+        lines : List[str]
+            The new lines of the Makefile.
+
+        Returns
+        -------
+        bool
+            Whether the rules were replaced. If not, the Makefile is unchanged
+            and it must be parsed again.
+        """
+        old_lines = self.__lines
+        starts = self.__starts
+        assert old_lines is not None
+        prefix, suffix = _common_affixes(old_lines, lines)
+        if prefix == len(old_lines) == len(lines):
+            return False
+
+        # The changed blocks: from the block containing the first changed
+        # line, to the first block following the last changed line
+        block = bisect.bisect_right(starts, prefix) - 1
+        while block >= 0 and lexer.rule_starts(lines, starts[block], starts[block] + 1)[0] != [starts[block]]:
+            # The changed line no longer starts a rule
+            block -= 1
+        if block < 0:
+            return False
+        start = starts[block]
+        following = bisect.bisect_left(starts, max(len(old_lines) - suffix, start + 1))
+        end = starts[following] if following < len(starts) else len(old_lines)
+        shift = len(lines) - len(old_lines)
+        new_starts, closed = lexer.rule_starts(lines, start, end + shift)
+        if not closed and following < len(starts):
+            # A change (e.g. an unterminated define) extends past the blocks
+            return False
+
+        old_tokens = list(lexer.tokenize(old_lines[start:end]))
+        new_tokens = list(lexer.tokenize(lines[start:end + shift]))
+        old_targets = [token.name for token in old_tokens if token.kind == lexer.RULE]
+        new_targets = [token.name for token in new_tokens if token.kind == lexer.RULE]
+        if any(self.__definitions[target] != 1 for target in old_targets):
+            return False
+        known, after = self.__previous_target(block)
+        if not known or not self.makefile.replace_rules(old_tokens, new_tokens, after):
+            return False
+
+        self.__definitions.subtract(old_targets)
+        self.__definitions.update(new_targets)
+        self.__starts = starts[:block] + new_starts + [line + shift for line in starts[following:]]
+        self.__lines = lines
+        return True
+
+    def __previous_target(self, block: int) -> Tuple[bool, Optional[str]]:
+        """Get the target of the last rule preceding a block.
+
+        Parameters
+        ----------
+        block : int
+            The index of the block.
+
+        Returns
+        -------
+        Tuple[bool, Optional[str]]
+            Whether the rule is known and its target (None if no rule precedes
+            the block). The rule is not known if, for example, the block is
+            preceded by an include directive.
+        """
+        if block == 0:
+            return not self.makefile.included, None
+        assert self.__lines is not None
+        tokens = list(lexer.tokenize(self.__lines[self.__starts[block - 1]:self.__starts[block]]))
+        rules = [index for index, token in enumerate(tokens) if token.kind == lexer.RULE]
+        if not rules:
+            return False, None
+        last = tokens[rules[-1]].name
+        known = (self.__definitions[last] == 1 and
+                 all(token.kind == lexer.RECIPE for token in tokens[rules[-1] + 1:]))
+        return known, last
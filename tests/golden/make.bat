@@ -0,0 +1,53 @@
+@echo off
+
+SET SRC=src
+SET OUT=build\bin
+SET CFLAGS=-O2 -Wall
+
+IF /I "%1"=="all" GOTO all
+IF /I "%1"=="dirs" GOTO dirs
+IF /I "%1"=="build/bin/app" GOTO build/bin/app
+IF /I "%1"=="main.o" GOTO main.o
+IF /I "%1"=="util.o" GOTO util.o
+IF /I "%1"=="clean" GOTO clean
+IF /I "%1"=="" GOTO all
+GOTO error
+
+:all
+	CALL make.bat dirs
+	CALL make.bat build/bin/app
+	echo Built %OUT%/app
+	GOTO :EOF
+
+:dirs
+	MKDIR %OUT% 
+	GOTO :EOF
+
+:build/bin/app
+	CALL make.bat main.o
+	CALL make.bat util.o
+	gcc %CFLAGS% -o %OUT%/app main.o util.o
+	GOTO :EOF
+
+:main.o
+	CALL make.bat src/main.c
+	gcc %CFLAGS% -c %SRC%/main.c
+	GOTO :EOF
+
+:util.o
+	CALL make.bat src/util.c
+	gcc %CFLAGS% -c %SRC%/util.c
+	GOTO :EOF
+
+:clean
+	RMDIR /S /Q %OUT% 
+	DEL /Q *.o app.log /F
+	GOTO :EOF
+
+:error
+    IF "%1"=="" (
+        ECHO make: *** No targets specified and no makefile found.  Stop.
+    ) ELSE (
+        ECHO make: *** No rule to make target '%1%'. Stop.
+    )
+    GOTO :EOF
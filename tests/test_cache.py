@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from make_to_batch.cache import ConversionCache
+
+
+class TestConversionCache:
+    def test_fetch_and_store(self, tmp_path):
+        cache = ConversionCache(str(tmp_path / 'cache'))
+        makefile = tmp_path / 'Makefile'
+        makefile.write_text('all:\n')
+        key = cache.key(str(makefile), {})
+        assert key != cache.key(str(makefile), {'option': True})
+
+        output = tmp_path / 'make.bat'
+        assert not cache.fetch(key, str(output))
+        output.write_text('content')
+        cache.store(key, str(output))
+        output.unlink()
+        assert cache.fetch(key, str(output))
+        assert 'content' == output.read_text()
+
+    def test_evict(self, tmp_path):
+        cache = ConversionCache(str(tmp_path / 'cache'), max_size=25)
+        output = tmp_path / 'make.bat'
+        output.write_text('0123456789')
+        for key, age in (('aa', 30), ('bb', 20), ('cc', 10)):
+            cache.store(key, str(output))
+            entry = str(tmp_path / 'cache' / key[:2] / (key + '.bat'))
+            os.utime(entry, (1000 - age, 1000 - age))
+
+        cache.evict()
+        assert not cache.fetch('aa', str(output))
+        assert cache.fetch('bb', str(output))
+        assert cache.fetch('cc', str(output))
+
+        # An entry without its manifest is removed
+        cache.store('dd', str(output))
+        os.remove(str(tmp_path / 'cache/dd/dd.json'))
+        cache.evict()
+        assert not (tmp_path / 'cache/dd/dd.bat').exists()
+        assert cache.fetch('cc', str(output))
+
+    def test_dependencies(self, tmp_path):
+        cache = ConversionCache(str(tmp_path / 'cache'))
+        fragment = tmp_path / 'paths.mk'
+        fragment.write_text('OUT = build\n')
+        output = tmp_path / 'make.bat'
+        output.write_text('content')
+        cache.store('aa', str(output), [str(fragment)])
+        assert cache.fetch('aa', str(output))
+
+        fragment.write_text('OUT = dist\n')
+        assert not cache.fetch('aa', str(output))
+        fragment.unlink()
+        assert not cache.fetch('aa', str(output))
@@ -0,0 +1,174 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from make_to_batch import cli
+
+MAKEFILE = 'all:\n\techo all\n'
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for directory in ('src/a', 'src/b/c', 'src/d'):
+        os.makedirs(str(tmp_path / directory))
+    (tmp_path / 'src/a/Makefile').write_text(MAKEFILE)
+    (tmp_path / 'src/b/c/makefile').write_text(MAKEFILE)
+    (tmp_path / 'src/d/notes.txt').write_text('not a Makefile')
+    return tmp_path
+
+
+class TestCli:
+    def test_single(self, tree):
+        output = str(tree / 'out/make.bat')
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', output]) is None
+        assert ':all\n\techo all\n' in open(output).read()
+
+    def test_missing(self, tree, capsys):
+        assert 1 == cli.run(['-i', str(tree / 'Makefile'), '-o', str(tree / 'make.bat')])
+        assert 'does not exists' in capsys.readouterr().out
+
+    def test_recursive(self, tree):
+        out_dir = tree / 'win'
+        assert cli.run(['--recursive', str(tree / 'src'), '--out-dir', str(out_dir), '-j', '2']) is None
+        assert (out_dir / 'a/make.bat').exists()
+        assert (out_dir / 'b/c/make.bat').exists()
+        assert not (out_dir / 'd').exists()
+
+    def test_errors_do_not_abort(self, tree, capsys):
+        assert 1 == cli.run([str(tree / 'src/a/Makefile'), str(tree / 'missing/Makefile')])
+        assert (tree / 'src/a/make.bat').exists()
+        assert 'missing' in capsys.readouterr().out
+
+    def test_find_makefiles(self, tree):
+        pattern = str(tree / 'src/*/Makefile')
+        assert [str(tree / 'src/a/Makefile')] == list(cli.find_makefiles([pattern]))
+        assert [] == list(cli.find_makefiles([str(tree / 'src')]))
+
+    def test_cache(self, tree, cache_home):
+        makefile = str(tree / 'src/a/Makefile')
+        output = tree / 'make.bat'
+        assert cli.run(['-i', makefile, '-o', str(output)]) is None
+        assert 1 == len(list((cache_home / 'make-to-batch').glob('*/*.bat')))
+
+        output.unlink()
+        assert cli.run(['-i', makefile, '-o', str(output)]) is None
+        assert ':all\n\techo all\n' in output.read_text()
+        assert 1 == len(list((cache_home / 'make-to-batch').glob('*/*.bat')))
+
+        assert cli.run(['-i', makefile, '-o', str(tree / 'other.bat'), '--no-cache']) is None
+        (tree / 'src/a/Makefile').write_text('clean:\n\techo clean\n')
+        assert cli.run(['-i', makefile, '-o', str(output)]) is None
+        assert ':clean\n' in output.read_text()
+        assert 2 == len(list((cache_home / 'make-to-batch').glob('*/*.bat')))
+
+    def test_table(self, tree, capsys):
+        (tree / 'src/a/Makefile').write_text('all:\n\ttouch x\n')
+        table = tree / 'table.json'
+        table.write_text(json.dumps({'touch': {'command': 'TYPE NUL >'}}))
+        output = tree / 'make.bat'
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '--table', str(table)]) is None
+        assert '\tTYPE NUL > x \n' in output.read_text()
+
+        # The cached batch file is not used with another table
+        table.write_text(json.dumps({'touch': {'command': 'COPY NUL'}}))
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '--table', str(table)]) is None
+        assert '\tCOPY NUL x \n' in output.read_text()
+
+        table.write_text('{')
+        assert 1 == cli.run(['-i', str(tree / 'src/a/Makefile'), '--table', str(table)])
+        assert 'not a valid JSON file' in capsys.readouterr().out
+
+    def test_targets(self, tree, capsys):
+        (tree / 'src/a/Makefile').write_text('all: a\n\techo all\na:\n\techo a\nb:\n\techo b\n')
+        output = tree / 'make.bat'
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '--targets', 'a, b']) is None
+        batch = output.read_text()
+        assert ':a\n' in batch and ':b\n' in batch and ':all\n' not in batch
+
+        assert 1 == cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '--targets', 'c'])
+        assert "No rule to make target 'c'" in capsys.readouterr().out
+
+    def test_module(self, tree):
+        command = [sys.executable, '-m', 'make_to_batch', '-i', str(tree / 'missing'), '-o', str(tree / 'make.bat')]
+        assert 1 == subprocess.run(command, stdout=subprocess.DEVNULL).returncode
+
+    def test_shard(self, tree, capsys):
+        (tree / 'src/a/Makefile').write_text('all: a\n\techo all\na:\n\techo a\n')
+        output = tree / 'build.bat'
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '--shard']) is None
+        assert 'SET "_MTB_SHARDS=%~dp0build.d"\n' in output.read_text()
+        assert 'CALL "%_MTB_SHARDS%\\a.bat"\n' in (tree / 'build.d/all.bat').read_text()
+        assert '\techo a\n' in (tree / 'build.d/a.bat').read_text()
+        with pytest.raises(SystemExit):
+            cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '--shard', '--subroutines'])
+        assert 'mutually exclusive' in capsys.readouterr().err
+
+    def test_define(self, tree, capsys):
+        (tree / 'src/a/Makefile').write_text('ifeq ($(MODE),debug)\nall:\n\techo debug\nendif\n')
+        output = tree / 'make.bat'
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output)]) is None
+        assert 'IF "%MODE%"=="debug" echo debug\n' in output.read_text()
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output), '-D', 'MODE=debug']) is None
+        assert 'SET MODE=debug\n' in output.read_text()
+        assert '\techo debug\n' in output.read_text()
+        with pytest.raises(SystemExit):
+            cli.run(['-D', 'MODE'])
+        assert 'invalid definition' in capsys.readouterr().err
+
+    def test_cache_include(self, tree):
+        (tree / 'src/a/Makefile').write_text('include ../common.mk\nall:\n\techo $(OUT)\n')
+        (tree / 'src/common.mk').write_text('OUT = build\n')
+        output = tree / 'make.bat'
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output)]) is None
+        assert 'SET OUT=build\n' in output.read_text()
+
+        (tree / 'src/common.mk').write_text('OUT = dist\n')
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output)]) is None
+        assert 'SET OUT=dist\n' in output.read_text()
+
+    def test_cache_directories(self, tree):
+        # The same Makefile includes different files in different directories
+        for name, out in (('a', 'alpha'), ('b', 'beta')):
+            os.makedirs(str(tree / name), exist_ok=True)
+            (tree / name / 'Makefile').write_text('include common.mk\nall:\n\techo $(OUT)\n')
+            (tree / name / 'common.mk').write_text('OUT = {}\n'.format(out))
+        assert cli.run([str(tree / 'a/Makefile'), str(tree / 'b/Makefile')]) is None
+        assert 'SET OUT=alpha\n' in (tree / 'a/make.bat').read_text()
+        assert 'SET OUT=beta\n' in (tree / 'b/make.bat').read_text()
+
+    def test_cache_wildcard(self, tree, cache_home):
+        (tree / 'src/a/Makefile').write_text('all: $(wildcard *.c)\n\techo all\n')
+        (tree / 'src/a/main.c').write_text('')
+        output = tree / 'make.bat'
+        assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output)]) is None
+        assert 'CALL make.bat main.c\n' in output.read_text()
+        assert [] == list((cache_home / 'make-to-batch').glob('*/*.bat'))
+
+    def test_cache_optional_include(self, tree):
+        for include in ('-include extra.mk', 'include *.mk'):
+            (tree / 'src/a/Makefile').write_text(include + '\nall:\n\techo $(X)\n')
+            output = tree / 'make.bat'
+            assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output)]) is None
+            assert 'SET X=' not in output.read_text()
+
+            (tree / 'src/a/extra.mk').write_text('X = hello\n')
+            assert cli.run(['-i', str(tree / 'src/a/Makefile'), '-o', str(output)]) is None
+            assert 'SET X=hello\n' in output.read_text()
+            (tree / 'src/a/extra.mk').unlink()
+
+    def test_stats(self, tree, capsys):
+        profile = tree / 'profile'
+        assert cli.run(['--recursive', str(tree / 'src'), '--stats', 'json', '--profile', str(profile),
+                        '--no-cache']) is None
+        stats = json.loads(capsys.readouterr().out)
+        assert 2 == stats['counters']['makefiles']
+        assert 'emit' in stats['timings']
+        assert profile.exists()
@@ -0,0 +1,108 @@
+import pytest
+from make_to_batch.conditionals import ConditionalStack, evaluate, split_arguments
+from make_to_batch.makefile import Makefile
+from make_to_batch.variables import VariableTable
+
+MAKEFILE = (
+    'CC = gcc\n'
+    'ifeq ($(CC),gcc)\n'
+    'CFLAGS = -Wall\n'
+    'else\n'
+    'CFLAGS = /W4\n'
+    'endif\n'
+    'ifdef DEBUG\n'
+    'CFLAGS += -g\n'
+    'endif\n'
+    'ifeq ($(OS),Windows_NT)\n'
+    'RM = del\n'
+    'else ifeq "$(OS)" "Darwin"\n'
+    'RM = rm -f\n'
+    'else\n'
+    'RM = rm\n'
+    'endif\n'
+    'all:\n'
+    '\techo $(CFLAGS)\n'
+    'ifneq ($(OS),Windows_NT)\n'
+    '\techo unix\n'
+    'endif\n'
+    '\techo done\n'
+)
+
+
+class TestConditionals:
+    def test_split_arguments(self):
+        assert ('$(A)', 'b') == split_arguments('($(A), b)')
+        assert ('$(subst a,b,$(A))', '') == split_arguments('($(subst a,b,$(A)),)')
+        assert ('a b', 'c') == split_arguments('"a b" \'c\'')
+        with pytest.raises(ValueError):
+            split_arguments('(a b)')
+
+    def test_evaluate(self):
+        variables = VariableTable()
+        variables.assign('A', '=', 'a')
+        variables.assign('EMPTY', '=', '')
+        assert evaluate('ifeq', '($(A),a)', variables) is True
+        assert evaluate('ifneq', '($(A),a)', variables) is False
+        assert evaluate('ifdef', 'A', variables) is True
+        assert evaluate('ifdef', 'EMPTY', variables) is False
+        assert evaluate('ifeq', '($(shell uname),)', variables) is True
+        assert '"%OS%"=="a"' == evaluate('ifeq', '($(OS),$(A))', variables)
+        assert 'NOT "%OS%"=="a"' == evaluate('ifneq', '($(OS),$(A))', variables)
+        assert 'NOT DEFINED HOME' == evaluate('ifndef', 'HOME', variables)
+
+    def test_stack(self):
+        stack = ConditionalStack()
+        stack.enter('DEFINED A', 1)
+        assert stack.live and ('DEFINED A',) == stack.guard
+        stack.alternative(True, 2, False)
+        assert stack.live and ('NOT DEFINED A',) == stack.guard
+        stack.alternative(True, 3, True)
+        assert not stack.live
+        with pytest.raises(ValueError, match='line 4'):
+            stack.alternative(True, 4, True)
+        stack.leave(5)
+        assert stack.live and () == stack.guard
+        stack.enter(False, 6)
+        with pytest.raises(ValueError, match='line 6'):
+            stack.close()
+
+    def test_makefile(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE)
+        batch = makefile.to_batch()
+        assert 'SET CFLAGS=-Wall\n' in batch
+        assert 'W4' not in batch
+        assert ('IF "%OS%"=="Windows_NT" SET RM=del\n'
+                'IF NOT "%OS%"=="Windows_NT" IF "%OS%"=="Darwin" SET RM=rm -f\n'
+                'IF NOT "%OS%"=="Windows_NT" IF NOT "%OS%"=="Darwin" SET RM=rm\n') in batch
+        assert '\techo %CFLAGS%\n\tIF NOT "%OS%"=="Windows_NT" echo unix\n\techo done\n' in batch
+
+    def test_overrides(self):
+        makefile = Makefile(overrides={'DEBUG': '1', 'CC': 'cl'})
+        makefile.parse_file(MAKEFILE)
+        batch = makefile.to_batch()
+        assert 'SET CC=cl\n' in batch
+        assert 'SET CFLAGS=\\W4 -g\n' in batch
+
+    def test_runtime_rules(self):
+        makefile = Makefile()
+        makefile.parse_file(
+            'X = a\n'
+            'ifdef WINDIR\n'
+            'X += b\n'
+            'all: win\n'
+            '\techo win\n'
+            'else\n'
+            'all: unix\n'
+            '\techo unix\n'
+            'endif\n'
+        )
+        batch = makefile.to_batch()
+        assert 'SET X=a\nIF DEFINED WINDIR SET X=%X% b\n' in batch
+        assert (':all\n\tCALL make.bat win\n\tCALL make.bat unix\n'
+                '\tIF DEFINED WINDIR echo win\n\tIF NOT DEFINED WINDIR echo unix\n') in batch
+
+    def test_errors(self):
+        for content in ('ifdef A\n', 'endif\n', 'ifeq (a b)\nendif\n', 'ifdef A\nelse\nelse\nendif\n'):
+            with pytest.raises(ValueError):
+                Makefile().parse_file(content)
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+from make_to_batch.filesystem import DirectoryTree, FileIndex, atomic_file
+
+
+class TestFileIndex:
+    def test_glob(self, tmp_path):
+        for name in ('src/a.c', 'src/b.c', 'src/.c', 'src/notes.txt', 'lib/x.c', 'lib/deep/y.c'):
+            (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / name).write_text('')
+        tree = DirectoryTree(str(tmp_path))
+        assert ['src/a.c', 'src/b.c'] == tree.glob('src/*.c')
+        assert ['./src/a.c'] == tree.glob('./src/a.?')
+        assert ['lib/x.c', 'src/a.c', 'src/b.c'] == tree.glob('*/*.c')
+        assert ['src/notes.txt'] == tree.glob('src/[n]*')
+        assert [] == tree.glob('missing/*.c')
+        assert tree.exists('lib/deep') and tree.exists('src/./a.c') and not tree.exists('src/c.c')
+
+    def test_symbolic_links(self, tmp_path):
+        (tmp_path / 'src').mkdir()
+        (tmp_path / 'src/a.c').write_text('')
+        (tmp_path / 'src/loop').symlink_to(tmp_path, target_is_directory=True)
+        tree = DirectoryTree(str(tmp_path))
+        assert ['src/a.c'] == tree.glob('src/*.c')
+        assert tree.exists('src/loop') and [] == tree.glob('src/loop/*')
+
+    def test_invalidation(self, tmp_path):
+        (tmp_path / 'src').mkdir()
+        index = FileIndex()
+        assert [] == index.tree(str(tmp_path)).glob('src/*.c')
+        assert index.tree(str(tmp_path)) is index.tree(str(tmp_path))
+        (tmp_path / 'src/a.c').write_text('')
+        os.utime(str(tmp_path / 'src'), ns=(0, 0))
+        assert ['src/a.c'] == index.tree(str(tmp_path)).glob('src/*.c')
+        assert 2 == index.misses and 2 == index.hits
+
+
+class TestAtomicFile:
+    def test_atomic_file(self, tmp_path):
+        path = str(tmp_path / 'make.bat')
+        with atomic_file(path) as f:
+            f.write('old')
+        with pytest.raises(RuntimeError):
+            with atomic_file(path) as f:
+                f.write('partial')
+                raise RuntimeError()
+        assert 'old' == (tmp_path / 'make.bat').read_text()
+        assert ['make.bat'] == os.listdir(str(tmp_path))
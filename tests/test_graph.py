@@ -0,0 +1,24 @@
+import pytest
+from make_to_batch.graph import CyclicDependencyError, independent_groups, reachable, topological_order
+
+
+class TestGraph:
+    def test_topological_order(self):
+        graph = {'all': ['prog', 'docs', 'README.md'], 'prog': ['config'], 'docs': ['config'], 'config': []}
+        order = topological_order(graph)
+        assert sorted(graph) == sorted(order)
+        for target, dependencies in graph.items():
+            for dependency in dependencies:
+                if dependency in graph:
+                    assert order.index(dependency) < order.index(target)
+
+    def test_cycle(self):
+        with pytest.raises(CyclicDependencyError) as error:
+            topological_order({'all': ['a'], 'a': ['b'], 'b': ['c'], 'c': ['a']})
+        assert ['a', 'b', 'c', 'a'] == error.value.cycle
+
+    def test_independent_groups(self):
+        graph = {'all': ['a', 'b', 'c', 'd'], 'a': ['config'], 'b': ['config'], 'c': [], 'd': [], 'config': []}
+        assert [['a'], ['b', 'c'], ['d']] == independent_groups(graph, ['a', 'b', 'c', 'd'], 2)
+        assert [['a', 'c', 'd'], ['b']] == independent_groups(graph, ['a', 'c', 'd', 'b'], 4)
+        assert {'a', 'config'} == reachable(graph, 'a')
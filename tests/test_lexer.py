@@ -0,0 +1,39 @@
+import pytest
+from make_to_batch import lexer
+
+
+class TestLexer:
+    def test_tokenize(self):
+        tokens = list(lexer.tokenize([
+            '# A comment\n',
+            'CC := gcc # the compiler\n',
+            'CFLAGS = -O2 \\\n',
+            '\t-Wall\n',
+            'include common.mk\n',
+            '\n',
+            'all: dirs prog ; @echo start\n',
+            '\tgcc -o prog \\\n',
+            '\t\tmain.c\n',
+            '\n',
+            '\techo done\n',
+        ]))
+        kinds = [token.kind for token in tokens]
+        assert kinds == [lexer.VARIABLE, lexer.VARIABLE, lexer.DIRECTIVE,
+                         lexer.RULE, lexer.RECIPE, lexer.RECIPE, lexer.RECIPE]
+
+        assert ('CC', ':=', 'gcc') == tokens[0][2:]
+        assert ('CFLAGS', '=', '-O2 -Wall') == tokens[1][2:]
+        assert ('include', 'common.mk') == (tokens[2].name, tokens[2].value)
+        assert ('all', ':', 'dirs prog') == tokens[3][2:]
+        assert 7 == tokens[3].line
+        assert ['@echo start', 'gcc -o prog main.c', 'echo done'] == [token.value for token in tokens[4:]]
+
+    def test_define(self):
+        tokens = list(lexer.tokenize(['define GREETING\n', 'hello\n', 'world\n', 'endef\n']))
+        assert 1 == len(tokens)
+        assert ('GREETING', '=', 'hello\nworld') == tokens[0][2:]
+
+    def test_recipe_outside_rule(self):
+        tokens = list(lexer.tokenize(['\tCC = gcc\n', 'all:\n', '\techo all\n', 'VAR = 1\n', '\techo no\n']))
+        assert [lexer.VARIABLE, lexer.RULE, lexer.RECIPE, lexer.VARIABLE] == [t.kind for t in tokens]
+
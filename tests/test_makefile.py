@@ -0,0 +1,262 @@
+import io
+import os
+from collections import Counter
+
+import pytest
+from make_to_batch.filesystem import FileIndex
+from make_to_batch.fragments import FragmentCache
+from make_to_batch.graph import CyclicDependencyError
+from make_to_batch.makefile import Makefile
+from make_to_batch.stats import Statistics
+
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden')
+
+MAKEFILE = (
+    'OUT = build/bin\n'
+    '.PHONY: all\n'
+    'all: | dirs\n'
+    '\techo $(OUT)\n'
+    'dirs:\n'
+    '\tmkdir -p $(OUT)\n'
+)
+
+
+class TestMakefile:
+    def test_parse_file(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE)
+        batch = makefile.to_batch()
+        assert 'SET OUT=build\\bin\n' in batch
+        assert ':all\n\tCALL make.bat dirs\n\techo %OUT%\n\tGOTO :EOF\n' in batch
+        assert ':dirs\n\tMKDIR %OUT% \n\tGOTO :EOF\n' in batch
+        assert 'PHONY' not in batch
+
+    def test_streams(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE)
+        streamed = Makefile()
+        streamed.parse_stream(io.StringIO(MAKEFILE))
+
+        output = io.StringIO()
+        streamed.write_batch(output)
+        assert makefile.to_batch() == output.getvalue()
+        assert makefile.to_batch() == ''.join(streamed.iter_batch())
+
+    def test_golden(self, tmp_path):
+        # The batch file of a representative Makefile, byte for byte
+        with open(os.path.join(GOLDEN, 'Makefile'), newline='') as f:
+            content = f.read()
+        with open(os.path.join(GOLDEN, 'make.bat'), newline='') as f:
+            expected = f.read()
+        makefile = Makefile()
+        makefile.parse_file(content)
+        assert expected == makefile.to_batch()
+        assert expected == ''.join(makefile.iter_batch())
+        makefile.save_batch(str(tmp_path / 'make.bat'))
+        assert expected.encode() == (tmp_path / 'make.bat').read_bytes().replace(os.linesep.encode(), b'\n')
+
+    def test_goto_dispatch(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE)
+        batch = makefile.to_batch(dispatch='goto')
+        assert 'IF /I' not in batch
+        assert 'SET "_MTB_TARGETS_0= all dirs "\n' in batch
+        assert 'GOTO %~1\nGOTO error\n' in batch
+        assert batch.split('\n\n', 3)[3] == makefile.to_batch().split('\n\n', 3)[3]
+
+        with pytest.raises(ValueError):
+            makefile.to_batch(dispatch='switch')
+
+    def test_once(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE + 'prog/main: dirs\n\tgcc\n')
+        batch = makefile.to_batch(once=True)
+        assert batch.startswith('@echo off\n\nIF /I "%_MTB_BUILD%"=="%~f0" GOTO _mtb_start\nSETLOCAL\n'
+                                'SET "_MTB_BUILD=%~f0"\n')
+        # The batch file of another Makefile forgets the targets already run
+        assert '''FOR /F "delims==" %%V IN ('SET _MTB_DONE_ 2^>NUL') DO SET "%%V="\n''' in batch
+        assert ':dirs\n\tIF DEFINED _MTB_DONE_dirs GOTO :EOF\n\tSET "_MTB_DONE_dirs=1"\n' in batch
+        assert 'IF DEFINED _MTB_DONE_prog_2F_main GOTO :EOF' in batch
+
+        makefile.parse_file('dirs: all\n')
+        with pytest.raises(CyclicDependencyError):
+            makefile.to_batch(once=True)
+
+    def test_subroutines(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE + 'prog: dirs main.c\n\t$(MAKE) all\n\t$(MAKE) -C sub all\n')
+        batch = makefile.to_batch(subroutines=True)
+        assert ''' DO SET "%%V="\nSET OUT=build\\bin\n\n:_mtb_start\n''' in batch
+        assert ':prog\n\tCALL :dirs\n\tCALL :all\n\tCALL make.bat -C sub all\n' in batch
+        assert 'CALL make.bat dirs' not in batch
+
+        # The invocations after a change of directory run another batch file
+        makefile.parse_file('all: dirs\n\tcd lib && $(MAKE) all\n\tcd lib; $(MAKE) dirs\n')
+        batch = makefile.to_batch(subroutines=True)
+        assert ':all\n\tCALL :dirs\n\tPUSHD lib && CALL make.bat all && POPD\n' in batch
+        assert '\tPUSHD lib & CALL make.bat dirs && POPD\n' in batch
+
+    def test_incremental(self):
+        makefile = Makefile()
+        makefile.parse_file(MAKEFILE + 'out/prog: main.c dirs\n\tgcc\nrelease: all\n\tzip\n')
+        assert frozenset(['all']) == makefile.phony
+        batch = makefile.to_batch(incremental=True)
+        assert (':out/prog\n\tCALL make.bat main.c\n\tCALL make.bat dirs\n'
+                '\tSET "_MTB_STALE="\n\tIF NOT EXIST "out\\prog" SET "_MTB_STALE=1"\n'
+                '\tIF NOT DEFINED _MTB_STALE CALL :_mtb_newer "out\\prog" "main.c"\n'
+                '\tIF NOT DEFINED _MTB_STALE CALL :_mtb_newer "out\\prog" "dirs"\n'
+                '\tIF NOT DEFINED _MTB_STALE GOTO :EOF\n\tgcc\n') in batch
+        assert ':all\n\tCALL make.bat dirs\n\techo' in batch
+        assert ':release\n\tCALL make.bat all\n\tzip\n' in batch
+        assert ':_mtb_newer\n' in batch
+
+    def test_jobs(self):
+        makefile = Makefile()
+        makefile.parse_file('all: a b c\n\techo all\na:\n\techo a\nb:\n\techo b\nc: a\n\techo c\n')
+        batch = makefile.to_batch(jobs=2)
+        assert 'IF "%~1"=="_mtb_job" GOTO _mtb_job\n' in batch
+        assert (':all\n\tSET "_MTB_JOB=%TEMP%\\_mtb_%RANDOM%%RANDOM%"\n\tSET "_MTB_FAILED="\n'
+                '\tSTART "" /B CMD /C CALL "%~f0" _mtb_job "%_MTB_JOB%_0" a\n'
+                '\tSTART "" /B CMD /C CALL "%~f0" _mtb_job "%_MTB_JOB%_1" b\n'
+                '\tCALL :_mtb_wait "%_MTB_JOB%_0" "%_MTB_JOB%_1"\n'
+                '\tIF DEFINED _MTB_FAILED EXIT /B 1\n'
+                '\tCALL make.bat c\n\techo all\n') in batch
+        assert ':_mtb_wait\n' in batch
+
+    def test_include(self, tmp_path):
+        (tmp_path / 'mk').mkdir()
+        (tmp_path / 'mk/paths.mk').write_text('OUT = build\ninclude tools.mk\n')
+        (tmp_path / 'mk/tools.mk').write_text('CC = gcc\nclean:\n\trm -rf $(OUT)\n')
+        fragments = FragmentCache()
+        for _ in range(2):
+            makefile = Makefile(fragments=fragments)
+            makefile.parse_file('MK = mk\ninclude $(MK)/paths.mk\n-include missing.mk\nall:\n\t$(CC) main.c\n',
+                                str(tmp_path))
+            batch = makefile.to_batch()
+            assert 'SET OUT=build\nSET CC=gcc\n' in batch
+            assert ':clean\n\tRMDIR /S /Q %OUT% \n' in batch
+            assert ':all\n\t%CC% main.c\n' in batch
+            assert [str(tmp_path / 'mk/paths.mk'), str(tmp_path / 'mk/tools.mk')] == makefile.included
+        assert 2 == fragments.misses and 2 == fragments.hits
+
+        with pytest.raises(FileNotFoundError):
+            Makefile(fragments=fragments).parse_file('include missing.mk\n', str(tmp_path))
+        (tmp_path / 'mk/tools.mk').write_text('include paths.mk\n')
+        with pytest.raises(ValueError):
+            Makefile(fragments=fragments).parse_file('include mk/paths.mk\n', str(tmp_path))
+
+    def test_stats(self):
+        stats = Statistics()
+        makefile = Makefile(stats=stats)
+        makefile.parse_file(MAKEFILE)
+        plain = Makefile()
+        plain.parse_file(MAKEFILE)
+        assert plain.to_batch() == makefile.to_batch()
+        assert {'makefiles': 1, 'lines': 6, 'rules': 2, 'recipe lines': 2, 'variables': 1,
+                'translated commands': 1, 'passthrough commands': 1} == stats.counters
+        assert {'mkdir': 1} == dict(stats.programs)
+        assert all(seconds >= 0 for seconds in stats.timings.values())
+
+        plain.passthrough = Counter()
+        assert plain.to_batch() == makefile.to_batch()
+        assert {'echo': 1} == plain.passthrough
+
+    def test_patterns(self, tmp_path):
+        (tmp_path / 'src').mkdir()
+        for name in ('src/a.c', 'src/b.c', 'src/x.s'):
+            (tmp_path / name).write_text('')
+        makefile = Makefile(files=FileIndex())
+        makefile.parse_file('SRC = $(wildcard src/*.c)\n'
+                            'prog: src/a.o src/x.o src/*.c\n'
+                            '\tgcc -o $@ $(SRC)\n'
+                            '%.o: %.c\n'
+                            '\tgcc -c $< -o $@\n'
+                            '%.o: %.s\n'
+                            '\tas $< -o $@\n'
+                            'src/a.o: src/a.h\n', str(tmp_path))
+        assert makefile.depends_on_files
+        assert {'prog': ['src/a.o', 'src/x.o'], 'src/a.o': [], 'src/x.o': []} == makefile.dependency_graph()
+        batch = makefile.to_batch()
+        assert 'SET SRC=src\\a.c src\\b.c\n' in batch
+        assert ('CALL make.bat src/a.o\n\tCALL make.bat src/x.o\n\tCALL make.bat src/a.c\n'
+                '\tCALL make.bat src/b.c\n') in batch
+        assert ':src/a.o\n\tCALL make.bat src/a.c\n\tCALL make.bat src/a.h\n\tgcc -c src/a.c -o src/a.o\n' in batch
+        assert '\tas src/x.s -o src/x.o\n' in batch
+        assert ':%.o' not in batch and ':src/b.o' not in batch
+
+    def test_targets(self):
+        makefile = Makefile()
+        makefile.parse_file('CC = gcc\n'
+                            'CFLAGS = -O2\n'
+                            'FLAGS = $(CFLAGS) -Wall\n'
+                            'DOC = doxygen\n'
+                            'all: build test docs\n'
+                            'build: main.o\n'
+                            '\t$(CC) $(FLAGS) -o main main.o\n'
+                            'main.o:\n'
+                            '\techo compile\n'
+                            'test:\n'
+                            '\t$(MAKE) -s build\n'
+                            '\t./main\n'
+                            'docs:\n'
+                            '\t$(DOC)\n')
+        batch = makefile.to_batch(targets=['test'])
+        assert ':test\n' in batch and ':build\n' in batch and ':main.o\n' in batch
+        assert ':all\n' not in batch and ':docs\n' not in batch and '"docs"' not in batch
+        assert 'SET CC=gcc\nSET CFLAGS=-O2\nSET FLAGS=-O2 -Wall\n' in batch
+        assert 'DOC' not in batch
+        assert makefile.to_batch(targets=['all', 'docs']) == makefile.to_batch()
+        with pytest.raises(ValueError):
+            makefile.to_batch(targets=['install'])
+
+    def test_share_recipes(self):
+        makefile = Makefile()
+        makefile.parse_file('all: a.txt b.txt c.txt\n'
+                            'a.txt:\n\tcp template/header.txt a.txt\n\techo generated >> a.txt\n'
+                            'b.txt:\n\tcp template/header.txt b.txt\n\techo generated >> b.txt\n'
+                            'c.txt:\n\tcp template/header.txt c.txt\n\techo generated > c.txt.log\n'
+                            'd:\n\techo a long recipe without the target\n'
+                            'e:\n\techo a long recipe without the target\n')
+        batch = makefile.to_batch(share_recipes=True)
+        assert ':a.txt\n\tCALL :_mtb_recipe_0 "a.txt"\n\tGOTO :EOF\n' in batch
+        assert ':b.txt\n\tCALL :_mtb_recipe_0 "b.txt"\n' in batch
+        assert ':c.txt\n\tXCOPY /Y template/header.txt c.txt' in batch
+        assert ':d\n\tCALL :_mtb_recipe_1\n' in batch and ':e\n\tCALL :_mtb_recipe_1\n' in batch
+        assert ':_mtb_recipe_0\n\tXCOPY /Y template/header.txt %~1 \n\techo generated >>%~1\n\tGOTO :EOF\n' in batch
+        assert batch.count('echo a long recipe') == 1
+        assert makefile.to_batch() != batch
+
+    def test_shards(self, tmp_path):
+        makefile = Makefile()
+        makefile.parse_file('all: src/main.o con\n'
+                            '\techo all\n'
+                            'src/main.o:\n'
+                            '\t$(MAKE) con\n'
+                            'con: missing\n'
+                            '\techo con\n')
+        files = dict(makefile.iter_shards(once=True))
+        assert sorted(files) == ['', 'make.d/all.bat', 'make.d/src/main.o.bat']
+        dispatcher = files['']
+        assert 'SET "_MTB_SHARDS=%~dp0make.d"\n' in dispatcher
+        assert 'CALL "%_MTB_SHARDS%\\all.bat"\n' in dispatcher
+        assert ':con\n\tIF DEFINED _MTB_DONE_con GOTO :EOF\n' in dispatcher
+        assert 'missing' not in dispatcher
+        assert ('\tCALL "%_MTB_SHARDS%\\src\\main.o.bat"\n\tCALL "%_MTB_MAKE%" con\n\techo all\n'
+                in files['make.d/all.bat'])
+        assert '\tCALL "%_MTB_MAKE%" con\n' in files['make.d/src/main.o.bat']
+        with pytest.raises(ValueError):
+            list(makefile.iter_shards(jobs=2))
+        with pytest.raises(ValueError):
+            list(makefile.iter_shards(subroutines=True))
+        collision = Makefile()
+        collision.parse_file('Build:\n\techo Build\nbuild:\n\techo build\n')
+        with pytest.raises(ValueError):
+            collision.save_shards(str(tmp_path / 'collision.bat'))
+        assert not (tmp_path / 'collision.d').exists()
+
+        (tmp_path / 'make.d').mkdir()
+        (tmp_path / 'make.d/old.bat').write_text('')
+        written = makefile.save_shards(str(tmp_path / 'make.bat'))
+        assert written[0] == str(tmp_path / 'make.bat')
+        assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob('*.bat')) == [
+            'make.bat', 'make.d/all.bat', 'make.d/src/main.o.bat']
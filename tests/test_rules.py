@@ -0,0 +1,62 @@
+import sys
+
+from make_to_batch.rules import PatternRule, RuleTable, instantiate, pattern_stem
+
+
+class TestRuleTable:
+    def test_rules(self):
+        rules = RuleTable()
+        rules.add('all', ['a', 'b'], ['echo all'])
+        a = rules.add('a', ['b'], ['echo a', 'echo again'])
+        rules.add('b', [], [])
+        rules.extend_recipe(a, ['echo more'])
+        assert ['all', 'a', 'b'] == list(rules)
+        assert 3 == len(rules) and 3 == len(rules.symbols)
+        assert ['echo a', 'echo again', 'echo more'] == rules.get('a').commands
+        assert ['b'] == rules.prerequisites(rules.get('a'))
+        assert [] == rules.get('b').commands
+
+        rules.add('all', ['b'], ['echo all'])
+        assert ['all', 'a', 'b'] == list(rules)
+        assert ['b'] == rules.prerequisites(rules.get('all'))
+        rules.remove('a')
+        assert 'a' not in rules and rules.get('a') is None
+        assert 'a' in rules.symbols
+        rules.add('a', [], [])
+        assert ['all', 'b', 'a'] == list(rules)
+        rules.add('c', [], [], rules.index('all') + 1)
+        assert ['all', 'c', 'b', 'a'] == list(rules)
+        assert 1 == rules.index('c')
+
+    def test_shared_recipes(self):
+        rules = RuleTable()
+        rules.add('x.o', ['x.c'], ['$(CC) -c $<'])
+        rules.add('y.o', ['y.c'], ['$(CC) -c $<'])
+        assert rules.get('x.o').recipe is rules.get('y.o').recipe
+
+
+    def test_replaced_rules(self):
+        rules = RuleTable()
+        for target in 'abc':
+            rules.add(target, ['x', 'y'], ['echo ' + target])
+        size = sys.getsizeof(rules)
+        # As while watching a Makefile, the rules are replaced over and over
+        for index in range(1000):
+            rules.add('a', ['x', 'y'], ['echo a {}'.format(index)])
+            rules.remove('b')
+            rules.add('b', ['y', 'x'], ['echo b {}'.format(index)])
+        assert ['a', 'c', 'b'] == list(rules)
+        assert ['y', 'x'] == rules.prerequisites(rules.get('b'))
+        assert ['x', 'y'] == rules.prerequisites(rules.get('c'))
+        assert ['echo a 999'] == rules.get('a').commands
+        assert sys.getsizeof(rules) < size + 1024
+
+
+class TestPatternRules:
+    def test_instantiate(self):
+        assert 'src/a' == pattern_stem('%.o', 'src/a.o')
+        assert pattern_stem('%.o', '.o') is None and pattern_stem('lib%.a', 'x.a') is None
+        rule = PatternRule('%.o', ['%.c'], ['gcc -c $< -o $@ # $*', 'echo $^ $$@'])
+        prerequisites, recipe = instantiate(rule, 'a.o', 'a', ['a.h', 'a.c'])
+        assert ['a.c', 'a.h', 'a.c'] == prerequisites
+        assert ['gcc -c a.c -o a.o # a', 'echo a.c a.h $$@'] == recipe
@@ -0,0 +1,71 @@
+import io
+import json
+import os
+import socket
+import threading
+
+import pytest
+from make_to_batch import cli
+from make_to_batch.serve import Server
+
+MAKEFILE = 'all:\n\tmkdir build\n\tgcc -c x.c\n'
+
+
+class TestServer:
+    def test_makefile(self):
+        response = Server().handle({'id': 7, 'makefile': MAKEFILE, 'options': {'dispatch': 'goto'}})
+        assert 7 == response['id'] and response['ok']
+        assert 'MKDIR build' in response['batch']
+        assert response['batch'] != Server().handle({'makefile': MAKEFILE})['batch']
+        assert [{'level': 'warning', 'message': "'gcc' has no batch equivalent: 1 command was copied as it is."}] \
+            == response['diagnostics']
+
+    def test_paths(self, tmp_path):
+        (tmp_path / 'Makefile').write_text(MAKEFILE)
+        output = tmp_path / 'out/make.bat'
+        response = Server().handle({'input': str(tmp_path / 'Makefile'), 'output': str(output)})
+        assert response['ok'] and 'batch' not in response
+        assert 'MKDIR build' in output.read_text()
+
+    def test_errors(self, tmp_path):
+        server = Server()
+        for request in ({'input': str(tmp_path / 'Makefile')}, {'makefile': MAKEFILE, 'options': {'jobs': 2}},
+                        {'makefile': MAKEFILE, 'defines': {'A': 1}}, {}):
+            response = server.handle(request)
+            assert not response['ok'] and 'error' == response['diagnostics'][0]['level']
+        assert not json.loads(server.handle_line('[1, 2]'))['ok']
+        assert not json.loads(server.handle_line('{"makefile":'))['ok']
+        # The server still works after the errors
+        assert server.handle({'makefile': MAKEFILE})['ok']
+        assert 7 == server.requests
+
+    def test_stream(self):
+        requests = io.StringIO('{"id": 1, "makefile": "a:\\n\\techo a\\n"}\n\n{"id": 2, "makefile": "b:\\n"}\n')
+        responses = io.StringIO()
+        Server().serve_stream(requests, responses)
+        assert [1, 2] == [json.loads(line)['id'] for line in responses.getvalue().splitlines()]
+
+    @pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="Unix sockets are not supported")
+    def test_socket(self, tmp_path):
+        path = str(tmp_path / 'server.sock')
+        server = threading.Thread(target=Server().serve_socket, args=(path, 1))
+        server.start()
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        for _ in range(100):
+            try:
+                client.connect(path)
+                break
+            except OSError:
+                server.join(0.01)
+        with client, client.makefile('rw', encoding='utf-8', newline='\n') as stream:
+            stream.write(json.dumps({'id': 'x', 'makefile': MAKEFILE}) + '\n')
+            stream.flush()
+            assert 'x' == json.loads(stream.readline())['id']
+            client.shutdown(socket.SHUT_WR)
+        server.join(5)
+        assert not server.is_alive() and not os.path.exists(path)
+
+    def test_cli(self, monkeypatch, capsys):
+        monkeypatch.setattr('sys.stdin', io.StringIO(json.dumps({'makefile': MAKEFILE}) + '\n'))
+        assert cli.run(['serve']) is None
+        assert json.loads(capsys.readouterr().out)['ok']
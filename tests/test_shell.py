@@ -0,0 +1,33 @@
+import pytest
+from make_to_batch import shell
+
+
+class TestShell:
+    def test_tokenize(self):
+        assert [('word', 'a'), ('word', '"b  c"'), ('redirection', '2>& 1'), ('redirection', '>> log'),
+                ('operator', '|'), ('word', 'grep'), ('word', "'x;y'"), ('operator', '||'), ('word', 'b')] == \
+            shell.tokenize('a  "b  c" 2>&1 >> log | grep \'x;y\' || b')
+        assert [('word', 'echo'), ('word', '$(patsubst %.c, %.o, $(SRC))')] == \
+            shell.tokenize('echo $(patsubst %.c, %.o, $(SRC))')
+        assert [('word', 'echo'), ('word', 'x$(a $(b $(c $(d))))y')] == shell.tokenize('echo x$(a $(b $(c $(d))))y')
+
+    def test_parse(self):
+        tree = shell.parse('cd dir && rm -f a | sort > out; echo done')
+        assert ('&&', ';') == tree.operators
+        assert 3 == len(tree.pipelines)
+        pipe = tree.pipelines[1]
+        assert ('rm', '-f', 'a') == pipe.commands[0].words
+        assert (shell.Redirection('>', 'out'),) == pipe.commands[1].redirections
+        assert shell.parse('a; b;').operators == (';',)
+
+    def test_memo(self):
+        assert shell.parse('ls -l') is shell.parse('ls -l')
+
+    def test_syntax_error(self):
+        for command in ('echo "x', 'a >', '| a', 'a && && b', 'echo $(a'):
+            with pytest.raises(shell.ShellSyntaxError):
+                shell.parse(command)
+
+    def test_split_words(self):
+        assert ['cp', '"a b"', 'c'] == shell.split_words('cp "a b" c > log')
+        assert ['a', 'b'] == shell.split_words(' a\tb ')
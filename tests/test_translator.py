@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+from make_to_batch import look_up_table
+from make_to_batch.translator import CommandTranslator
+
+
+class TestCommandTranslator:
+    def test_translate(self):
+        translator = CommandTranslator()
+        assert 'MKDIR %OUT% ' == translator.translate('mkdir -p $(OUT)')
+        assert 'PUSHD dir && DEL /Q a /F && POPD' == translator.translate('cd dir && rm -f a')
+        assert 'CALL make.bat clean' == translator.translate('$(MAKE) clean')
+        assert 'gcc -o %OUT%' == translator.translate('gcc -o ${OUT}')
+
+    def test_memo(self):
+        translator = CommandTranslator(cache_size=2)
+        for command in ('ls -l', 'ls -l', 'rm a', 'ls -l', 'echo 1', 'rm a'):
+            translator.translate(command)
+        info = translator.cache_info()
+        assert 2 == info.hits
+        assert 4 == info.misses
+        assert 2 == info.currsize
+
+    def test_table(self):
+        translator = CommandTranslator({'touch': {'command': 'TYPE NUL >', 'options': {}}})
+        assert 'TYPE NUL > file ' == translator.translate('touch file')
+        assert 'mkdir -p dir' == translator.translate('mkdir -p dir')
+
+    def test_syntax(self):
+        translator = CommandTranslator()
+        assert 'DEL /Q a /F || echo no' == translator.translate('rm -f a || echo no')
+        assert 'DIR   >NUL 2>&1' == translator.translate('ls >/dev/null 2>&1')
+        assert 'XCOPY /Y "a b" c ' == translator.translate('cp "a b" c')
+        assert 'echo "x' == translator.translate('echo "x')
+        program, = translator.translate_with_programs('sort a | uniq')[1][:1]
+        assert ('sort', False) == program
+
+    def test_combined_flags(self):
+        translator = CommandTranslator()
+        # DEL /S would leave the directories
+        assert 'RMDIR /S /Q build ' == translator.translate('rm -rf build')
+        assert 'RMDIR /S /Q build ' == translator.translate('rm --recursive build')
+        assert 'DEL /Q a /F' == translator.translate('rm -f a')
+        assert 'XCOPY /Y a b /E /I' == translator.translate('cp -r a b')
+        # Unknown flags leave the whole option as it is
+        assert 'DEL /Q a -rx' == translator.translate('rm -rx a')
+
+
+class TestLookUpTables:
+    def test_read(self, tmp_path):
+        (tmp_path / 'a.json').write_text(json.dumps({'touch': {'command': 'TYPE NUL >'}}))
+        (tmp_path / 'b.toml').write_text('[rm]\ncommand = "ERASE"\n[rm.options]\n"-v" = "/P"\n')
+        paths = [str(tmp_path / 'a.json'), str(tmp_path / 'b.toml')]
+        translator = CommandTranslator(compiled=look_up_table.load_tables(paths))
+        assert 'TYPE NUL > file ' == translator.translate('touch file')
+        assert 'ERASE a /P /F' == translator.translate('rm -vf a')
+
+        (tmp_path / 'bad.json').write_text(json.dumps({'touch': {'options': {}}}))
+        with pytest.raises(ValueError):
+            look_up_table.read_table(str(tmp_path / 'bad.json'))
+
+    def test_content_type(self):
+        from make_to_batch.look_up_table import LookUpTableContent
+        assert LookUpTableContent is not None
+
+    def test_cache(self, tmp_path):
+        path = tmp_path / 'table.json'
+        path.write_text(json.dumps({'touch': {'command': 'TYPE NUL >'}}))
+        cache = str(tmp_path / 'cache')
+        assert 'touch' in look_up_table.load_tables([str(path)], cache)
+        assert 1 == len(os.listdir(os.path.join(cache, 'tables')))
+
+        path.write_text(json.dumps({'wc': {'command': 'FIND /C /V ""'}}))
+        os.utime(str(path), (1, 1))
+        compiled = look_up_table.load_tables([str(path)], cache)
+        assert 'wc' in compiled and 'touch' not in compiled and 'rm' in compiled
@@ -0,0 +1,63 @@
+import pytest
+from make_to_batch.makefile import Makefile
+from make_to_batch.variables import RecursiveVariableError, VariableTable
+
+
+class TestVariableTable:
+    def test_flavors(self):
+        table = VariableTable()
+        table.assign('A', '=', '$(B) a')
+        table.assign('C', ':=', '$(B) c')
+        table.assign('B', '=', 'b')
+        table.assign('B', '?=', 'ignored')
+        table.assign('B', '+=', 'more')
+        assert ('b more a', True) == table.resolve('A')
+        assert ('$(B) c', False) == table.resolve('C')
+
+        table.assign('D', '=', '$(HOME)/$(A) $$PATH $@')
+        assert ('$(HOME)/b more a $PATH $@', False) == table.resolve('D')
+        table.assign('E', '=', '$(patsubst %.c,%.o,$(A)) ${B}')
+        assert ('$(patsubst %.c,%.o,b more a) b more', False) == table.resolve('E')
+
+    def test_nested(self):
+        table = VariableTable()
+        table.assign('MODE', '=', 'release')
+        table.assign('FLAGS_release', '=', '-O2')
+        table.assign('FLAGS', '=', '$(FLAGS_$(MODE))')
+        assert ('-O2', True) == table.resolve('FLAGS')
+
+    def test_cycle(self):
+        table = VariableTable()
+        table.assign('A', '=', '$(B)')
+        table.assign('B', '=', '$(A)')
+        with pytest.raises(RecursiveVariableError):
+            table.resolve('A')
+        with pytest.raises(RecursiveVariableError):
+            list(table.resolved_items())
+
+    def test_resolved_items(self):
+        table = VariableTable()
+        table.assign('A', '=', '$(C)/a')
+        table.assign('B', '=', 'b')
+        table.assign('C', '=', '$(HOME)')
+        assert [('C', '$(HOME)', False), ('A', '$(HOME)/a', False), ('B', 'b', True)] == list(table.resolved_items())
+
+
+class TestMakefileVariables:
+    def test_functions(self):
+        variables = VariableTable({'upper': str.upper})
+        variables.assign('A', '=', 'x $(upper a $(B)) $(shell ls)')
+        variables.assign('B', '=', 'b')
+        assert ('x A B $(shell ls)', False) == variables.resolve('A')
+
+    def test_inline(self):
+        makefile = Makefile()
+        makefile.parse_file('OUT = build\nBIN = $(OUT)/bin\nTMP = $(TEMP)/x\nall:\n\techo $(BIN) $(TMP)\n')
+        batch = makefile.to_batch()
+        assert 'SET OUT=build\nSET BIN=build\\bin\nSET TMP=%TEMP%\\x\n' in batch
+        assert '\techo %BIN% %TMP%\n' in batch
+
+        batch = makefile.to_batch(inline_variables=True)
+        assert 'SET OUT' not in batch
+        assert 'SET TMP=%TEMP%\\x\n' in batch
+        assert '\techo build\\bin %TEMP%\\x\n' in batch
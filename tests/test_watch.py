@@ -0,0 +1,79 @@
+import os
+
+import pytest
+from make_to_batch import cli
+from make_to_batch.makefile import Makefile
+from make_to_batch.watch import FULL, INCREMENTAL, Watcher
+
+MAKEFILE = 'CC = gcc\n\nall: a b\n\techo all\n\na: x\n\t$(CC) -o a x\n\nb:\n\techo b\n\nx:\n\techo x\n'
+
+
+@pytest.fixture
+def makefile(tmp_path):
+    path = tmp_path / 'Makefile'
+    mtime = [0]
+
+    def write(content):
+        # Each version gets a new modification time, however fast it is written
+        path.write_text(content)
+        mtime[0] += 1
+        os.utime(str(path), (mtime[0], mtime[0]))
+
+    write(MAKEFILE)
+    return write
+
+
+def convert(watcher):
+    makefile = Makefile()
+    with open(watcher.input_path) as f:
+        makefile.parse_stream(f, os.path.dirname(watcher.input_path))
+    return makefile.to_batch(**watcher.options)
+
+
+class TestWatcher:
+    def test_updates(self, tmp_path, makefile):
+        output = tmp_path / 'make.bat'
+        watcher = Watcher(str(tmp_path / 'Makefile'), str(output), {'once': True})
+        assert FULL == watcher.update()
+        assert not watcher.changed() and watcher.update() is None
+
+        versions = [
+            (MAKEFILE.replace('echo b', 'echo c'), INCREMENTAL),
+            (MAKEFILE.replace('b:\n', 'c:\n\techo c\n\nb:\n'), INCREMENTAL),
+            (MAKEFILE.replace('\nb:\n\techo b\n', ''), INCREMENTAL),
+            (MAKEFILE + '\ny:\n\techo y\n', INCREMENTAL),
+            (MAKEFILE.replace('a: x', 'a: x y') + '\ny:\n\techo y\n', INCREMENTAL),
+            (MAKEFILE.replace('gcc', 'clang'), FULL),
+            (MAKEFILE.replace('a: x', 'a: x\nCFLAGS = -O2'), FULL),
+            (MAKEFILE.replace('b:', '%.o: %.c'), FULL),
+        ]
+        for content, kind in versions:
+            makefile(content)
+            assert watcher.changed()
+            assert kind == watcher.update()
+            assert convert(watcher) == output.read_text()
+
+    def test_includes(self, tmp_path, makefile):
+        (tmp_path / 'rules.mk').write_text('y:\n\techo y\n')
+        makefile('include rules.mk\n' + MAKEFILE)
+        watcher = Watcher(str(tmp_path / 'Makefile'), str(tmp_path / 'make.bat'), {})
+        assert FULL == watcher.update()
+
+        (tmp_path / 'rules.mk').write_text('y:\n\techo changed\n')
+        os.utime(str(tmp_path / 'rules.mk'), (100, 100))
+        assert FULL == watcher.update()
+        assert 'echo changed' in (tmp_path / 'make.bat').read_text()
+
+    def test_errors(self, tmp_path):
+        watcher = Watcher(str(tmp_path / 'Makefile'), str(tmp_path / 'make.bat'), {})
+        with pytest.raises(FileNotFoundError):
+            watcher.update()
+        assert not watcher.changed()
+        (tmp_path / 'Makefile').write_text(MAKEFILE)
+        assert FULL == watcher.update()
+
+    def test_cli(self, tmp_path, makefile, capsys):
+        output = tmp_path / 'out/make.bat'
+        cli.watch([(str(tmp_path / 'Makefile'), str(output))], {}, 0.01, max_rounds=2)
+        assert convert(Watcher(str(tmp_path / 'Makefile'), str(output), {})) == output.read_text()
+        assert 1 == capsys.readouterr().out.count('full update')